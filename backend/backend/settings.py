@@ -1,12 +1,22 @@
 from pathlib import Path
 from datetime import timedelta
 import os
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv   # ← add this
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 load_dotenv(BASE_DIR / '.env')   # ← add this
 
+
+def _env_overrides(**variables):
+    """Integer entries for a store config dict, from whichever ``variables`` are set.
+
+    Each store module keeps its defaults in ``DEFAULTS`` and merges its settings dict
+    over them, so settings only carry overrides.
+    """
+    return {key: int(os.environ[name]) for key, name in variables.items() if name in os.environ}
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -77,12 +87,65 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default; setting DB_NAME switches to PostgreSQL (production).
+if os.environ.get('DB_NAME'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ['DB_NAME'],
+            'USER': os.environ.get('DB_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Keep each worker thread's connection open between requests and
+            # check it is still alive before reusing it.
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),     # seconds; 0 closes per request
+            'CONN_HEALTH_CHECKS': True,
+            # Transaction-mode PgBouncer can't hold server-side cursors open
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER', '') == 'pgbouncer',
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+                'sslmode': os.environ.get('DB_SSLMODE', 'prefer'),
+                'application_name': 'phoneplace',
+            },
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+
+# Read replicas (see store/routing.py): DB_REPLICA_HOSTS lists PostgreSQL
+# replica hosts sharing the primary's credentials; SQLITE_REPLICAS lists
+# replica files for trying routing locally (kept fresh by replica_heartbeat).
+if os.environ.get('DB_NAME'):
+    _replicas = [
+        {**DATABASES['default'], 'HOST': host}
+        for host in filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))
+    ]
+else:
+    _replicas = [
+        {**DATABASES['default'], 'NAME': BASE_DIR / path}
+        for path in filter(None, os.environ.get('SQLITE_REPLICAS', '').split(','))
+    ]
+for _n, _replica in enumerate(_replicas, 1):
+    DATABASES[f'replica_{_n}'] = {**_replica, 'TEST': {'MIRROR': 'default'}}
+if _replicas:
+    DATABASE_ROUTERS = ['store.routing.ReplicaRouter']
+    # Outside the session middleware, so session writes pin the browser too.
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('django.contrib.sessions.middleware.SessionMiddleware'),
+        'store.routing.ReplicaPinningMiddleware',
+    )
+# Overrides store/routing.py DEFAULTS (lag limit, pin time).
+READ_REPLICAS = _env_overrides(MAX_LAG='DB_REPLICA_MAX_LAG')
+
+# WAL, synchronous=NORMAL, mmap and a busy timeout on every SQLite connection
+# (see store/sqlite.py). Opt-in for single-node SQLite deployments.
+SQLITE_PERFORMANCE_PROFILE = os.environ.get('SQLITE_PERFORMANCE_PROFILE', '') == '1'
 
 
 # Password validation
@@ -106,7 +169,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'store.authentication.StatelessJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -126,6 +189,7 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
+JWT_USER_CACHE_TTL = 60   # Seconds a user's active flag is trusted without a query
 
 # ──────────────────────────────────────────────
 # CORS 
@@ -138,6 +202,39 @@ CORS_ALLOWED_ORIGINS = [
     os.environ.get('FRONTEND_URL', 'https://phoneplacekenya.com'),
 ]
 CORS_ALLOW_CREDENTIALS = True
+# Checkout and STK push send Idempotency-Key; replays are flagged in Idempotent-Replayed.
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
+
+# ──────────────────────────────────────────────
+# Cache
+# ──────────────────────────────────────────────
+# Set REDIS_URL in production so every gunicorn worker shares one cache;
+# without it each process keeps its own in-memory cache.
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Idempotency-Key replay window and how long a duplicate waits on the original
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 60 * 60))          # seconds
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', 90))   # seconds
+
+# Login attempts allowed per sliding window before lockout. Overrides store/throttles.py DEFAULTS.
+LOGIN_THROTTLE = _env_overrides(IP_LIMIT='LOGIN_IP_LIMIT', IDENTIFIER_LIMIT='LOGIN_IDENTIFIER_LIMIT')
+# Reverse proxies in front of Django. The per-IP limit trusts only the X-Forwarded-For
+# hop they append; 0 uses REMOTE_ADDR, so a client-supplied header never picks the bucket.
+REST_FRAMEWORK['NUM_PROXIES'] = int(os.environ.get('NUM_PROXIES', 0))
 
 # ──────────────────────────────────────────────
 # Static & Media
@@ -164,7 +261,40 @@ MPESA_CONSUMER_SECRET = os.environ.get('MPESA_CONSUMER_SECRET', '')
 MPESA_SHORTCODE = os.environ.get('MPESA_SHORTCODE', '174379')       # Sandbox default
 MPESA_PASSKEY = os.environ.get('MPESA_PASSKEY', '')
 MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL', 'http://d082-2c0f-6300-d09-fd00-ecf6-3cb3-9e9c-6b3c.ngrok-free.app/api/v1/mpesa/callback/')
-MPESA_BASE_URL = 'https://sandbox.safaricom.co.ke'                 # Change to live for production
+MPESA_BASE_URL = os.environ.get('MPESA_BASE_URL', 'https://sandbox.safaricom.co.ke')   # Change to live for production
+MPESA_TOKEN_EXPIRY_MARGIN = 60                                       # Refresh OAuth tokens this many seconds early
+MPESA_HTTP_POOL_SIZE = 10                                            # Keep-alive connections per worker
+MPESA_HTTP_RETRIES = 2                                               # Extra attempts for idempotent calls
+MPESA_HTTP_BACKOFF = 0.5                                             # Seconds; doubled per retry, with jitter
+MPESA_CIRCUIT_FAILURE_THRESHOLD = 5                                  # Consecutive failures before failing fast
+MPESA_CIRCUIT_RESET_TIMEOUT = 30                                     # Seconds before probing Daraja again
+MPESA_STK_RATE_LIMIT = int(os.environ.get('MPESA_STK_RATE_LIMIT', 5))  # STK pushes per second, all workers
+
+# Background thread pool per worker process (see store/tasks.py)
+BACKGROUND_TASK_WORKERS = int(os.environ.get('BACKGROUND_TASK_WORKERS', 4))
+# Run tasks inline instead (debugging). Tests that submit tasks turn it on with override_settings.
+BACKGROUND_TASKS_EAGER = os.environ.get('BACKGROUND_TASKS_EAGER', '') == '1'
+
+# How long checkout holds variant stock while an M-Pesa payment is pending
+STOCK_RESERVATION_TTL = int(os.environ.get('STOCK_RESERVATION_TTL', 15 * 60))   # seconds
+
+# Write-behind recently-viewed tracking. Overrides store/tracking.py DEFAULTS.
+RECENTLY_VIEWED = _env_overrides(FLUSH_INTERVAL='RECENTLY_VIEWED_FLUSH_INTERVAL')
+
+# Upper bound on how long a position's live banners are cached between schedule changes
+BANNER_CACHE_MAX_TTL = 60 * 60   # seconds
+
+# Newest reviews embedded in the product detail payload; older ones are paginated
+PRODUCT_DETAIL_REVIEWS = 5
+
+# Seconds a viewer's wishlist/cart product ids stay cached (see store/membership.py)
+MEMBERSHIP_CACHE_TTL = 15 * 60
+
+# Popularity rollup behind best sellers and search ranking. Overrides store/popularity.py DEFAULTS.
+POPULARITY = {}
+
+# Order numbers each worker claims from the database per round trip
+ORDER_NUMBER_BLOCK_SIZE = int(os.environ.get('ORDER_NUMBER_BLOCK_SIZE', 50))
 
 # ──────────────────────────────────────────────
 # Email (optional)
@@ -2,7 +2,8 @@ from django.contrib import admin
 from .models import (
     Category, Brand, Product, ProductVariant, ProductImage,
     ProductSpecification, Review, Banner, Cart, CartItem,
-    Order, OrderItem, UserProfile, Wishlist, MpesaTransaction
+    Order, OrderItem, UserProfile, Wishlist, MpesaTransaction,
+    StockReservation, MpesaCallback, ProductPopularity
 )
 
 
@@ -65,7 +66,7 @@ class OrderAdmin(admin.ModelAdmin):
 
 @admin.register(Banner)
 class BannerAdmin(admin.ModelAdmin):
-    list_display = ['title', 'position', 'is_active', 'order']
+    list_display = ['title', 'position', 'is_active', 'starts_at', 'ends_at', 'order']
     list_filter = ['position', 'is_active']
     list_editable = ['is_active', 'order']
 
@@ -77,7 +78,30 @@ class MpesaTransactionAdmin(admin.ModelAdmin):
     readonly_fields = ['checkout_request_id', 'merchant_request_id', 'created_at', 'updated_at']
 
 
+@admin.register(MpesaCallback)
+class MpesaCallbackAdmin(admin.ModelAdmin):
+    list_display = ['checkout_request_id', 'result_code', 'outcome', 'received_at']
+    list_filter = ['outcome']
+    search_fields = ['checkout_request_id']
+    readonly_fields = ['checkout_request_id', 'result_code', 'outcome', 'payload', 'received_at']
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['order', 'variant', 'quantity', 'status', 'expires_at', 'created_at']
+    list_filter = ['status']
+    raw_id_fields = ['order', 'variant']
+
+
 admin.site.register(Review)
 admin.site.register(UserProfile)
 admin.site.register(Wishlist)
-admin.site.register(Cart)
\ No newline at end of file
+admin.site.register(Cart)
+
+
+@admin.register(ProductPopularity)
+class ProductPopularityAdmin(admin.ModelAdmin):
+    list_display = ['product', 'score', 'view_score', 'sales_score', 'pending_views', 'scored_at']
+    list_select_related = ['product']
+    readonly_fields = ['product', 'pending_views', 'view_score', 'sales_score', 'score', 'scored_at']
+    ordering = ['-score']
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .sqlite import tune_connection
+
+        if settings.SQLITE_PERFORMANCE_PROFILE:
+            connection_created.connect(tune_connection, dispatch_uid='store.sqlite.tune_connection')
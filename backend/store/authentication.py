@@ -0,0 +1,66 @@
+"""
+JWT authentication without a user query per request.
+
+simplejwt's ``JWTAuthentication`` loads the ``auth_user`` row on every
+authenticated request. ``StatelessJWTAuthentication`` trusts the signed
+``user_id`` claim and returns a ``LazyUser`` whose columns load only if a view
+actually reads them. Whether the account is still active is checked against
+a short-lived cache entry (``JWT_USER_CACHE_TTL`` seconds); saving or deleting
+a user refreshes that entry, so deactivating an account revokes its tokens
+immediately (bulk ``QuerySet.update()`` calls take effect within the TTL).
+
+Emails are stored lower-cased and looked up through the ``LOWER(email)``
+indexes created in migration 0008, so login and registration cost one index
+probe however many users there are.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.functions import Lower
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import LazyUser
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def users_with_email(email):
+    """Users whose email matches case-insensitively (at most one)."""
+    # The expression must match the index definition exactly to be used.
+    return User.objects.annotate(email_ci=Lower('email')).filter(email_ci=normalize_email(email))
+
+
+def active_cache_key(user_id):
+    return f'auth:active:{user_id}'
+
+
+def is_user_active(user_id):
+    """Return True/False for an existing user, None if there is no such user."""
+    key = active_cache_key(user_id)
+    active = cache.get(key)
+    if active is None:
+        active = User.objects.filter(pk=user_id).values_list('is_active', flat=True).first()
+        if active is None:
+            return None
+        cache.set(key, active, settings.JWT_USER_CACHE_TTL)
+    return active
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        active = is_user_active(user_id)
+        if active is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if not active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+        return LazyUser.from_db(None, ['id', 'is_active'], [user_id, True])
@@ -0,0 +1,58 @@
+"""
+Scheduled banners.
+
+Banners show between their optional ``starts_at`` and ``ends_at``.
+``live_banners(position)`` serializes the banners live at a position and caches
+them until the next start or end time at that position, capped at
+``BANNER_CACHE_MAX_TTL``. Between schedule changes the hero and promo
+endpoints run no queries, and campaigns switch over when the entry expires.
+``store.signals`` clears the cache whenever a banner is saved or deleted.
+"""
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Banner
+from .serializers import BannerSerializer
+
+
+def banner_cache_key(position):
+    return f'banners:live:{position}'
+
+
+def forget_live_banners():
+    cache.delete_many([banner_cache_key(position) for position, _ in Banner.POSITION_CHOICES])
+
+
+def scheduled(queryset, at):
+    """Restrict ``queryset`` to banners live at ``at``."""
+    return queryset.filter(
+        Q(starts_at__isnull=True) | Q(starts_at__lte=at),
+        Q(ends_at__isnull=True) | Q(ends_at__gt=at),
+    )
+
+
+def live_banners(position):
+    """Serialized banners live at ``position`` now."""
+    key = banner_cache_key(position)
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    now = timezone.now()
+    # Live banners plus upcoming ones, whose start times bound the cache entry.
+    banners = list(
+        Banner.objects.filter(is_active=True, position=position)
+        .filter(Q(ends_at__isnull=True) | Q(ends_at__gt=now))
+    )
+    data = BannerSerializer([b for b in banners if b.is_live(now)], many=True).data
+
+    boundaries = [t for b in banners for t in (b.starts_at, b.ends_at) if t is not None and t > now]
+    timeout = settings.BANNER_CACHE_MAX_TTL
+    if boundaries:
+        timeout = min(timeout, math.ceil((min(boundaries) - now).total_seconds()))
+    cache.set(key, data, timeout)
+    return data
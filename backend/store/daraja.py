@@ -0,0 +1,277 @@
+"""
+Safaricom Daraja (M-Pesa) API access.
+
+All Daraja traffic goes through one ``DarajaClient`` per process, which keeps a
+pooled ``requests.Session`` (so TLS connections are reused), applies a timeout
+per endpoint, retries idempotent calls with jittered exponential backoff, and
+stops calling Daraja for a while once it keeps failing (circuit breaker).
+Every call records ``daraja.<endpoint>`` latency and outcome counters in
+``store.metrics``.
+
+OAuth access tokens are cached in the shared cache until shortly before their
+``expires_in`` so STK pushes do not pay for a token round trip each time.
+Refreshes are single-flight: the worker that wins a cache lock fetches a new
+token while the others wait briefly and then reuse it.
+"""
+import base64
+import logging
+import math
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_KEY = 'mpesa:access_token'
+TOKEN_LOCK_KEY = 'mpesa:access_token:refresh'
+TOKEN_POLL_INTERVAL = 0.1
+
+# name: (method, path, (connect timeout, read timeout), safe to retry)
+ENDPOINTS = {
+    'oauth': ('GET', '/oauth/v1/generate?grant_type=client_credentials', (3.05, 10), True),
+    'stk_push': ('POST', '/mpesa/stkpush/v1/processrequest', (3.05, 30), False),
+    'stk_query': ('POST', '/mpesa/stkpushquery/v1/query', (3.05, 15), True),
+}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class DarajaError(ValueError):
+    pass
+
+
+class CircuitOpenError(DarajaError):
+    pass
+
+
+class CircuitBreaker:
+    """Open after ``threshold`` consecutive failures; allow one trial call after ``reset_timeout``."""
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Half-open: let this caller probe, keep the rest out until it reports back.
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning("Daraja circuit opened after %s consecutive failures", self.failures)
+                self.opened_at = time.monotonic()
+
+
+class DarajaClient:
+    def __init__(self, base_url=None, max_retries=None, backoff=None, pool_size=None,
+                 failure_threshold=None, reset_timeout=None):
+        self.base_url = (base_url or settings.MPESA_BASE_URL).rstrip('/')
+        self.max_retries = settings.MPESA_HTTP_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.MPESA_HTTP_BACKOFF if backoff is None else backoff
+        self.breaker = CircuitBreaker(
+            failure_threshold or settings.MPESA_CIRCUIT_FAILURE_THRESHOLD,
+            settings.MPESA_CIRCUIT_RESET_TIMEOUT if reset_timeout is None else reset_timeout,
+        )
+        pool_size = pool_size or settings.MPESA_HTTP_POOL_SIZE
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def request(self, endpoint, **kwargs):
+        method, path, timeout, idempotent = ENDPOINTS[endpoint]
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                metrics.incr(f'daraja.{endpoint}.short_circuited')
+                raise CircuitOpenError(f"Daraja unavailable; not calling {endpoint} while the circuit is open.")
+
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                metrics.timing(f'daraja.{endpoint}', time.monotonic() - started)
+                metrics.incr(f'daraja.{endpoint}.errors')
+                self.breaker.record_failure()
+                # A POST that timed out connecting never reached Daraja, so it is safe to resend.
+                retryable = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if retryable and attempt < self.max_retries:
+                    attempt += 1
+                    self._sleep(attempt)
+                    continue
+                raise DarajaError(f"M-Pesa {endpoint} network error: {e}")
+
+            metrics.timing(f'daraja.{endpoint}', time.monotonic() - started)
+            if response.status_code >= 500:
+                metrics.incr(f'daraja.{endpoint}.errors')
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+            if idempotent and response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                attempt += 1
+                self._sleep(attempt)
+                continue
+            return response
+
+    def _sleep(self, attempt):
+        # Full jitter keeps retrying workers from hitting Daraja in lockstep.
+        time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+    def fetch_access_token(self):
+        """Request a new token from Daraja; returns ``(token, expires_in)``."""
+        consumer_key = settings.MPESA_CONSUMER_KEY
+        consumer_secret = settings.MPESA_CONSUMER_SECRET
+
+        if not consumer_key or not consumer_secret:
+            raise DarajaError(
+                "MPESA_CONSUMER_KEY or MPESA_CONSUMER_SECRET is empty. "
+                "Check your .env file and that load_dotenv() is called in settings.py."
+            )
+
+        auth = base64.b64encode(f"{consumer_key}:{consumer_secret}".encode()).decode()
+        r = self.request('oauth', headers={"Authorization": f"Basic {auth}"})
+        if r.status_code != 200:
+            raise DarajaError(f"M-Pesa OAuth failed (HTTP {r.status_code}): {r.text[:200]}")
+
+        if not r.text.strip():
+            raise DarajaError(
+                f"Empty response from M-Pesa OAuth (HTTP {r.status_code}). "
+                "Wrong credentials or base URL."
+            )
+
+        data = r.json()
+        token = data.get('access_token')
+        if not token:
+            raise DarajaError(f"No access_token in M-Pesa response: {data}")
+
+        return token, int(data.get('expires_in', 3599))
+
+    def _authorized_post(self, endpoint, payload):
+        headers = {"Authorization": f"Bearer {get_access_token()}", "Content-Type": "application/json"}
+        r = self.request(endpoint, json=payload, headers=headers)
+        if r.status_code == 401:
+            # The cached token was revoked early; nothing was processed, so retry once.
+            invalidate_access_token()
+            headers["Authorization"] = f"Bearer {get_access_token()}"
+            r = self.request(endpoint, json=payload, headers=headers)
+        try:
+            return r.json()
+        except ValueError:
+            raise DarajaError(f"Non-JSON response from M-Pesa {endpoint} (HTTP {r.status_code})")
+
+    def stk_push(self, phone, amount, account_reference, description):
+        timestamp, password = _password()
+        return self._authorized_post('stk_push', {
+            "BusinessShortCode": settings.MPESA_SHORTCODE,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": amount,
+            "PartyA": phone,
+            "PartyB": settings.MPESA_SHORTCODE,
+            "PhoneNumber": phone,
+            "CallBackURL": settings.MPESA_CALLBACK_URL,
+            "AccountReference": account_reference,
+            "TransactionDesc": description,
+        })
+
+    def stk_query(self, checkout_request_id):
+        timestamp, password = _password()
+        return self._authorized_post('stk_query', {
+            "BusinessShortCode": settings.MPESA_SHORTCODE,
+            "Password": password,
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        })
+
+
+def _password():
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    password = base64.b64encode(
+        f"{settings.MPESA_SHORTCODE}{settings.MPESA_PASSKEY}{timestamp}".encode()
+    ).decode()
+    return timestamp, password
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return this process's client; a pool inherited across fork() is not reused."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = DarajaClient()
+            _client_pid = os.getpid()
+        return _client
+
+
+def token_lock_timeout():
+    """Seconds a refresh can take: every OAuth attempt timing out, plus the longest backoffs."""
+    _, _, (connect, read), _ = ENDPOINTS['oauth']
+    retries, backoff = settings.MPESA_HTTP_RETRIES, settings.MPESA_HTTP_BACKOFF
+    return math.ceil((retries + 1) * (connect + read) + backoff * (2 ** retries - 1)) + 1
+
+
+def get_access_token():
+    """Return a valid Daraja access token, refreshing it at most once across workers."""
+    token = cache.get(TOKEN_CACHE_KEY)
+    if token:
+        return token
+
+    # The lock must outlive the refresh, or a second worker starts one alongside it.
+    lock_timeout = token_lock_timeout()
+    deadline = time.monotonic() + lock_timeout
+    while True:
+        if cache.add(TOKEN_LOCK_KEY, 1, lock_timeout):
+            try:
+                # Another worker may have refreshed between our read and the lock.
+                token = cache.get(TOKEN_CACHE_KEY)
+                if token:
+                    return token
+                token, expires_in = get_client().fetch_access_token()
+                ttl = max(expires_in - settings.MPESA_TOKEN_EXPIRY_MARGIN, 1)
+                cache.set(TOKEN_CACHE_KEY, token, ttl)
+                logger.info("Refreshed M-Pesa access token (cached for %ss)", ttl)
+                return token
+            finally:
+                cache.delete(TOKEN_LOCK_KEY)
+
+        time.sleep(TOKEN_POLL_INTERVAL)
+        token = cache.get(TOKEN_CACHE_KEY)
+        if token:
+            return token
+        if time.monotonic() > deadline:
+            raise DarajaError("Timed out waiting for another worker to refresh the M-Pesa access token.")
+
+
+def invalidate_access_token():
+    """Drop the cached token, e.g. after Daraja rejects it as expired."""
+    cache.delete(TOKEN_CACHE_KEY)
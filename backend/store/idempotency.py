@@ -0,0 +1,96 @@
+"""
+Idempotency-Key support for unsafe endpoints.
+
+Clients on flaky mobile networks retry POSTs they never saw a response for.
+When a request carries an ``Idempotency-Key`` header, the first response for
+that (endpoint, user, key) is stored in the cache for ``IDEMPOTENCY_TTL``
+seconds and replayed for every retry. A retry that arrives while the first
+request is still running waits for it to finish instead of running the view a
+second time. Reusing a key with a different body is rejected with 422.
+
+Stored entries are keyed by a SHA-256 digest, so the store stays compact no
+matter how long client keys are. Use a cache shared by all workers
+(``REDIS_URL``) in production, otherwise the guarantee only holds per process.
+"""
+import functools
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+
+
+def _digest(*parts):
+    return hashlib.sha256('\x1f'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return Response(
+            {'error': 'Idempotency-Key was already used with a different request body.'},
+            status=422,
+        )
+    return Response(stored['data'], status=stored['status'], headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(scope):
+    """Decorate an APIView handler (``def post(self, request, ...)``)."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.META.get(HEADER)
+            if not key:
+                return handler(self, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response({'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters.'}, status=400)
+
+            owner = request.user.pk if request.user.is_authenticated else request.session.session_key
+            digest = _digest(scope, owner, key)
+            result_key, lock_key = f'idem:{digest}', f'idem-lock:{digest}'
+            fingerprint = _digest(json.dumps(request.data, sort_keys=True, default=str))
+            ttl = getattr(settings, 'IDEMPOTENCY_TTL', 24 * 60 * 60)
+            lock_timeout = getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 90)
+
+            stored = cache.get(result_key)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+
+            if cache.add(lock_key, fingerprint, lock_timeout):
+                try:
+                    # The previous holder may have finished between our two reads.
+                    stored = cache.get(result_key)
+                    if stored is not None:
+                        return _replay(stored, fingerprint)
+                    response = handler(self, request, *args, **kwargs)
+                    # Server errors are not final; let the client retry them for real.
+                    if response.status_code < 500:
+                        cache.set(result_key, {
+                            'fingerprint': fingerprint,
+                            'status': response.status_code,
+                            'data': response.data,
+                        }, ttl)
+                    return response
+                finally:
+                    cache.delete(lock_key)
+
+            # Another worker is running this request; wait for its response.
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                stored = cache.get(result_key)
+                if stored is not None:
+                    return _replay(stored, fingerprint)
+                if cache.get(lock_key) is None:
+                    break
+            return Response(
+                {'error': 'A request with this Idempotency-Key is still being processed or failed; retry.'},
+                status=409,
+            )
+        return wrapper
+    return decorator
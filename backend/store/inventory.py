@@ -0,0 +1,149 @@
+"""
+Stock reservations.
+
+Checkout places a time-limited hold on every variant in the cart instead of
+decrementing ``ProductVariant.stock`` straight away. A successful M-Pesa
+callback converts the holds into sales (the stock decrement happens then), a
+failed payment releases them, and ``release_expired_reservations`` sweeps holds
+whose TTL ran out so abandoned checkouts give their stock back. A payment
+that arrives after its holds lapsed is sold only from stock nobody else holds,
+and logged either way.
+
+Available stock is ``stock`` minus the quantity of active, unexpired holds.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Now
+from django.utils import timezone
+
+from .models import ProductVariant, StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, variant, requested, available):
+        self.variant = variant
+        self.requested = requested
+        self.available = available
+        super().__init__(f"Only {available} of {variant} available, {requested} requested")
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60))
+
+
+def with_available_stock(variants, now=None):
+    """Annotate ``available`` onto a variant queryset.
+
+    Holds are summed in a correlated subquery on ``reservation_hold_idx``, so
+    the queryset keeps its own plan. Without ``now`` the cutoff is the
+    database clock at query time, which suits module-level querysets.
+    """
+    held = StockReservation.objects.filter(
+        variant=OuterRef('pk'), status='active', expires_at__gt=now or Now()
+    ).values('variant').annotate(total=Sum('quantity')).values('total')
+    return variants.annotate(available=F('stock') - Coalesce(Subquery(held), 0))
+
+
+def available_stock(variant_ids, now=None):
+    """Return ``{variant_id: available}`` for the given variants in one query."""
+    rows = with_available_stock(ProductVariant.objects.filter(id__in=variant_ids), now=now)
+    return dict(rows.values_list('id', 'available'))
+
+
+def held_quantities(variant_ids, now=None):
+    """Return ``{variant_id: held}`` for variants with active holds."""
+    now = now or timezone.now()
+    rows = StockReservation.objects.filter(
+        variant_id__in=variant_ids, status='active', expires_at__gt=now
+    ).values('variant_id').annotate(held=Sum('quantity')).values_list('variant_id', 'held')
+    return dict(rows)
+
+
+def reserve(order, lines):
+    """
+    Place holds for ``lines`` (``(variant, quantity)`` pairs) on ``order``.
+
+    Must run inside a transaction that has already locked the variants with
+    ``select_for_update()``; raises ``InsufficientStock`` when any line cannot
+    be covered by the stock that is not already held.
+    """
+    now = timezone.now()
+    held = held_quantities([variant.id for variant, _ in lines], now=now)
+    for variant, quantity in lines:
+        available = variant.stock - held.get(variant.id, 0)
+        if quantity > available:
+            raise InsufficientStock(variant, quantity, max(available, 0))
+
+    expires_at = now + reservation_ttl()
+    return StockReservation.objects.bulk_create([
+        StockReservation(variant=variant, order=order, quantity=quantity, expires_at=expires_at)
+        for variant, quantity in lines
+    ])
+
+
+@transaction.atomic
+def convert_reservations(order):
+    """Turn the order's holds into sales by decrementing stock; returns how many."""
+    now = timezone.now()
+    holds = list(
+        StockReservation.objects.select_for_update()
+        .filter(order=order, status__in=['active', 'released'])
+        .order_by('variant_id')
+    )
+    live = [h for h in holds if h.status == 'active' and h.expires_at > now]
+    lapsed = [h for h in holds if h not in live]
+    for hold in live:
+        # Covered by the hold: checkout never let anyone else claim this stock.
+        ProductVariant.objects.filter(id=hold.variant_id).update(stock=F('stock') - hold.quantity)
+    if lapsed:
+        _convert_lapsed(order, lapsed, now)
+    if holds:
+        StockReservation.objects.filter(id__in=[h.id for h in holds]).update(status='converted')
+    return len(holds)
+
+
+def _convert_lapsed(order, holds, now):
+    """Sell holds whose TTL ran out before payment, from whatever stock is still unclaimed."""
+    variant_ids = sorted({h.variant_id for h in holds})
+    # Lock the variants like checkout does, so no new hold claims the stock meanwhile.
+    list(ProductVariant.objects.select_for_update().filter(id__in=variant_ids).order_by('id').values_list('id', flat=True))
+    available = available_stock(variant_ids, now=now)
+    for hold in holds:
+        if available.get(hold.variant_id, 0) >= hold.quantity:
+            available[hold.variant_id] -= hold.quantity
+            ProductVariant.objects.filter(id=hold.variant_id).update(stock=F('stock') - hold.quantity)
+            logger.warning(
+                "Order %s paid after its hold on variant %s lapsed; sold %s from unclaimed stock",
+                order.order_number, hold.variant_id, hold.quantity,
+            )
+        else:
+            logger.error(
+                "Order %s paid after its hold on variant %s lapsed; stock is oversold by up to %s",
+                order.order_number, hold.variant_id, hold.quantity,
+            )
+
+
+def release_reservations(order):
+    """Give the order's active holds back to available stock."""
+    return StockReservation.objects.filter(order=order, status='active').update(status='released')
+
+
+def release_expired(batch_size=500, now=None):
+    """Release expired holds in batches; returns how many were released."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        ids = list(
+            StockReservation.objects.filter(status='active', expires_at__lte=now)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        released += StockReservation.objects.filter(id__in=ids, status='active').update(status='released')
+    return released
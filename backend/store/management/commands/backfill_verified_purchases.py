@@ -0,0 +1,23 @@
+"""
+Mark existing reviews whose author bought the product (paid order).
+
+Usage:
+    python manage.py backfill_verified_purchases
+    python manage.py backfill_verified_purchases --chunk-size 20000
+"""
+
+from django.core.management.base import BaseCommand
+
+from store.reviews import backfill_verified_purchases
+
+
+class Command(BaseCommand):
+    help = 'Backfill Review.is_verified_purchase from paid orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Reviews (by primary-key range) examined per UPDATE statement.')
+
+    def handle(self, *args, **options):
+        flagged = backfill_verified_purchases(chunk_size=options['chunk_size'])
+        self.stdout.write(f'Marked {flagged} review(s) as verified purchases.')
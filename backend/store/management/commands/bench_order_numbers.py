@@ -0,0 +1,56 @@
+"""
+Benchmark the order number allocator.
+
+Usage:
+    python manage.py bench_order_numbers
+    python manage.py bench_order_numbers --count 20000 --threads 8 --block-size 100
+"""
+
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from store.sequences import BlockAllocator
+
+
+class Command(BaseCommand):
+    help = 'Measure order number allocations per second and check they are unique.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help='Numbers to allocate in total.')
+        parser.add_argument('--threads', type=int, default=4, help='Concurrent allocating threads.')
+        parser.add_argument('--block-size', type=int, default=50, help='Values claimed per database round trip.')
+
+    def handle(self, *args, **options):
+        count, threads = options['count'], options['threads']
+        # A separate sequence so the benchmark never consumes real order numbers.
+        allocator = BlockAllocator('bench_order_number', options['block_size'])
+        values = []
+        values_lock = threading.Lock()
+
+        def worker(n):
+            try:
+                got = [allocator.next_value() for _ in range(n)]
+                with values_lock:
+                    values.extend(got)
+            finally:
+                connection.close()
+
+        per_thread = [count // threads + (1 if i < count % threads else 0) for i in range(threads)]
+        pool = [threading.Thread(target=worker, args=(n,)) for n in per_thread]
+        started = time.perf_counter()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        duplicates = len(values) - len(set(values))
+        self.stdout.write(
+            f'{len(values)} numbers in {elapsed:.3f}s = {len(values) / elapsed:,.0f} allocations/s '
+            f'({allocator.refills} block claims, {duplicates} duplicates)'
+        )
+        if duplicates:
+            self.stderr.write(self.style.ERROR('Duplicate numbers allocated!'))
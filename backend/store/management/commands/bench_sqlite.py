@@ -0,0 +1,132 @@
+"""
+Compare SQLite read/write concurrency with and without the performance profile.
+
+Builds two scratch databases (never the real one) shaped like the hot paths:
+product lookups plus recently-viewed reads, against upserts of
+recently-viewed rows. It then runs the same reader/writer thread mix on each,
+once with SQLite's defaults and once with store.sqlite's pragmas.
+
+Usage:
+    python manage.py bench_sqlite
+    python manage.py bench_sqlite --readers 8 --writers 4 --seconds 10
+"""
+
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from store.sqlite import apply_pragmas, profile_pragmas
+
+PRODUCTS = 2000
+USERS = 500
+
+SCHEMA = [
+    'CREATE TABLE product (id INTEGER PRIMARY KEY, name TEXT, price REAL, description TEXT)',
+    'CREATE TABLE recently_viewed (user_id INTEGER, product_id INTEGER, viewed_at REAL, '
+    'UNIQUE (user_id, product_id))',
+    'CREATE INDEX recently_viewed_user ON recently_viewed (user_id, viewed_at)',
+]
+READ_PRODUCT = 'SELECT id, name, price, description FROM product WHERE id = ?'
+READ_HISTORY = 'SELECT product_id FROM recently_viewed WHERE user_id = ? ORDER BY viewed_at DESC LIMIT 10'
+UPSERT_VIEW = (
+    'INSERT INTO recently_viewed (user_id, product_id, viewed_at) VALUES (?, ?, ?) '
+    'ON CONFLICT (user_id, product_id) DO UPDATE SET viewed_at = excluded.viewed_at'
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark SQLite read/write concurrency before and after the performance profile.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help='Concurrent reading threads.')
+        parser.add_argument('--writers', type=int, default=2, help='Concurrent writing threads.')
+        parser.add_argument('--seconds', type=float, default=5, help='Duration of each run.')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as scratch:
+            results = {}
+            for label, pragmas in [('defaults', {}), ('profile', profile_pragmas())]:
+                path = Path(scratch) / f'{label}.sqlite3'
+                self._build(path, pragmas)
+                results[label] = self._run(path, pragmas, options)
+
+        self.stdout.write(f"{'':10} {'reads/s':>10} {'writes/s':>10} {'read p99':>10} {'locked':>8}")
+        for label, r in results.items():
+            self.stdout.write(
+                f"{label:10} {r['reads'] / options['seconds']:>10,.0f} {r['writes'] / options['seconds']:>10,.0f} "
+                f"{r['read_p99'] * 1000:>8.1f}ms {r['locked']:>8}"
+            )
+
+    def _connect(self, path, pragmas):
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        apply_pragmas(conn.cursor(), pragmas)
+        return conn
+
+    def _build(self, path, pragmas):
+        conn = self._connect(path, pragmas)
+        for statement in SCHEMA:
+            conn.execute(statement)
+        conn.execute('BEGIN')
+        conn.executemany(
+            'INSERT INTO product (id, name, price, description) VALUES (?, ?, ?, ?)',
+            [(i, f'Phone {i}', 10000 + i, 'x' * 500) for i in range(PRODUCTS)],
+        )
+        conn.executemany(UPSERT_VIEW, [
+            (random.randrange(USERS), random.randrange(PRODUCTS), time.time()) for _ in range(USERS * 10)
+        ])
+        conn.execute('COMMIT')
+        conn.close()
+
+    def _run(self, path, pragmas, options):
+        deadline = time.monotonic() + options['seconds']
+        lock = threading.Lock()
+        totals = {'reads': 0, 'writes': 0, 'locked': 0}
+        latencies = []
+
+        def reader():
+            conn = self._connect(path, pragmas)
+            reads, locked, mine = 0, 0, []
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    conn.execute(READ_PRODUCT, (random.randrange(PRODUCTS),)).fetchall()
+                    conn.execute(READ_HISTORY, (random.randrange(USERS),)).fetchall()
+                except sqlite3.OperationalError:
+                    locked += 1
+                    continue
+                mine.append(time.perf_counter() - started)
+                reads += 1
+            conn.close()
+            with lock:
+                totals['reads'] += reads
+                totals['locked'] += locked
+                latencies.extend(mine)
+
+        def writer():
+            conn = self._connect(path, pragmas)
+            writes, locked = 0, 0
+            while time.monotonic() < deadline:
+                try:
+                    conn.execute(UPSERT_VIEW, (random.randrange(USERS), random.randrange(PRODUCTS), time.time()))
+                    writes += 1
+                except sqlite3.OperationalError:
+                    locked += 1
+            conn.close()
+            with lock:
+                totals['writes'] += writes
+                totals['locked'] += locked
+
+        threads = [threading.Thread(target=reader) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=writer) for _ in range(options['writers'])]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        totals['read_p99'] = statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1 else 0
+        return totals
@@ -0,0 +1,125 @@
+"""
+Copy every table from a SQLite database into the configured database.
+
+Meant for moving a branch off SQLite: point DB_NAME/DB_* at the new
+PostgreSQL database, run ``migrate`` there, then:
+
+    python manage.py copy_sqlite_to_postgres --source db.sqlite3
+    python manage.py copy_sqlite_to_postgres --source /backups/db.sqlite3 --batch-size 5000 --yes
+
+Rows are streamed from SQLite in primary-key order and written in batches of
+``--batch-size`` (``execute_values`` on PostgreSQL), so memory stays flat
+however large the tables are. Primary keys and timestamps are copied as-is
+(``auto_now`` is bypassed), sequences are reset afterwards and row counts are
+verified. The whole copy runs in one transaction: foreign keys are checked at
+commit, so tables load in any order and a failure leaves the target empty.
+The target's existing rows in these tables are deleted first.
+"""
+
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+
+SOURCE = 'sqlite_source'
+
+
+class Command(BaseCommand):
+    help = 'Stream all data from a SQLite database into the configured (PostgreSQL) database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default='db.sqlite3', help='Path to the SQLite database file.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Target database alias.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per INSERT batch.')
+        parser.add_argument('--yes', action='store_true', help='Do not ask before replacing target data.')
+
+    def handle(self, *args, **options):
+        source_path = Path(options['source']).resolve()
+        if not source_path.exists():
+            raise CommandError(f'{source_path} does not exist.')
+        target = connections[options['database']]
+        if target.vendor == 'sqlite' and Path(target.settings_dict['NAME']).resolve() == source_path:
+            raise CommandError('The target database is the source file; set DB_NAME to copy into PostgreSQL.')
+
+        configured = connections.configure_settings({
+            **connections.settings,
+            SOURCE: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(source_path)},
+        })
+        connections.settings[SOURCE] = configured[SOURCE]
+        source = connections[SOURCE]
+
+        self._check_migrated(source, 'source')
+        self._check_migrated(target, 'target')
+
+        models = [
+            model for model in apps.get_models(include_auto_created=True)
+            if model._meta.managed and not model._meta.proxy
+        ]
+        if not options['yes']:
+            answer = input(f"Replace all data in '{target.settings_dict['NAME']}' with {source_path}? [y/N] ")
+            if answer.lower() != 'y':
+                raise CommandError('Aborted.')
+
+        started = time.monotonic()
+        with transaction.atomic(using=target.alias):
+            tables = [model._meta.db_table for model in models]
+            target.ops.execute_sql_flush(target.ops.sql_flush(no_style(), tables, allow_cascade=True))
+            copied = {model: self._copy(model, source, target, options['batch_size']) for model in models}
+            with target.cursor() as cursor:
+                for sql in target.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+
+        mismatched = [
+            model._meta.label for model, rows in copied.items()
+            if model._base_manager.using(target.alias).count() != rows
+        ]
+        source.close()
+        if mismatched:
+            raise CommandError(f"Row counts differ after copying: {', '.join(mismatched)}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Copied {sum(copied.values())} rows in {len(models)} tables in {time.monotonic() - started:.1f}s.'
+        ))
+
+    def _check_migrated(self, connection, role):
+        executor = MigrationExecutor(connection)
+        if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            raise CommandError(
+                f"The {role} database has unapplied migrations; run "
+                f"'manage.py migrate{' --database ' + connection.alias if role == 'target' else ''}' first."
+            )
+
+    def _copy(self, model, source, target, batch_size):
+        fields = model._meta.local_concrete_fields
+        qn = target.ops.quote_name
+        columns = ', '.join(qn(field.column) for field in fields)
+        insert = f'INSERT INTO {qn(model._meta.db_table)} ({columns}) VALUES '
+
+        rows = (
+            model._base_manager.using(source.alias).order_by('pk')
+            .values_list(*[field.attname for field in fields]).iterator(chunk_size=batch_size)
+        )
+        copied, batch = 0, []
+        started = time.monotonic()
+        with target.cursor() as cursor:
+            for row in rows:
+                batch.append([field.get_db_prep_save(value, connection=target) for field, value in zip(fields, row)])
+                if len(batch) >= batch_size:
+                    copied += self._insert(cursor, target, insert, batch, len(fields))
+                    batch = []
+            if batch:
+                copied += self._insert(cursor, target, insert, batch, len(fields))
+        if copied:
+            self.stdout.write(f'  {model._meta.label}: {copied} rows ({time.monotonic() - started:.1f}s)')
+        return copied
+
+    def _insert(self, cursor, target, insert, batch, width):
+        if target.vendor == 'postgresql':
+            from psycopg2.extras import execute_values
+            execute_values(cursor.cursor, insert + '%s', batch, page_size=len(batch))
+        else:
+            cursor.executemany(insert + '(' + ', '.join(['%s'] * width) + ')', batch)
+        return len(batch)
@@ -0,0 +1,187 @@
+"""
+Local stand-in for Safaricom's Daraja API, for load-testing payments.
+
+Serves OAuth, STK push (processrequest) and STK query, and posts the STK
+result callback to the CallBackURL of each push after --callback-delay.
+
+Usage:
+    python manage.py daraja_simulator --port 8001
+    python manage.py daraja_simulator --latency 300 --jitter 200 --failure-rate 0.02 \
+        --callback-delay 5 --decline-rate 0.1 --drop-callback-rate 0.05
+
+Point the backend at it with:
+    MPESA_BASE_URL=http://127.0.0.1:8001
+    MPESA_CALLBACK_URL=http://127.0.0.1:8000/api/v1/mpesa/callback/
+    MPESA_CONSUMER_KEY=sim MPESA_CONSUMER_SECRET=sim
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.core.management.base import BaseCommand
+
+
+class Simulator:
+    def __init__(self, latency, jitter, failure_rate, callback_delay, decline_rate, drop_callback_rate):
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.failure_rate = failure_rate
+        self.callback_delay = callback_delay
+        self.decline_rate = decline_rate
+        self.drop_callback_rate = drop_callback_rate
+        self.results = {}       # CheckoutRequestID -> (ResultCode, ResultDesc) once "completed"
+        self.lock = threading.Lock()
+        self.stats = {'oauth': 0, 'stk_push': 0, 'stk_query': 0, 'failed': 0, 'callbacks': 0, 'callback_errors': 0}
+        self.session = requests.Session()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def delay(self):
+        time.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+
+    def complete(self, checkout_request_id, merchant_request_id, payload):
+        if random.random() < self.decline_rate:
+            result = ('1032', 'Request cancelled by user')
+        else:
+            result = ('0', 'The service request is processed successfully.')
+        with self.lock:
+            self.results[checkout_request_id] = result
+        if random.random() < self.drop_callback_rate:
+            return
+
+        stk = {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': int(result[0]),
+            'ResultDesc': result[1],
+        }
+        if result[0] == '0':
+            stk['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': payload.get('Amount')},
+                {'Name': 'MpesaReceiptNumber', 'Value': uuid.uuid4().hex[:10].upper()},
+                {'Name': 'PhoneNumber', 'Value': payload.get('PhoneNumber')},
+            ]}
+        try:
+            self.session.post(payload['CallBackURL'], json={'Body': {'stkCallback': stk}}, timeout=10)
+            self.count('callbacks')
+        except requests.exceptions.RequestException:
+            self.count('callback_errors')
+
+
+def make_handler(sim):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def maybe_fail(self):
+            if random.random() < sim.failure_rate:
+                sim.count('failed')
+                self.reply(503, {'errorCode': '503.001.01', 'errorMessage': 'Simulated outage'})
+                return True
+            return False
+
+        def do_GET(self):
+            if not self.path.startswith('/oauth/v1/generate'):
+                return self.reply(404, {'errorMessage': 'Not found'})
+            sim.count('oauth')
+            sim.delay()
+            if self.maybe_fail():
+                return
+            self.reply(200, {'access_token': uuid.uuid4().hex, 'expires_in': '3599'})
+
+        def do_POST(self):
+            payload = self.read_json()
+            sim.delay()
+            if self.path == '/mpesa/stkpush/v1/processrequest':
+                sim.count('stk_push')
+                if self.maybe_fail():
+                    return
+                checkout_request_id = f'ws_CO_{uuid.uuid4().hex}'
+                merchant_request_id = f'{random.randint(10000, 99999)}-{random.randint(1000000, 9999999)}-1'
+                timer = threading.Timer(
+                    sim.callback_delay, sim.complete, args=(checkout_request_id, merchant_request_id, payload)
+                )
+                timer.daemon = True
+                timer.start()
+                return self.reply(200, {
+                    'MerchantRequestID': merchant_request_id,
+                    'CheckoutRequestID': checkout_request_id,
+                    'ResponseCode': '0',
+                    'ResponseDescription': 'Success. Request accepted for processing',
+                    'CustomerMessage': 'Success. Request accepted for processing',
+                })
+            if self.path == '/mpesa/stkpushquery/v1/query':
+                sim.count('stk_query')
+                if self.maybe_fail():
+                    return
+                with sim.lock:
+                    result = sim.results.get(payload.get('CheckoutRequestID'))
+                if result is None:
+                    return self.reply(500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'})
+                return self.reply(200, {
+                    'ResponseCode': '0',
+                    'ResponseDescription': 'The service request has been accepted successsfully',
+                    'CheckoutRequestID': payload.get('CheckoutRequestID'),
+                    'ResultCode': result[0],
+                    'ResultDesc': result[1],
+                })
+            self.reply(404, {'errorMessage': 'Not found'})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = 'Run a local Daraja simulator (OAuth, STK push, STK query, callbacks).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=int, default=200, help='Mean response latency in ms.')
+        parser.add_argument('--jitter', type=int, default=100, help='Latency jitter (+/- ms).')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with 503.')
+        parser.add_argument('--callback-delay', type=float, default=3.0,
+                            help='Seconds between an STK push and its callback (the customer entering their PIN).')
+        parser.add_argument('--decline-rate', type=float, default=0.0, help='Fraction of payments the customer cancels.')
+        parser.add_argument('--drop-callback-rate', type=float, default=0.0,
+                            help='Fraction of callbacks never delivered (exercises reconcile_mpesa).')
+
+    def handle(self, *args, **options):
+        sim = Simulator(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            failure_rate=options['failure_rate'],
+            callback_delay=options['callback_delay'],
+            decline_rate=options['decline_rate'],
+            drop_callback_rate=options['drop_callback_rate'],
+        )
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(sim))
+        server.daemon_threads = True
+        self.stdout.write(f"Daraja simulator listening on http://{options['host']}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'Simulator stats: {sim.stats}')
@@ -0,0 +1,168 @@
+"""
+Print the query plan of every query the storefront's read endpoints run.
+
+Each endpoint is requested in-process against the configured database, inside
+a transaction that is rolled back so carts and sessions created on the way are
+discarded; product views it buffers (store.tracking) are discarded too. Its
+queries are captured and each SELECT is passed to ``EXPLAIN QUERY PLAN``
+(SQLite) or ``EXPLAIN`` (PostgreSQL). Table scans that use no index are
+flagged, except on the small reference tables in ``REFERENCE_TABLES``, whose
+endpoints return nearly every row. Run it on a seeded database: PostgreSQL's
+planner prefers sequential scans on tables with only a handful of rows.
+
+Usage:
+    python manage.py explain_endpoints
+    python manage.py explain_endpoints --only products --fail-on-scan
+"""
+
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from store import tracking
+from store.models import Brand, Category, Order, Product, StkPushJob
+
+# (method, path, needs a logged-in user). Placeholders are filled from the data.
+ENDPOINTS = [
+    ('get', 'categories/', False),
+    ('get', 'categories/all_flat/', False),
+    ('get', 'brands/', False),
+    ('get', 'brands/featured/', False),
+    ('get', 'products/', False),
+    ('get', 'products/?is_featured=true', False),
+    ('get', 'products/?is_hot=true', False),
+    ('get', 'products/?is_new=true', False),
+    ('get', 'products/?search=phone', False),
+    ('get', 'products/featured/', False),
+    ('get', 'products/best_sellers/', False),
+    ('get', 'products/new_arrivals/', False),
+    ('get', 'products/by_category/?slug={category}', False),
+    ('get', 'products/by_brand/?slug={brand}', False),
+    ('get', 'products/{product}/', False),
+    ('get', 'products/{product}/related/', False),
+    ('get', 'products/{product}/reviews/', False),
+    ('get', 'banners/', False),
+    ('get', 'banners/hero/', False),
+    ('get', 'banners/promo/', False),
+    ('get', 'cart/', False),
+    ('get', 'recently-viewed/', False),
+    ('post', 'membership/', False),
+    ('get', 'cart/', True),
+    ('get', 'recently-viewed/', True),
+    ('post', 'membership/', True),
+    ('get', 'wishlist/', True),
+    ('get', 'orders/', True),
+    ('get', 'orders/{order}/', True),
+    ('get', 'auth/profile/', True),
+    ('get', 'mpesa/stk-push/{job}/', True),
+]
+
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)(?!\w| USING)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+REFERENCE_TABLES = {'store_category', 'store_brand', 'store_banner'}
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN every query run by the read endpoints and flag full table scans.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', help='Only endpoints whose path contains this text.')
+        parser.add_argument('--fail-on-scan', action='store_true', help='Exit non-zero if any full scan is found.')
+
+    def handle(self, *args, **options):
+        values, user = self._sample()
+        self.tables = set(connection.introspection.table_names())
+        scans = []
+        for method, template, needs_user in ENDPOINTS:
+            if options['only'] and options['only'] not in template:
+                continue
+            try:
+                path = template.format(**values)
+            except KeyError as missing:
+                self.stdout.write(self.style.WARNING(f'{method.upper()} {template}: skipped, no {missing} in the data'))
+                continue
+            if needs_user and user is None:
+                self.stdout.write(self.style.WARNING(f'{method.upper()} {template}: skipped, no users'))
+                continue
+
+            label = f"{method.upper()} /api/v1/{path}{' (logged in)' if needs_user else ''}"
+            queries, status = self._capture(method, path, user if needs_user else None, values)
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{label}: {status}, {len(queries)} queries'))
+            for sql in queries:
+                plan = self._explain(sql)
+                self.stdout.write(f'  {sql[:150]}')
+                for line in plan:
+                    scanned = self._scanned_table(line)
+                    if scanned in REFERENCE_TABLES:
+                        self.stdout.write(f'    {line}   (reference table)')
+                    elif scanned:
+                        scans.append((label, scanned))
+                        self.stdout.write(self.style.ERROR(f'    {line}   <-- full scan'))
+                    else:
+                        self.stdout.write(f'    {line}')
+
+        if not scans:
+            self.stdout.write(self.style.SUCCESS('No full table scans.'))
+            return
+        self.stdout.write(self.style.WARNING(f'{len(scans)} full scan(s):'))
+        for label, table in scans:
+            self.stdout.write(f'  {table} in {label}')
+        if options['fail_on_scan']:
+            raise CommandError('Full table scans found.')
+
+    def _sample(self):
+        values = {}
+        product = Product.objects.filter(is_active=True).first()
+        if product:
+            values['product'] = product.slug
+            values['product_id'] = str(product.pk)
+        category = Category.objects.filter(is_active=True).first()
+        if category:
+            values['category'] = category.slug
+        brand = Brand.objects.filter(is_active=True).first()
+        if brand:
+            values['brand'] = brand.slug
+        order = Order.objects.filter(user__isnull=False).select_related('user').first()
+        if order:
+            values['order'] = order.pk
+            job = StkPushJob.objects.filter(order=order).first()
+            if job:
+                values['job'] = job.pk
+            return values, order.user
+        return values, User.objects.filter(is_active=True).first()
+
+    def _capture(self, method, path, user, values):
+        client = APIClient(raise_request_exception=False)
+        if user:
+            client.force_authenticate(user)
+        data = {'product_ids': [values['product_id']]} if method == 'post' and 'product_id' in values else {}
+        try:
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    response = getattr(client, method)(f'/api/v1/{path}', data, format='json')
+                transaction.set_rollback(True)
+        finally:
+            # Product pages buffer their views outside the transaction; a later flush would record them.
+            tracking.discard()
+        selects = [q['sql'] for q in captured.captured_queries if q['sql'].lstrip().upper().startswith(('SELECT', 'WITH'))]
+        return selects, response.status_code
+
+    def _explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return [row[-1] for row in cursor.fetchall()]
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+
+    def _scanned_table(self, line):
+        pattern = SQLITE_SCAN if connection.vendor == 'sqlite' else POSTGRES_SCAN
+        match = pattern.search(line.strip())
+        # Scans of subqueries and CTEs are over rows already fetched by index.
+        if match and match.group(1) in self.tables:
+            return match.group(1)
+        return None
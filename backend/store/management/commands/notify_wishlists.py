@@ -0,0 +1,27 @@
+"""
+Email users about price drops and restocks of products on their wishlist.
+
+Usage:
+    python manage.py notify_wishlists
+    python manage.py notify_wishlists --batch-size 5000 --interval 600
+"""
+
+from store.management.periodic import PeriodicCommand
+from store.notifications import notify_wishlists
+
+
+class Command(PeriodicCommand):
+    help = 'Send wishlist price-drop and back-in-stock notifications.'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Variant changes handled per batch.')
+
+    def run_once(self, **options):
+        # Drain everything pending, one batch at a time.
+        while True:
+            changes, sent = notify_wishlists(batch_size=options['batch_size'])
+            if not changes:
+                break
+            self.stdout.write(f'{changes} change(s) -> {sent} email(s).')
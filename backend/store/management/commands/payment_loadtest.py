@@ -0,0 +1,127 @@
+"""
+End-to-end payment load test: checkout -> STK push -> callback -> paid.
+
+Run the API against the Daraja simulator (see daraja_simulator), then:
+
+    python manage.py payment_loadtest --payments 200 --concurrency 20
+    python manage.py payment_loadtest --base-url http://127.0.0.1:8000/api/v1 --variant-id 12 --restock
+
+Each payment uses its own freshly registered user (registration happens before
+the clock starts) and reports payments per second plus end-to-end latency.
+"""
+
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from store.models import ProductVariant
+
+CHECKOUT_FORM = {
+    'full_name': 'Load Test',
+    'email': 'loadtest@example.com',
+    'phone': '0712345678',
+    'shipping_address': 'Kimathi Street',
+    'city': 'Nairobi',
+    'county': 'Nairobi',
+    'payment_method': 'mpesa',
+}
+
+
+class Command(BaseCommand):
+    help = 'Measure end-to-end M-Pesa payments per second against a running API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/api/v1')
+        parser.add_argument('--payments', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--variant-id', type=int, help='Variant to buy (default: first active one with stock).')
+        parser.add_argument('--restock', action='store_true',
+                            help='Top up the variant stock first (needs this process to share the API database).')
+        parser.add_argument('--timeout', type=float, default=120, help='Seconds to wait for each payment.')
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        base = options['base_url'].rstrip('/')
+        variant = self._variant(options)
+        run = uuid.uuid4().hex[:6]
+        local = threading.local()
+
+        def session():
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            return local.session
+
+        def register(i):
+            r = session().post(f'{base}/auth/register/', json={
+                'username': f'lt-{run}-{i}', 'email': f'lt-{run}-{i}@example.com',
+                'password': 'LoadTest!2024', 'password2': 'LoadTest!2024',
+            }, timeout=30)
+            r.raise_for_status()
+            return r.json()['tokens']['access']
+
+        def pay(token):
+            s = session()
+            headers = {'Authorization': f'Bearer {token}'}
+            started = time.monotonic()
+            try:
+                r = s.post(f'{base}/cart/', json={'product_id': str(variant.product_id), 'variant_id': variant.id},
+                           headers=headers, timeout=30)
+                r.raise_for_status()
+                r = s.post(f'{base}/orders/', json=CHECKOUT_FORM, headers=headers, timeout=30)
+                if r.status_code != 201:
+                    return 'checkout_failed', time.monotonic() - started
+                order = r.json()
+                r = s.post(f'{base}/mpesa/stk-push/', json={'phone': CHECKOUT_FORM['phone'], 'order_id': order['id']},
+                           headers=headers, timeout=30)
+                if r.status_code not in (200, 202):
+                    return 'push_failed', time.monotonic() - started
+
+                deadline = started + options['timeout']
+                while time.monotonic() < deadline:
+                    time.sleep(options['poll_interval'])
+                    status = s.get(f"{base}/orders/{order['id']}/", headers=headers, timeout=30).json()
+                    if status['payment_status'] != 'pending':
+                        return status['payment_status'], time.monotonic() - started
+                return 'timeout', time.monotonic() - started
+            except requests.exceptions.RequestException:
+                return 'error', time.monotonic() - started
+
+        payments, concurrency = options['payments'], options['concurrency']
+        self.stdout.write(f'Registering {payments} users...')
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            tokens = list(pool.map(register, range(payments)))
+
+        self.stdout.write(f'Running {payments} payments with concurrency {concurrency}...')
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(pay, tokens))
+        elapsed = time.monotonic() - started
+
+        outcomes = {}
+        for outcome, _ in results:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        paid = sorted(latency for outcome, latency in results if outcome == 'paid')
+        self.stdout.write(f'Outcomes: {outcomes}')
+        self.stdout.write(f'{len(paid)} paid in {elapsed:.1f}s = {len(paid) / elapsed:.2f} payments/s')
+        if paid:
+            p95 = paid[min(len(paid) - 1, int(len(paid) * 0.95))]
+            self.stdout.write(
+                f'End-to-end latency: p50 {statistics.median(paid):.2f}s, p95 {p95:.2f}s, max {paid[-1]:.2f}s'
+            )
+
+    def _variant(self, options):
+        qs = ProductVariant.objects.filter(is_active=True, product__is_active=True)
+        if options['variant_id']:
+            variant = qs.filter(id=options['variant_id']).first()
+        else:
+            variant = qs.filter(stock__gt=0).first()
+        if variant is None:
+            raise CommandError('No active variant found; pass --variant-id.')
+        if options['restock']:
+            ProductVariant.objects.filter(id=variant.id).update(stock=variant.stock + options['payments'])
+        return variant
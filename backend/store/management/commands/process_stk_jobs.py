@@ -0,0 +1,61 @@
+"""
+Send STK push jobs that no web worker picked up (e.g. lost on a restart).
+
+Jobs left in ``processing`` by a worker that crashed or was recycled are
+requeued once their lease (``--lease`` seconds since they were claimed)
+runs out, and sent on the same sweep. Those Daraja had already accepted are
+recorded as sent instead, so the customer is not prompted twice.
+
+Usage:
+    python manage.py process_stk_jobs
+    python manage.py process_stk_jobs --older-than 30 --workers 4 --interval 15
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from store.management.periodic import PeriodicCommand
+from store.models import StkPushJob
+from store.payments import process_stk_job, record_stalled_stk_pushes, requeue_stalled_stk_jobs
+
+
+def _process(job_id):
+    try:
+        process_stk_job(job_id)
+    finally:
+        close_old_connections()
+
+
+class Command(PeriodicCommand):
+    help = 'Process queued STK push jobs that have been waiting too long.'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--older-than', type=int, default=30,
+                            help='Only pick up jobs queued at least this many seconds ago.')
+        parser.add_argument('--lease', type=int, default=120,
+                            help='Requeue jobs still processing this many seconds after being claimed.')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent Daraja calls.')
+        parser.add_argument('--limit', type=int, default=500, help='Jobs per sweep.')
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers']) as self.pool:
+            super().handle(*args, **options)
+
+    def run_once(self, **options):
+        recorded = record_stalled_stk_pushes(options['lease'])
+        if recorded:
+            self.stdout.write(f'Recorded {recorded} stalled STK push job(s) Daraja had accepted.')
+        requeued = requeue_stalled_stk_jobs(options['lease'])
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stalled STK push job(s).')
+        cutoff = timezone.now() - timedelta(seconds=options['older_than'])
+        job_ids = list(
+            StkPushJob.objects.filter(status='queued', created_at__lte=cutoff)
+            .order_by('created_at').values_list('id', flat=True)[:options['limit']]
+        )
+        list(self.pool.map(_process, job_ids))
+        self.stdout.write(f'Processed {len(job_ids)} queued STK push job(s).')
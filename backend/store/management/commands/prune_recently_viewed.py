@@ -0,0 +1,23 @@
+"""
+Delete recently-viewed rows older than the retention window.
+
+Usage:
+    python manage.py prune_recently_viewed
+    python manage.py prune_recently_viewed --days 30 --interval 3600
+"""
+
+from store.management.periodic import PeriodicCommand
+from store.tracking import prune_stale
+
+
+class Command(PeriodicCommand):
+    help = 'Prune stale recently-viewed history (abandoned sessions, inactive users).'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--days', type=int,
+                            help="Days of history to keep (default: RECENTLY_VIEWED['RETENTION_DAYS']).")
+
+    def run_once(self, **options):
+        deleted = prune_stale(days=options['days'])
+        self.stdout.write(f'Deleted {deleted} stale recently-viewed row(s).')
@@ -0,0 +1,40 @@
+"""
+Re-query Daraja for M-Pesa payments whose callback never arrived.
+
+Usage:
+    python manage.py reconcile_mpesa
+    python manage.py reconcile_mpesa --older-than 300 --workers 16 --rate 20
+    python manage.py reconcile_mpesa --interval 60
+"""
+
+import time
+
+from store.management.periodic import PeriodicCommand
+from store.payments import reconcile_pending
+
+
+class Command(PeriodicCommand):
+    help = 'Resolve pending M-Pesa transactions by querying their STK push status.'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--older-than', type=int, default=120,
+                            help='Only query transactions pending for at least this many seconds.')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent STK status queries.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Transactions per bulk update.')
+        parser.add_argument('--rate', type=int, default=0,
+                            help='Max STK queries per second across workers (0 = no limit).')
+
+    def run_once(self, **options):
+        started = time.monotonic()
+        counts = reconcile_pending(
+            older_than=options['older_than'],
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            rate=options['rate'],
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Reconciled in {elapsed:.1f}s: {counts['paid']} paid, "
+            f"{counts['failed']} failed, {counts['unresolved']} still pending."
+        )
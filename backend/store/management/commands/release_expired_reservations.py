@@ -0,0 +1,23 @@
+"""
+Release stock holds whose TTL has passed.
+
+Usage:
+    python manage.py release_expired_reservations
+    python manage.py release_expired_reservations --batch-size 1000 --interval 30
+"""
+
+from store.inventory import release_expired
+from store.management.periodic import PeriodicCommand
+
+
+class Command(PeriodicCommand):
+    help = 'Release expired stock reservations so abandoned checkouts free their stock.'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Holds released per UPDATE statement.')
+
+    def run_once(self, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(f'Released {released} expired reservation(s).')
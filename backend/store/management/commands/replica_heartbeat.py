@@ -0,0 +1,53 @@
+"""
+Write the heartbeat row that store.routing measures replica lag by.
+
+Keep it running whenever read replicas are configured: if it stops, every
+replica soon looks stale and reads fall back to the primary.
+
+With SQLITE_REPLICAS it also copies the primary database over each replica
+file after every beat, standing in for replication so routing can be tried
+locally. Stop it and reads move back to the primary once the copies are more
+than READ_REPLICAS['MAX_LAG'] seconds old.
+
+Usage:
+    python manage.py replica_heartbeat
+    python manage.py replica_heartbeat --interval 0.5
+    python manage.py replica_heartbeat --interval 0      # one beat, then exit
+"""
+
+import sqlite3
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from store.management.periodic import PeriodicCommand
+from store.models import ReplicaHeartbeat
+from store.routing import replica_aliases
+
+
+class Command(PeriodicCommand):
+    help = 'Write the replication heartbeat (and copy SQLite replicas) every interval.'
+    default_interval = 1
+
+    def handle(self, *args, **options):
+        self.sqlite_replicas = [
+            alias for alias in replica_aliases()
+            if connections[alias].vendor == 'sqlite'
+            and connections[alias].settings_dict['NAME'] != connections[DEFAULT_DB_ALIAS].settings_dict['NAME']
+        ]
+        super().handle(*args, **options)
+        self.stdout.write(f'Heartbeat written; {len(self.sqlite_replicas)} SQLite replica(s) copied.')
+
+    def run_once(self, **options):
+        ReplicaHeartbeat.objects.update_or_create(pk=1, defaults={'beat_at': timezone.now()})
+        for alias in self.sqlite_replicas:
+            self._copy(alias)
+
+    def _copy(self, alias):
+        primary = connections[DEFAULT_DB_ALIAS]
+        primary.ensure_connection()
+        target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+        try:
+            primary.connection.backup(target)
+        finally:
+            target.close()
@@ -0,0 +1,18 @@
+"""
+Roll product views and paid sales up into popularity scores.
+
+Usage:
+    python manage.py update_popularity
+    python manage.py update_popularity --interval 300
+"""
+
+from store.management.periodic import PeriodicCommand
+from store.popularity import update_popularity
+
+
+class Command(PeriodicCommand):
+    help = 'Recompute time-decayed product popularity and the cached best-seller list.'
+
+    def run_once(self, **options):
+        scored = update_popularity()
+        self.stdout.write(f'Scored {scored} product(s).')
@@ -0,0 +1,30 @@
+"""
+Base class for the store's sweep commands.
+
+Each sweep (reconciliation, reservation release, pruning, ...) runs once by
+default, for cron, or in a loop with ``--interval N`` under a process
+supervisor.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class PeriodicCommand(BaseCommand):
+    """Call ``run_once`` once, or every ``--interval`` seconds."""
+    default_interval = 0
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=self.default_interval,
+                            help='Seconds between runs; 0 runs once and exits.')
+
+    def handle(self, *args, **options):
+        while True:
+            self.run_once(**options)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def run_once(self, **options):
+        raise NotImplementedError('subclasses of PeriodicCommand must provide a run_once() method')
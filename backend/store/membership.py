@@ -0,0 +1,61 @@
+"""
+Batch "is in wishlist / is in cart" lookups for product cards.
+
+A viewer's wishlisted and carted product ids are loaded together with one
+``UNION ALL`` query over the indexed ``(user, product)`` and ``cart`` keys,
+then cached per user (or anonymous session) for
+``MEMBERSHIP_CACHE_TTL`` seconds. ``store.signals`` drops the entry whenever
+one of that viewer's wishlist or cart rows is saved or deleted.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Value
+
+from .models import CartItem, Wishlist
+
+WISHLIST, CART = 'w', 'c'
+
+
+def membership_key(user_id=None, session_key=None):
+    owner = f'user:{user_id}' if user_id else f'session:{session_key}'
+    return f'membership:{owner}'
+
+
+def _load(user_id, session_key):
+    if user_id:
+        in_cart = CartItem.objects.filter(cart__user_id=user_id)
+    else:
+        in_cart = CartItem.objects.filter(cart__session_key=session_key)
+    rows = in_cart.annotate(kind=Value(CART)).values_list('product_id', 'kind')
+    if user_id:
+        wished = Wishlist.objects.filter(user_id=user_id).annotate(kind=Value(WISHLIST))
+        rows = wished.values_list('product_id', 'kind').union(rows, all=True)
+
+    sets = {WISHLIST: set(), CART: set()}
+    for product_id, kind in rows:
+        sets[kind].add(str(product_id))
+    return sets
+
+
+def membership_sets(request):
+    """``{'w': {product ids}, 'c': {product ids}}`` for the requesting viewer."""
+    user_id = request.user.pk if request.user.is_authenticated else None
+    session_key = request.session.session_key
+    if not user_id and not session_key:
+        return {WISHLIST: set(), CART: set()}
+
+    key = membership_key(user_id, session_key)
+    sets = cache.get(key)
+    if sets is None:
+        sets = _load(user_id, session_key)
+        cache.set(key, sets, settings.MEMBERSHIP_CACHE_TTL)
+    return sets
+
+
+def membership_bitmaps(request, product_ids):
+    """One '0'/'1' character per requested id, in request order."""
+    sets = membership_sets(request)
+    return {
+        'wishlist': ''.join('1' if pid in sets[WISHLIST] else '0' for pid in product_ids),
+        'cart': ''.join('1' if pid in sets[CART] else '0' for pid in product_ids),
+    }
@@ -0,0 +1,37 @@
+"""
+Lightweight counters kept in the shared cache.
+
+Every worker adds to the same ``metrics:<name>`` keys (when ``REDIS_URL`` is
+set), so totals can be scraped from Redis or read with ``snapshot()``.
+Timings are recorded as a call count plus total milliseconds, which is enough
+to chart mean latency without a metrics server.
+"""
+import logging
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'metrics:'
+
+
+def incr(name, amount=1):
+    key = PREFIX + name
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # First hit for this key; another worker may create it concurrently.
+        if not cache.add(key, amount, timeout=None):
+            cache.incr(key, amount)
+
+
+def timing(name, seconds):
+    incr(f'{name}.count')
+    incr(f'{name}.ms', int(seconds * 1000))
+    logger.debug("%s took %.1fms", name, seconds * 1000)
+
+
+def snapshot(*names):
+    keys = [PREFIX + n for n in names]
+    values = cache.get_many(keys)
+    return {n: values.get(k, 0) for n, k in zip(names, keys)}
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-19 04:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('active', 'Active'), ('converted', 'Converted'), ('released', 'Released')], default='active', max_length=20)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.order')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.productvariant')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['variant', 'status', 'expires_at'], name='reservation_hold_idx'), models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-19 04:35
+
+from django.db import migrations, models
+
+
+# Legacy order numbers are 'PPK-' + 8 random digits; starting the sequence at
+# nine digits keeps every allocated number clear of them.
+ORDER_NUMBER_START = 100_000_000
+
+
+def create_order_number_sequence(apps, schema_editor):
+    Sequence = apps.get_model('store', 'Sequence')
+    Sequence.objects.get_or_create(name='order_number', defaults={'last_value': ORDER_NUMBER_START})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_stockreservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_order_number_sequence, migrations.RunPython.noop),
+    ]
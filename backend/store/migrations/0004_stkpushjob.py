@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-19 04:39
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StkPushJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('phone', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('processing', 'Processing'), ('sent', 'Sent'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('checkout_request_id', models.CharField(blank=True, max_length=200)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stk_push_jobs', to='store.order')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='stkjob_status_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-19 04:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_mpesacallback'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mpesatransaction',
+            index=models.Index(fields=['status', 'created_at'], name='mpesatx_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-19 04:47
+
+import django.contrib.auth.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('store', '0006_mpesatransaction_status_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LazyUser',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('auth.user',),
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import Lower, Trim
+
+
+# The lookup index matches the ``Lower('email')`` expression Django emits. The
+# uniqueness guard is partial because many accounts (admins, legacy users)
+# have no email; planners can't use it for lookups, hence two indexes.
+LOOKUP_INDEX = 'store_auth_user_email_lower_idx'
+UNIQUE_INDEX = 'store_auth_user_email_lower_uniq'
+
+
+def normalize_emails(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    normalized = Lower(Trim('email'))
+    # Checked up front: the unique index would otherwise fail with a bare IntegrityError.
+    duplicates = list(
+        User.objects.annotate(normalized=normalized).exclude(normalized='')
+        .values('normalized').annotate(users=Count('pk')).filter(users__gt=1)
+        .values_list('normalized', flat=True)[:20]
+    )
+    if duplicates:
+        raise RuntimeError(
+            f"More than one user has each of these emails (ignoring case and surrounding spaces): "
+            f"{', '.join(duplicates)}. Resolve the duplicates before migrating."
+        )
+    User.objects.update(email=normalized)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('store', '0007_lazyuser'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_emails, migrations.RunPython.noop),
+        migrations.RunSQL(
+            f"CREATE INDEX {LOOKUP_INDEX} ON auth_user (LOWER(email))",
+            f"DROP INDEX {LOOKUP_INDEX}",
+        ),
+        migrations.RunSQL(
+            f"CREATE UNIQUE INDEX {UNIQUE_INDEX} ON auth_user (LOWER(email)) WHERE email <> ''",
+            f"DROP INDEX {UNIQUE_INDEX}",
+        ),
+    ]
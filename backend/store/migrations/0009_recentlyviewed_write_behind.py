@@ -0,0 +1,41 @@
+# Generated by Django 5.0.7 on 2026-10-19 04:52
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def dedupe_session_views(apps, schema_editor):
+    # Keep the newest row of each (session_key, product) pair so the unique
+    # constraint can be added.
+    RecentlyViewed = apps.get_model('store', 'RecentlyViewed')
+    dupes = (
+        RecentlyViewed.objects.filter(session_key__isnull=False)
+        .values('session_key', 'product').annotate(rows=Count('pk'), keep=Max('pk')).filter(rows__gt=1)
+    )
+    for dupe in dupes:
+        RecentlyViewed.objects.filter(
+            session_key=dupe['session_key'], product=dupe['product']
+        ).exclude(pk=dupe['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_user_email_lower_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recentlyviewed',
+            name='viewed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(dedupe_session_views, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='recentlyviewed',
+            constraint=models.UniqueConstraint(fields=('session_key', 'product'), name='recentlyviewed_session_product_uniq'),
+        ),
+    ]
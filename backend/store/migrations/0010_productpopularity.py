@@ -0,0 +1,30 @@
+# Generated by Django 5.0.7 on 2026-10-19 04:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_recentlyviewed_write_behind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='store.product')),
+                ('pending_views', models.PositiveIntegerField(default=0)),
+                ('view_score', models.FloatField(default=0)),
+                ('sales_score', models.FloatField(default=0)),
+                ('score', models.FloatField(default=0)),
+                ('scored_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name_plural': 'Product popularity',
+                'indexes': [models.Index(fields=['-score'], name='popularity_score_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.7 on 2026-10-19 04:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_cart_session_key_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariantChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('price_drop', 'Price drop'), ('back_in_stock', 'Back in stock')], max_length=20)),
+                ('old_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('new_price', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variant_changes', to='store.product')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='store.productvariant')),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='variantchange_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.7 on 2026-10-19 04:58
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_reviews(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Review = apps.get_model('store', 'Review')
+    histograms = defaultdict(dict)
+    for row in Review.objects.values('product_id', 'rating').annotate(n=Count('id')).order_by():
+        histograms[row['product_id']][f"stars_{row['rating']}"] = row['n']
+    fields = [f'stars_{stars}' for stars in range(1, 6)]
+    products = [Product(pk=pk, **{**dict.fromkeys(fields, 0), **counts}) for pk, counts in histograms.items()]
+    Product.objects.bulk_update(products, fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_variantchange'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stars_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stars_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', '-created_at', '-id'], name='review_product_recent_idx'),
+        ),
+        migrations.RunPython(count_existing_reviews, migrations.RunPython.noop),
+    ]
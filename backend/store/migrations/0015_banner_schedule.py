@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-19 05:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_orderitem_order_product_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='banner',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, help_text='Leave empty to show until deactivated', null=True),
+        ),
+        migrations.AddField(
+            model_name='banner',
+            name='starts_at',
+            field=models.DateTimeField(blank=True, help_text='Leave empty to show immediately', null=True),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.7 on 2026-10-19 05:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_banner_schedule'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='order_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='product_active_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_featured', True)), fields=['-created_at'], name='product_featured_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_hot', True)), fields=['-created_at'], name='product_hot_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_new', True)), fields=['-created_at'], name='product_new_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productvariant',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['product', 'price'], name='variant_product_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recentlyviewed',
+            index=models.Index(condition=models.Q(('user__isnull', False)), fields=['user', '-viewed_at'], name='recentlyviewed_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recentlyviewed',
+            index=models.Index(condition=models.Q(('session_key__isnull', False)), fields=['session_key', '-viewed_at'], name='recentlyviewed_session_idx'),
+        ),
+    ]
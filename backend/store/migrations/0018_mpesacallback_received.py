@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-19 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_replicaheartbeat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mpesacallback',
+            name='outcome',
+            field=models.CharField(choices=[('received', 'Received'), ('applied', 'Applied'), ('duplicate', 'Duplicate'), ('unknown', 'Unknown transaction')], default='received', max_length=20),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from django.utils.text import slugify
 import uuid
 
@@ -65,47 +66,78 @@ class Product(models.Model):
     is_hot = models.BooleanField(default=False)
     is_new = models.BooleanField(default=False)
     tags = models.CharField(max_length=500, blank=True, help_text="Comma-separated tags")
+    # Review counts per star rating, maintained by store.signals
+    stars_1 = models.PositiveIntegerField(default=0, editable=False)
+    stars_2 = models.PositiveIntegerField(default=0, editable=False)
+    stars_3 = models.PositiveIntegerField(default=0, editable=False)
+    stars_4 = models.PositiveIntegerField(default=0, editable=False)
+    stars_5 = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        # Storefront listings: active products (optionally one flag) newest first.
+        indexes = [
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True), name='product_active_recent_idx'),
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True, is_featured=True),
+                         name='product_featured_recent_idx'),
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True, is_hot=True),
+                         name='product_hot_recent_idx'),
+            models.Index(fields=['-created_at'], condition=models.Q(is_active=True, is_new=True),
+                         name='product_new_recent_idx'),
+        ]
+
+    STAR_FIELDS = ('stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5')
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
         if not self.sku:
             self.sku = f"PPK-{str(self.id)[:8].upper()}"
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The star counts are only written by store.signals' F() updates: a full save
+            # (admin form, script) of an instance loaded before a review would undo them.
+            skip = {*self.STAR_FIELDS, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields if not f.primary_key and f.name not in skip
+            ]
         super().save(*args, **kwargs)
 
+    # The three below read ``variants.all()``/``images.all()`` so a list's
+    # prefetch of images and (active) variants serves every product at once.
+    def _active_prices(self):
+        return [v.sale_price or v.price for v in self.variants.all() if v.is_active]
+
     @property
     def min_price(self):
-        variants = self.variants.filter(is_active=True)
-        if variants.exists():
-            prices = [v.sale_price or v.price for v in variants]
-            return min(prices)
-        return None
+        prices = self._active_prices()
+        return min(prices) if prices else None
 
     @property
     def max_price(self):
-        variants = self.variants.filter(is_active=True)
-        if variants.exists():
-            prices = [v.sale_price or v.price for v in variants]
-            return max(prices)
-        return None
+        prices = self._active_prices()
+        return max(prices) if prices else None
 
     @property
     def main_image(self):
-        img = self.images.filter(is_primary=True).first()
-        if img:
-            return img
-        return self.images.first()
+        images = list(self.images.all())
+        return next((img for img in images if img.is_primary), images[0] if images else None)
+
+    @property
+    def rating_histogram(self):
+        return {stars: getattr(self, f'stars_{stars}') for stars in range(1, 6)}
+
+    @property
+    def review_count(self):
+        return sum(self.rating_histogram.values())
 
     @property
     def average_rating(self):
-        reviews = self.reviews.all()
-        if reviews.exists():
-            return round(sum(r.rating for r in reviews) / reviews.count(), 1)
+        histogram = self.rating_histogram
+        total = sum(histogram.values())
+        if total:
+            return round(sum(stars * count for stars, count in histogram.items()) / total, 1)
         return 0
 
     def __str__(self):
@@ -125,6 +157,12 @@ class ProductVariant(models.Model):
 
     class Meta:
         ordering = ['price']
+        # Active variants of a product by price. Partial rather than (product, is_active): boolean
+        # filters compile to a bare column, which SQLite can't match against an index column.
+        indexes = [
+            models.Index(fields=['product', 'price'], condition=models.Q(is_active=True),
+                         name='variant_product_active_idx'),
+        ]
 
     @property
     def effective_price(self):
@@ -184,6 +222,7 @@ class Review(models.Model):
     class Meta:
         unique_together = ['product', 'user']
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['product', '-created_at', '-id'], name='review_product_recent_idx')]
 
     def __str__(self):
         return f"{self.user.username} review on {self.product.name}"
@@ -198,6 +237,8 @@ class Banner(models.Model):
     link = models.CharField(max_length=500, blank=True)
     position = models.CharField(max_length=20, choices=POSITION_CHOICES, default='hero')
     is_active = models.BooleanField(default=True)
+    starts_at = models.DateTimeField(null=True, blank=True, help_text="Leave empty to show immediately")
+    ends_at = models.DateTimeField(null=True, blank=True, help_text="Leave empty to show until deactivated")
     order = models.PositiveIntegerField(default=0)
     badge_text = models.CharField(max_length=50, blank=True, help_text="e.g. NEW INSTOCK, FRESH DEAL")
     badge_color = models.CharField(max_length=20, default='green')
@@ -209,10 +250,13 @@ class Banner(models.Model):
     def __str__(self):
         return self.title
 
+    def is_live(self, at):
+        return (self.starts_at is None or self.starts_at <= at) and (self.ends_at is None or at < self.ends_at)
+
 
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True, related_name='cart')
-    session_key = models.CharField(max_length=40, null=True, blank=True)
+    session_key = models.CharField(max_length=40, null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -298,17 +342,27 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['user', '-created_at'], name='order_user_recent_idx')]
 
     def save(self, *args, **kwargs):
         if not self.order_number:
-            import random, string
-            self.order_number = 'PPK-' + ''.join(random.choices(string.digits, k=8))
+            from .sequences import allocate_order_number
+            self.order_number = allocate_order_number()
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.order_number
 
 
+class Sequence(models.Model):
+    """Named counter handed out to workers in blocks (see store.sequences)."""
+    name = models.CharField(max_length=50, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_value}"
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
@@ -318,6 +372,9 @@ class OrderItem(models.Model):
     price = models.DecimalField(max_digits=12, decimal_places=2)
     quantity = models.PositiveIntegerField()
 
+    class Meta:
+        indexes = [models.Index(fields=['order', 'product'], name='orderitem_order_product_idx')]
+
     @property
     def subtotal(self):
         return self.price * self.quantity
@@ -330,16 +387,59 @@ class RecentlyViewed(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='recently_viewed')
     session_key = models.CharField(max_length=40, null=True, blank=True)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    viewed_at = models.DateTimeField(auto_now=True)
+    viewed_at = models.DateTimeField(default=timezone.now)   # Set by store.tracking when the view happened
 
     class Meta:
         ordering = ['-viewed_at']
         unique_together = ['user', 'product']
+        constraints = [
+            models.UniqueConstraint(fields=['session_key', 'product'], name='recentlyviewed_session_product_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-viewed_at'], condition=models.Q(user__isnull=False),
+                         name='recentlyviewed_user_idx'),
+            models.Index(fields=['session_key', '-viewed_at'], condition=models.Q(session_key__isnull=False),
+                         name='recentlyviewed_session_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} viewed"
 
 
+class ProductPopularity(models.Model):
+    """Rolled-up demand signal per product; see store/popularity.py."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    pending_views = models.PositiveIntegerField(default=0)   # Flushed from store.tracking, not yet scored
+    view_score = models.FloatField(default=0)                # Time-decayed view count
+    sales_score = models.FloatField(default=0)               # Time-decayed units sold (paid orders)
+    score = models.FloatField(default=0)
+    scored_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = 'Product popularity'
+        indexes = [models.Index(fields=['-score'], name='popularity_score_idx')]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.score:.1f}"
+
+
+class LazyUser(User):
+    """
+    A ``User`` known only by its id (built from JWT claims).
+
+    Every other column is deferred; the first access to any of them loads the
+    whole row in one query, so views that never touch the user stay query-free.
+    """
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred.intersection(fields):
+            fields = list(deferred | set(fields))
+        super().refresh_from_db(using=using, fields=fields)
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     phone = models.CharField(max_length=20, blank=True)
@@ -367,10 +467,70 @@ class MpesaTransaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'], name='mpesatx_status_created_idx')]
+
     def __str__(self):
         return f"M-Pesa {self.checkout_request_id} - {self.status}"
 
 
+class MpesaCallback(models.Model):
+    """Raw journal of every STK callback Safaricom delivers, including redeliveries."""
+    OUTCOME_CHOICES = [
+        ('received', 'Received'), ('applied', 'Applied'), ('duplicate', 'Duplicate'),
+        ('unknown', 'Unknown transaction'),
+    ]
+    checkout_request_id = models.CharField(max_length=200, db_index=True)
+    result_code = models.CharField(max_length=10, blank=True)
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES, default='received')
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Callback {self.checkout_request_id} ({self.outcome})"
+
+
+class StkPushJob(models.Model):
+    """An STK push request queued for a background worker."""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'), ('processing', 'Processing'), ('sent', 'Sent'), ('failed', 'Failed'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stk_push_jobs')
+    phone = models.CharField(max_length=20)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    checkout_request_id = models.CharField(max_length=200, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'], name='stkjob_status_created_idx')]
+
+    def __str__(self):
+        return f"STK push {self.id} - {self.status}"
+
+
+class StockReservation(models.Model):
+    """A time-limited hold on variant stock while an order awaits payment."""
+    STATUS_CHOICES = [('active', 'Active'), ('converted', 'Converted'), ('released', 'Released')]
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['variant', 'status', 'expires_at'], name='reservation_hold_idx'),
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x {self.variant_id} for {self.order_id} ({self.status})"
+
+
 class Wishlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wishlist')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -380,4 +540,33 @@ class Wishlist(models.Model):
         unique_together = ['user', 'product']
 
     def __str__(self):
-        return f"{self.user.username} - {self.product.name}"
\ No newline at end of file
+        return f"{self.user.username} - {self.product.name}"
+
+
+class VariantChange(models.Model):
+    """A wishlist-worthy change to a variant, awaiting store.notifications."""
+    KIND_CHOICES = [('price_drop', 'Price drop'), ('back_in_stock', 'Back in stock')]
+
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='changes')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variant_changes')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    old_price = models.DecimalField(max_digits=12, decimal_places=2)
+    new_price = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='variantchange_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} on {self.variant_id}"
+
+
+class ReplicaHeartbeat(models.Model):
+    """Single row rewritten on the primary; its age on a replica is the replica's lag (see store.routing)."""
+    beat_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Heartbeat at {self.beat_at}"
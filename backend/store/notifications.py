@@ -0,0 +1,115 @@
+"""
+Wishlist price-drop and back-in-stock emails.
+
+``store.signals`` records each price drop or restock of a saved variant as a
+``VariantChange``. ``notify_wishlists`` (``python manage.py
+notify_wishlists``) claims a batch of pending changes, joins them against
+``Wishlist`` in one streamed query ordered by user, and sends one email per
+user over a single SMTP connection. Each email names the latest change per
+variant, and a price drop is left out if the price has moved since.
+
+Changes are claimed before anything is sent, so delivery is at most once: a
+crash or SMTP failure mid-batch skips the remaining users rather than
+emailing anyone twice. Stock changed with ``QuerySet.update()`` (checkout,
+reservation settlement) bypasses the signals; those only ever reduce stock.
+"""
+import logging
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import VariantChange
+
+logger = logging.getLogger(__name__)
+
+ROW_FIELDS = [
+    'product__wishlist__user_id', 'product__wishlist__user__email', 'product__wishlist__user__first_name',
+    'kind', 'variant_id', 'product__name', 'variant__name', 'old_price', 'new_price',
+    'variant__price', 'variant__sale_price',
+]
+
+
+def claim_changes(batch_size):
+    """Mark up to ``batch_size`` pending changes processed; returns their ids."""
+    with transaction.atomic():
+        ids = list(
+            VariantChange.objects.select_for_update()
+            .filter(processed_at__isnull=True).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        VariantChange.objects.filter(id__in=ids).update(processed_at=timezone.now())
+    return ids
+
+
+def wishlist_rows(change_ids):
+    """(user, change) pairs for every wishlist watching a changed product, grouped by user."""
+    return (
+        VariantChange.objects.filter(
+            id__in=change_ids,
+            product__is_active=True,
+            variant__is_active=True,
+            product__wishlist__user__is_active=True,
+            product__wishlist__user__email__gt='',
+        )
+        .order_by('product__wishlist__user_id', 'id')
+        .values_list(*ROW_FIELDS)
+        .iterator(chunk_size=2000)
+    )
+
+
+def build_message(email, first_name, rows):
+    """One user's email, or None if none of their changes still hold."""
+    latest, first_old_price = {}, {}
+    for row in rows:   # Ordered by change id, so later changes win.
+        latest[row[3:5]] = row
+        first_old_price.setdefault(row[3:5], row[7])
+    lines = []
+    for key, (*_, kind, _, product_name, variant_name, _, new_price, price, sale_price) in latest.items():
+        old_price = first_old_price[key]
+        if kind == 'price_drop':
+            if new_price != (sale_price or price):
+                continue   # The price has moved again since this drop.
+            lines.append(f"- {product_name} ({variant_name}) is now KES {new_price:,.0f}, down from KES {old_price:,.0f}")
+        else:
+            lines.append(f"- {product_name} ({variant_name}) is back in stock at KES {new_price:,.0f}")
+    if not lines:
+        return None
+    body = (
+        f"Hi {first_name or 'there'},\n\n"
+        "Good news about items on your wishlist:\n\n"
+        + "\n".join(lines)
+        + "\n\nPhonePlace Kenya"
+    )
+    return EmailMessage("Good news about your wishlist", body, settings.DEFAULT_FROM_EMAIL, [email])
+
+
+def notify_wishlists(batch_size=1000, send_chunk=200):
+    """Email users about one batch of changes; returns ``(changes, emails_sent)``."""
+    change_ids = claim_changes(batch_size)
+    if not change_ids:
+        return 0, 0
+
+    sent = 0
+    pending = []
+    with get_connection() as connection:
+        for (_, email, first_name), rows in groupby(wishlist_rows(change_ids), key=lambda row: row[:3]):
+            message = build_message(email, first_name, list(rows))
+            if message is not None:
+                pending.append(message)
+            if len(pending) >= send_chunk:
+                sent += _send(connection, pending)
+                pending = []
+        sent += _send(connection, pending)
+    return len(change_ids), sent
+
+
+def _send(connection, messages):
+    if not messages:
+        return 0
+    try:
+        return connection.send_messages(messages) or 0
+    except Exception:
+        logger.exception("Could not send %d wishlist notification(s)", len(messages))
+        return 0
@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ReviewCursorPagination(CursorPagination):
+    """Newest reviews first; cursors stay stable as new reviews arrive."""
+    page_size = 10
+    max_page_size = 50
+    page_size_query_param = 'page_size'
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,271 @@
+"""
+M-Pesa payment flow.
+
+``enqueue_stk_push`` records an ``StkPushJob`` and hands it to the background
+pool; ``process_stk_job`` sends it to Daraja at no more than
+``MPESA_STK_RATE_LIMIT`` requests per second and records the resulting
+``MpesaTransaction``. Clients poll the job for the outcome.
+``requeue_stalled_stk_jobs`` hands jobs whose worker died mid-send back to
+the queue, for ``process_stk_jobs`` to send again; jobs Daraja had already
+accepted are recorded by ``record_stalled_stk_pushes`` instead of re-pushed.
+
+``record_stk_callback`` ingests Safaricom's result callback. Every delivery is
+journaled in ``MpesaCallback`` first, and the entry's ``outcome`` stays
+``received`` if applying it fails. The transaction row is then locked and
+only a ``pending`` transaction is updated, so redeliveries are no-ops. The
+order's stock holds are converted or released in the same transaction, so a
+paid order can never be left with holds for the expiry sweep to release.
+
+``reconcile_pending`` recovers payments whose callback never arrived by
+querying Daraja for the STK status of old pending transactions.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import tasks
+from .daraja import DarajaError, get_client
+from .inventory import convert_reservations, release_reservations
+from .models import MpesaCallback, MpesaTransaction, Order, StkPushJob
+
+logger = logging.getLogger(__name__)
+
+stk_rate_limiter = tasks.RateLimiter('mpesa_stk_push', settings.MPESA_STK_RATE_LIMIT)
+
+
+def enqueue_stk_push(order, phone):
+    job = StkPushJob.objects.create(order=order, phone=phone)
+    transaction.on_commit(lambda: tasks.submit(process_stk_job, job.id))
+    return job
+
+
+def process_stk_job(job_id):
+    # Claim the job so a recovery sweep and the pool never send it twice.
+    claimed = StkPushJob.objects.filter(id=job_id, status='queued').update(status='processing')
+    if not claimed:
+        return
+    job = StkPushJob.objects.select_related('order').get(id=job_id)
+    order = job.order
+
+    stk_rate_limiter.acquire()
+    try:
+        data = get_client().stk_push(
+            phone=job.phone,
+            amount=int(order.total),
+            account_reference=order.order_number,
+            description=f"Payment for order {order.order_number}",
+        )
+        if data.get('ResponseCode') != '0':
+            _finish(job, 'failed', error=data.get('errorMessage') or data.get('ResponseDescription') or str(data))
+            return
+        # Record the push before anything else can fail, so a crash from here
+        # on is recovered by recording the transaction rather than pushing again.
+        job.checkout_request_id = data['CheckoutRequestID']
+        StkPushJob.objects.filter(id=job.id).update(checkout_request_id=job.checkout_request_id)
+        _record_push(job, data.get('MerchantRequestID', ''))
+    except DarajaError as e:
+        logger.warning("STK push for order %s failed: %s", order.order_number, e)
+        _finish(job, 'failed', error=str(e))
+    except Exception as e:
+        if job.checkout_request_id:
+            # The customer has the prompt; leave the job for record_stalled_stk_pushes.
+            logger.exception("Recording STK push %s for order %s failed", job.checkout_request_id, order.order_number)
+        else:
+            logger.exception("STK push for order %s failed", order.order_number)
+            _finish(job, 'failed', error=str(e))
+
+
+def _record_push(job, merchant_request_id=''):
+    order = job.order
+    with transaction.atomic():
+        MpesaTransaction.objects.get_or_create(
+            checkout_request_id=job.checkout_request_id,
+            defaults={
+                'order': order,
+                'merchant_request_id': merchant_request_id,
+                'amount': order.total,
+                'phone': job.phone,
+            },
+        )
+        order.mpesa_checkout_request_id = job.checkout_request_id
+        order.mpesa_phone = job.phone
+        order.save(update_fields=['mpesa_checkout_request_id', 'mpesa_phone', 'updated_at'])
+        _finish(job, 'sent', checkout_request_id=job.checkout_request_id)
+
+
+def requeue_stalled_stk_jobs(lease):
+    """Requeue jobs stuck in ``processing`` for over ``lease`` seconds; returns the count.
+
+    Only jobs that never got a ``CheckoutRequestID`` are requeued; those that
+    did were already pushed and are left to ``record_stalled_stk_pushes``.
+    The lease must outlast a Daraja call (timeouts, retries and rate limiting
+    included): a job requeued while its worker is still sending is pushed twice.
+    """
+    now = timezone.now()
+    return StkPushJob.objects.filter(
+        status='processing', checkout_request_id='', updated_at__lte=now - timedelta(seconds=lease)
+    ).update(status='queued', updated_at=now)
+
+
+def record_stalled_stk_pushes(lease):
+    """Finish jobs Daraja accepted but whose worker died before recording them; returns the count.
+
+    The ``MpesaTransaction`` is created as pending, so the callback or
+    ``reconcile_pending`` settles it like any other push.
+    """
+    jobs = StkPushJob.objects.select_related('order').filter(
+        status='processing', updated_at__lte=timezone.now() - timedelta(seconds=lease)
+    ).exclude(checkout_request_id='')
+    recorded = 0
+    for job in jobs:
+        _record_push(job)
+        recorded += 1
+    return recorded
+
+
+def _finish(job, status, **fields):
+    for name, value in fields.items():
+        setattr(job, name, value)
+    job.status = status
+    job.save(update_fields=['status', 'updated_at', *fields])
+
+
+def record_stk_callback(payload):
+    """Journal and apply one STK callback; returns the journal entry."""
+    stk = payload.get('Body', {}).get('stkCallback', {})
+    checkout_request_id = stk.get('CheckoutRequestID') or ''
+    result_code = str(stk.get('ResultCode', ''))
+    result_desc = stk.get('ResultDesc', '')
+    items = {i['Name']: i.get('Value', '') for i in stk.get('CallbackMetadata', {}).get('Item', [])}
+
+    # Journal first, on its own, so a delivery is on record even if applying it fails.
+    entry = MpesaCallback.objects.create(
+        checkout_request_id=checkout_request_id,
+        result_code=result_code,
+        payload=payload,
+    )
+    with transaction.atomic():
+        tx = (
+            MpesaTransaction.objects.select_for_update()
+            .select_related('order')
+            .filter(checkout_request_id=checkout_request_id)
+            .first()
+        )
+        if tx is None:
+            entry.outcome = 'unknown'
+        elif tx.status != 'pending':
+            entry.outcome = 'duplicate'
+        else:
+            entry.outcome = 'applied'
+            apply_stk_result(tx, result_code, result_desc, str(items.get('MpesaReceiptNumber', '')))
+        entry.save(update_fields=['outcome'])
+    return entry
+
+
+def apply_stk_result(tx, result_code, result_desc, receipt=''):
+    """Move a locked pending transaction (and its order) to its final state."""
+    tx.result_code = result_code
+    tx.result_desc = result_desc
+    paid = result_code == '0'
+    if paid:
+        tx.status = 'success'
+        tx.mpesa_receipt = receipt
+        order = tx.order
+        order.payment_status = 'paid'
+        order.status = 'confirmed'
+        order.mpesa_transaction_id = receipt
+        order.save(update_fields=['payment_status', 'status', 'mpesa_transaction_id', 'updated_at'])
+    else:
+        tx.status = 'failed'
+    tx.save(update_fields=['result_code', 'result_desc', 'status', 'mpesa_receipt', 'updated_at'])
+    settle_order_stock(tx.order, paid)
+
+
+def settle_order_stock(order, paid):
+    """Follow-up to a payment result: turn holds into sales, or release them."""
+    if paid:
+        convert_reservations(order)
+    else:
+        release_reservations(order)
+
+
+def _query_status(client, limiter, checkout_request_id):
+    if limiter:
+        limiter.acquire()
+    try:
+        return client.stk_query(checkout_request_id)
+    except DarajaError as e:
+        logger.info("STK query for %s failed: %s", checkout_request_id, e)
+        return None
+    finally:
+        close_old_connections()
+
+
+def reconcile_pending(older_than=120, workers=8, batch_size=500, rate=0):
+    """
+    Resolve pending transactions older than ``older_than`` seconds.
+
+    Transactions are scanned in primary-key batches through the
+    ``(status, created_at)`` index, queried concurrently on a bounded thread
+    pool and written back with one bulk update per batch. Transactions that
+    Daraja still reports as in progress stay pending for the next run.
+    Returns ``{'paid': n, 'failed': n, 'unresolved': n}``.
+    """
+    client = get_client()
+    limiter = tasks.RateLimiter('mpesa_stk_query', rate) if rate else None
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    counts = {'paid': 0, 'failed': 0, 'unresolved': 0}
+    last_pk = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = list(
+                MpesaTransaction.objects.filter(status='pending', created_at__lte=cutoff, pk__gt=last_pk)
+                .order_by('pk').values_list('pk', 'checkout_request_id')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+
+            results = pool.map(lambda row: _query_status(client, limiter, row[1]), batch)
+            outcomes = {}
+            for (pk, _), data in zip(batch, results):
+                result_code = None if data is None else data.get('ResultCode')
+                if result_code is None or result_code == '':
+                    counts['unresolved'] += 1
+                else:
+                    outcomes[pk] = (str(result_code), data.get('ResultDesc', ''))
+
+            paid, failed = _apply_batch(outcomes)
+            counts['paid'] += paid
+            counts['failed'] += failed
+    return counts
+
+
+def _apply_batch(outcomes):
+    if not outcomes:
+        return 0, 0
+    now = timezone.now()
+    with transaction.atomic():
+        # Skip anything a late callback settled while we were querying.
+        txs = list(MpesaTransaction.objects.select_for_update().filter(pk__in=outcomes, status='pending'))
+        for tx in txs:
+            tx.result_code, tx.result_desc = outcomes[tx.pk]
+            tx.status = 'success' if tx.result_code == '0' else 'failed'
+            tx.updated_at = now
+        MpesaTransaction.objects.bulk_update(txs, ['result_code', 'result_desc', 'status', 'updated_at'])
+
+        paid_orders = [tx.order_id for tx in txs if tx.status == 'success']
+        failed_orders = [tx.order_id for tx in txs if tx.status == 'failed']
+        Order.objects.filter(pk__in=paid_orders).update(payment_status='paid', status='confirmed', updated_at=now)
+
+        orders = Order.objects.in_bulk(paid_orders + failed_orders)
+        for order_id in paid_orders:
+            settle_order_stock(orders[order_id], True)
+        for order_id in failed_orders:
+            settle_order_stock(orders[order_id], False)
+    return len(paid_orders), len(failed_orders)
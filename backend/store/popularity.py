@@ -0,0 +1,108 @@
+"""
+Data-driven product popularity.
+
+``update_popularity`` is a periodic rollup (``python manage.py
+update_popularity``) that folds two demand signals into
+``ProductPopularity.score``:
+
+* views, counted by ``store.tracking`` into ``pending_views``. They are added
+  to ``view_score``, which decays with a half-life of ``HALF_LIFE_DAYS``.
+* units sold on paid orders over the last ``SALES_WINDOW_DAYS``. They are
+  aggregated per product and day in one query and weighted by the same decay.
+
+``score = view_score + SALE_WEIGHT * sales_score``. The rollup caches the
+ids of the top ``TOP_N`` products; ``best_sellers`` serves that list without
+touching ``OrderItem``, and search results are ranked by the stored score.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import OrderItem, ProductPopularity
+
+TOP_CACHE_KEY = 'popularity:top'
+
+DEFAULTS = {
+    'HALF_LIFE_DAYS': 7,
+    'SALE_WEIGHT': 20,          # one unit sold counts as this many views
+    'SALES_WINDOW_DAYS': 60,
+    'TOP_N': 100,
+    'TOP_CACHE_TTL': 10 * 60,   # seconds; workers re-read the table after this
+}
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'POPULARITY', {})}
+
+
+def decay(age_days, half_life):
+    return 0.5 ** (max(age_days, 0) / half_life)
+
+
+def sales_scores(now, config):
+    """Decayed units sold per product over the sales window."""
+    since = now - timedelta(days=config['SALES_WINDOW_DAYS'])
+    daily = (
+        OrderItem.objects.filter(order__payment_status='paid', order__created_at__gte=since, product__isnull=False)
+        .annotate(day=TruncDate('order__created_at'))
+        .values_list('product_id', 'day')
+        .annotate(units=Sum('quantity'))
+        .order_by()
+    )
+    today = timezone.localdate(now)
+    scores = defaultdict(float)
+    for product_id, day, units in daily:
+        scores[product_id] += units * decay((today - day).days, config['HALF_LIFE_DAYS'])
+    return scores
+
+
+def update_popularity():
+    """Recompute every product's score and refresh the cached top-N list."""
+    config = _config()
+    now = timezone.now()
+    sales = sales_scores(now, config)
+
+    with transaction.atomic():
+        ProductPopularity.objects.bulk_create(
+            [ProductPopularity(product_id=product_id) for product_id in sales], ignore_conflicts=True
+        )
+        rows = list(ProductPopularity.objects.select_for_update())
+        for row in rows:
+            elapsed_days = (now - row.scored_at).total_seconds() / 86400
+            row.view_score = row.view_score * decay(elapsed_days, config['HALF_LIFE_DAYS']) + row.pending_views
+            row.sales_score = sales.get(row.product_id, 0.0)
+            row.score = row.view_score + config['SALE_WEIGHT'] * row.sales_score
+            # Subtract what was scored rather than zeroing, so views flushed
+            # concurrently are kept for the next run.
+            row.pending_views = F('pending_views') - row.pending_views
+            row.scored_at = now
+        ProductPopularity.objects.bulk_update(
+            rows, ['view_score', 'sales_score', 'score', 'pending_views', 'scored_at'], batch_size=500
+        )
+
+    cache.set(TOP_CACHE_KEY, _top_from_table(config), config['TOP_CACHE_TTL'])
+    return len(rows)
+
+
+def _top_from_table(config):
+    return [
+        str(product_id) for product_id in
+        ProductPopularity.objects.filter(score__gt=0, product__is_active=True)
+        .order_by('-score').values_list('product_id', flat=True)[:config['TOP_N']]
+    ]
+
+
+def top_product_ids(limit=None):
+    """Ids of the most popular active products, best first."""
+    config = _config()
+    ids = cache.get(TOP_CACHE_KEY)
+    if ids is None:
+        ids = _top_from_table(config)
+        cache.set(TOP_CACHE_KEY, ids, config['TOP_CACHE_TTL'])
+    return ids[:limit] if limit else ids
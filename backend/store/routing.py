@@ -0,0 +1,169 @@
+"""
+Read-replica routing.
+
+Installed when replicas are configured (``DB_REPLICA_HOSTS`` or
+``SQLITE_REPLICAS``, see settings). ``ReplicaPinningMiddleware`` marks GET/HEAD
+requests as safe to read from a replica; ``ReplicaRouter`` then sends their
+reads to one replica per request. Everything else stays on the primary:
+writes, any request that is not a safe method, management commands and
+background tasks, reads inside ``transaction.atomic()``, and
+``select_for_update``.
+
+Read-your-writes: once a request writes, its remaining reads go to the
+primary, and the client's next requests are pinned there for ``PIN_SECONDS``.
+That covers, for example, adding to the cart and then reloading it. A client
+with a valid bearer token is pinned by user id in the shared cache, so the pin
+follows the token to other tabs, devices and workers. Anonymous clients get a
+short-lived cookie instead.
+
+Lag: ``python manage.py replica_heartbeat`` rewrites a ``ReplicaHeartbeat``
+row on the primary every second. A replica whose copy of that row is older
+than ``MAX_LAG`` seconds, or that can't be reached, gets no reads until a
+later check (every ``CHECK_INTERVAL`` seconds per process) finds it caught
+up. If the heartbeat stops, every replica looks stale and all reads fall back
+to the primary.
+"""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+from .authentication import StatelessJWTAuthentication
+from .models import ReplicaHeartbeat
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'MAX_LAG': 5,           # seconds behind the primary before a replica is skipped
+    'CHECK_INTERVAL': 2,    # seconds between lag checks of each replica
+    'PIN_SECONDS': 5,       # how long a client reads from the primary after writing
+}
+PIN_COOKIE = 'primary_pin'
+
+_state = threading.local()
+_health = {}    # alias -> (checked at, usable)
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'READ_REPLICAS', {})}
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+
+
+def replica_lag(alias):
+    """Seconds since the heartbeat this replica has seen, or None if unknown."""
+    try:
+        beat_at = ReplicaHeartbeat.objects.using(alias).values_list('beat_at', flat=True).first()
+    except DatabaseError:
+        logger.warning("Replica %s is unreachable", alias, exc_info=True)
+        return None
+    return None if beat_at is None else (timezone.now() - beat_at).total_seconds()
+
+
+def usable_replicas():
+    config = _config()
+    now = time.monotonic()
+    usable = []
+    for alias in replica_aliases():
+        checked_at, ok = _health.get(alias, (None, False))
+        if checked_at is None or now - checked_at >= config['CHECK_INTERVAL']:
+            lag = replica_lag(alias)
+            ok = lag is not None and lag <= config['MAX_LAG']
+            if not ok:
+                logger.info("Reading from the primary instead of %s (lag: %s)", alias, lag)
+            _health[alias] = (now, ok)
+        if ok:
+            usable.append(alias)
+    return usable
+
+
+def begin_request(replica_reads):
+    _state.replica_reads = replica_reads
+    _state.replica = None
+    _state.wrote = False
+
+
+def end_request():
+    """Stop routing this thread's reads; returns whether the request wrote."""
+    wrote = getattr(_state, 'wrote', False)
+    begin_request(False)
+    return wrote
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not getattr(_state, 'replica_reads', False) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if _state.replica is None:
+            usable = usable_replicas()
+            _state.replica = random.choice(usable) if usable else DEFAULT_DB_ALIAS
+        return _state.replica
+
+    def db_for_write(self, model, **hints):
+        # Read-your-writes: the rest of this request reads the primary.
+        _state.replica_reads = False
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        return db == DEFAULT_DB_ALIAS
+
+
+def pin_key(user_id):
+    return f'routing:pin:{user_id}'
+
+
+def token_user_id(request):
+    """The user id in the request's bearer token if it verifies, else None; no queries."""
+    auth = StatelessJWTAuthentication()
+    header = auth.get_header(request)
+    raw_token = None if header is None else auth.get_raw_token(header)
+    if raw_token is None:
+        return None
+    try:
+        return auth.get_validated_token(raw_token)[api_settings.USER_ID_CLAIM]
+    except (AuthenticationFailed, KeyError):
+        return None
+
+
+class ReplicaPinningMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        safe = request.method in ('GET', 'HEAD', 'OPTIONS')
+        user_id = token_user_id(request)
+        if not safe:
+            pinned = True
+        elif user_id is not None:
+            pinned = cache.get(pin_key(user_id)) is not None
+        else:
+            pinned = PIN_COOKIE in request.COOKIES
+        begin_request(not pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = end_request()
+        if wrote or not safe:
+            seconds = _config()['PIN_SECONDS']
+            if user_id is not None:
+                cache.set(pin_key(user_id), 1, timeout=seconds)
+            else:
+                response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,86 @@
+"""
+Block-allocated sequences.
+
+Each worker process claims a contiguous block of values from a ``Sequence``
+row with a single ``UPDATE ... SET last_value = last_value + block`` and then
+hands them out from memory. The UPDATE takes the row (or, on SQLite, database)
+write lock, so two processes can never receive the same block and no retry
+loop is needed; values are unique and increase within a process, with gaps
+left by blocks a process did not use up before exiting.
+
+A block is only cached when it is claimed outside any transaction. Inside an
+outer ``atomic()`` (the admin, scripts) a rollback would rewind the counter
+while this process kept handing out the block, and the next process to claim
+would get the same values. So there the allocator claims a single value
+instead, which a rollback un-claims together with the row that used it.
+Checkout allocates before opening its transaction, so it still gets blocks.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import Sequence
+
+
+class BlockAllocator:
+    def __init__(self, name, block_size):
+        self.name = name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = -1
+        self._pid = None
+        self.refills = 0
+
+    def _claim(self, size):
+        """Advance the counter by ``size``; returns its new value."""
+        with transaction.atomic():
+            updated = Sequence.objects.filter(name=self.name).update(last_value=F('last_value') + size)
+            if not updated:
+                Sequence.objects.get_or_create(name=self.name)
+                Sequence.objects.filter(name=self.name).update(last_value=F('last_value') + size)
+            return Sequence.objects.values_list('last_value', flat=True).get(name=self.name)
+
+    def _claim_block(self):
+        last = self._claim(self.block_size)
+        self._next = last - self.block_size + 1
+        self._end = last
+        self._pid = os.getpid()
+        self.refills += 1
+
+    def next_value(self):
+        with self._lock:
+            # A block inherited across fork() is shared with the parent; drop it.
+            if self._pid != os.getpid():
+                self._next, self._end = 0, -1
+            if self._next > self._end:
+                if connection.in_atomic_block:
+                    # Don't cache what the caller's rollback could hand to another process.
+                    return self._claim(1)
+                self._claim_block()
+            value = self._next
+            self._next += 1
+            return value
+
+
+_order_numbers = None
+_order_numbers_lock = threading.Lock()
+
+
+def order_number_allocator():
+    global _order_numbers
+    if _order_numbers is None:
+        with _order_numbers_lock:
+            if _order_numbers is None:
+                _order_numbers = BlockAllocator(
+                    'order_number', getattr(settings, 'ORDER_NUMBER_BLOCK_SIZE', 50)
+                )
+    return _order_numbers
+
+
+def allocate_order_number():
+    """Return the next order number, e.g. ``PPK-100000042``."""
+    return f"PPK-{order_number_allocator().next_value()}"
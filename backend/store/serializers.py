@@ -1,9 +1,12 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from .authentication import normalize_email, users_with_email
 from .models import (
     Category, Brand, Product, ProductVariant, ProductImage,
     ProductSpecification, Review, Banner, Cart, CartItem,
-    Order, OrderItem, RecentlyViewed, UserProfile, Wishlist
+    Order, OrderItem, RecentlyViewed, UserProfile, Wishlist, StkPushJob
 )
 
 
@@ -35,6 +38,8 @@ class BrandSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug', 'logo', 'description', 'is_featured', 'product_count']
 
     def get_product_count(self, obj):
+        if hasattr(obj, 'active_product_count'):   # Annotated by BrandViewSet
+            return obj.active_product_count
         return obj.products.filter(is_active=True).count()
 
 
@@ -50,11 +55,13 @@ class ProductImageSerializer(serializers.ModelSerializer):
 class ProductVariantSerializer(serializers.ModelSerializer):
     discount_percentage = serializers.ReadOnlyField()
     effective_price = serializers.ReadOnlyField()
+    # Stock minus active holds; only present where the queryset uses inventory.with_available_stock().
+    available = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = ProductVariant
         fields = ['id', 'name', 'storage', 'color', 'ram', 'price',
-                  'sale_price', 'effective_price', 'discount_percentage', 'stock', 'is_active']
+                  'sale_price', 'effective_price', 'discount_percentage', 'stock', 'available', 'is_active']
 
 
 class ProductSpecificationSerializer(serializers.ModelSerializer):
@@ -88,7 +95,7 @@ class ProductListSerializer(serializers.ModelSerializer):
     min_price = serializers.ReadOnlyField()
     max_price = serializers.ReadOnlyField()
     average_rating = serializers.ReadOnlyField()
-    review_count = serializers.SerializerMethodField()
+    review_count = serializers.ReadOnlyField()
 
     class Meta:
         model = Product
@@ -99,9 +106,6 @@ class ProductListSerializer(serializers.ModelSerializer):
             'created_at'
         ]
 
-    def get_review_count(self, obj):
-        return obj.reviews.count()
-
 
 class ProductDetailSerializer(serializers.ModelSerializer):
     """Full serializer for product detail page."""
@@ -110,11 +114,12 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     variants = ProductVariantSerializer(many=True, read_only=True)
     specifications = ProductSpecificationSerializer(many=True, read_only=True)
-    reviews = ReviewSerializer(many=True, read_only=True)
+    reviews = serializers.SerializerMethodField()   # Newest few; the rest via /products/<slug>/reviews/
     min_price = serializers.ReadOnlyField()
     max_price = serializers.ReadOnlyField()
     average_rating = serializers.ReadOnlyField()
-    review_count = serializers.SerializerMethodField()
+    review_count = serializers.ReadOnlyField()
+    rating_histogram = serializers.ReadOnlyField()
 
     class Meta:
         model = Product
@@ -123,12 +128,13 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             'description', 'short_description', 'condition',
             'images', 'variants', 'specifications', 'reviews',
             'is_featured', 'is_hot', 'is_new',
-            'min_price', 'max_price', 'average_rating', 'review_count',
+            'min_price', 'max_price', 'average_rating', 'review_count', 'rating_histogram',
             'tags', 'created_at'
         ]
 
-    def get_review_count(self, obj):
-        return obj.reviews.count()
+    def get_reviews(self, obj):
+        reviews = obj.reviews.select_related('user')[:settings.PRODUCT_DETAIL_REVIEWS]
+        return ReviewSerializer(reviews, many=True).data
 
 
 # ──────────────────────────────────────────────
@@ -245,10 +251,13 @@ class RegisterSerializer(serializers.ModelSerializer):
         model = User
         fields = ['username', 'email', 'first_name', 'last_name', 'password', 'password2', 'phone']
 
+    def validate_email(self, value):
+        return normalize_email(value)
+
     def validate(self, attrs):
         if attrs['password'] != attrs['password2']:
             raise serializers.ValidationError({'password': 'Passwords do not match.'})
-        if User.objects.filter(email=attrs['email']).exists():
+        if attrs.get('email') and users_with_email(attrs['email']).exists():
             raise serializers.ValidationError({'email': 'Email already registered.'})
         return attrs
 
@@ -256,7 +265,12 @@ class RegisterSerializer(serializers.ModelSerializer):
         phone = validated_data.pop('phone', '')
         validated_data.pop('password2')
         password = validated_data.pop('password')
-        user = User.objects.create_user(password=password, **validated_data)
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(password=password, **validated_data)
+        except IntegrityError:
+            # Lost a race with a concurrent registration; the unique index caught it.
+            raise serializers.ValidationError({'email': 'Email already registered.'})
         UserProfile.objects.create(user=user, phone=phone)
         return user
 
@@ -280,6 +294,10 @@ class WishlistSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'added_at']
 
 
+class MembershipQuerySerializer(serializers.Serializer):
+    product_ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False, max_length=500)
+
+
 # ──────────────────────────────────────────────
 # M-Pesa STK Push
 # ──────────────────────────────────────────────
@@ -295,4 +313,15 @@ class MpesaSTKPushSerializer(serializers.Serializer):
             phone = '254' + phone
         if not phone.startswith('254') or len(phone) != 12:
             raise serializers.ValidationError('Invalid Kenyan phone number.')
-        return phone
\ No newline at end of file
+        return phone
+
+
+class StkPushJobSerializer(serializers.ModelSerializer):
+    job_id = serializers.UUIDField(source='id', read_only=True)
+    order_id = serializers.UUIDField(source='order.id', read_only=True)
+    payment_status = serializers.CharField(source='order.payment_status', read_only=True)
+
+    class Meta:
+        model = StkPushJob
+        fields = ['job_id', 'order_id', 'status', 'checkout_request_id', 'error',
+                  'payment_status', 'created_at', 'updated_at']
@@ -0,0 +1,97 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .authentication import active_cache_key
+from .banners import forget_live_banners
+from .membership import membership_key
+from .models import Banner, Cart, CartItem, Product, ProductVariant, Review, VariantChange, Wishlist
+
+
+@receiver(post_save, sender=User)
+def refresh_user_active_status(sender, instance, **kwargs):
+    cache.delete(active_cache_key(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user(sender, instance, **kwargs):
+    cache.delete(active_cache_key(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Wishlist)
+def forget_wishlist_membership(sender, instance, **kwargs):
+    cache.delete(membership_key(user_id=instance.user_id))
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def forget_cart_membership(sender, instance, **kwargs):
+    try:
+        cart = instance.cart
+    except Cart.DoesNotExist:   # Deleted along with its cart
+        return
+    cache.delete(membership_key(cart.user_id, cart.session_key))
+
+
+def _variant_snapshot(variant):
+    # Skip instances loaded with price or stock deferred rather than query.
+    if {'price', 'sale_price', 'stock'} <= variant.__dict__.keys():
+        return variant.effective_price, variant.stock
+    return None
+
+
+@receiver(post_init, sender=ProductVariant)
+def remember_variant_state(sender, instance, **kwargs):
+    instance._wishlist_snapshot = _variant_snapshot(instance)
+
+
+@receiver(post_save, sender=ProductVariant)
+def capture_variant_change(sender, instance, created, **kwargs):
+    """Record price drops and restocks for the wishlist notifier."""
+    before, after = instance._wishlist_snapshot, _variant_snapshot(instance)
+    instance._wishlist_snapshot = after
+    if created or before is None or after is None:
+        return
+    (old_price, old_stock), (new_price, new_stock) = before, after
+    kinds = []
+    if new_price < old_price:
+        kinds.append('price_drop')
+    if old_stock == 0 and new_stock > 0:
+        kinds.append('back_in_stock')
+    VariantChange.objects.bulk_create([
+        VariantChange(variant=instance, product_id=instance.product_id, kind=kind,
+                      old_price=old_price, new_price=new_price)
+        for kind in kinds
+    ])
+
+
+def _count_stars(product_id, stars, delta):
+    field = f'stars_{stars}'
+    Product.objects.filter(pk=product_id).update(**{field: F(field) + delta})
+
+
+@receiver(post_init, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    instance._counted_rating = instance.__dict__.get('rating')
+
+
+@receiver(post_save, sender=Review)
+def count_review(sender, instance, created, **kwargs):
+    """Keep the product's star histogram in step with its reviews."""
+    if created:
+        _count_stars(instance.product_id, instance.rating, 1)
+    elif instance._counted_rating is not None and instance._counted_rating != instance.rating:
+        _count_stars(instance.product_id, instance._counted_rating, -1)
+        _count_stars(instance.product_id, instance.rating, 1)
+    instance._counted_rating = instance.rating
+
+
+@receiver(post_delete, sender=Review)
+def uncount_review(sender, instance, **kwargs):
+    _count_stars(instance.product_id, instance.rating, -1)
+
+
+@receiver([post_save, post_delete], sender=Banner)
+def refresh_live_banners(sender, instance, **kwargs):
+    forget_live_banners()
@@ -0,0 +1,38 @@
+"""
+Opt-in SQLite performance profile for single-node deployments.
+
+SQLite's defaults (rollback journal, ``synchronous=FULL``, no mmap, 2 MB page
+cache) make every write block readers. With ``SQLITE_PERFORMANCE_PROFILE``
+enabled, each new connection is switched to WAL, so readers never wait on the
+writer. It also gets ``synchronous=NORMAL`` (durable across application
+crashes; only an OS crash or power cut can lose the last commits) and a
+memory-mapped, larger page cache. ``busy_timeout`` makes writers queue for the
+lock instead of failing at once. Override individual values with
+``SQLITE_PRAGMAS``; measure with ``python manage.py bench_sqlite``.
+"""
+from django.conf import settings
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,     # bytes
+    'cache_size': -64_000,              # negative = KiB, i.e. 64 MB per connection
+    'busy_timeout': 5000,               # ms
+    'temp_store': 'MEMORY',
+}
+
+
+def profile_pragmas():
+    return {**PRAGMAS, **getattr(settings, 'SQLITE_PRAGMAS', {})}
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def tune_connection(sender, connection, **kwargs):
+    """``connection_created`` receiver; connected by ``StoreConfig.ready``."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor, profile_pragmas())
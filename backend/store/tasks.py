@@ -0,0 +1,77 @@
+"""
+In-process background work.
+
+Each worker process owns a small thread pool that runs jobs after the request
+has returned, so slow third-party calls (Daraja) no longer hold a gunicorn
+worker. Nothing here is persisted: a job that is queued or running when a
+process restarts is lost. Callers that need it to survive keep their own
+record and sweep it; ``StkPushJob`` rows, for example, are picked up by
+``python manage.py process_stk_jobs``.
+
+Set ``BACKGROUND_TASKS_EAGER = True`` to run jobs inline (tests, debugging).
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BACKGROUND_TASK_WORKERS, thread_name_prefix='store-task'
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _run(fn, args, kwargs):
+    close_old_connections()
+    try:
+        fn(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", getattr(fn, '__name__', fn))
+    finally:
+        close_old_connections()
+
+
+def submit(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` on the background pool."""
+    if settings.BACKGROUND_TASKS_EAGER:
+        return fn(*args, **kwargs)
+    return _get_executor().submit(_run, fn, args, kwargs)
+
+
+class RateLimiter:
+    """
+    Allow at most ``per_second`` calls per wall-clock second across all workers.
+
+    Windows are counted in the shared cache, so the limit is global when the
+    cache is Redis and per process otherwise.
+    """
+
+    def __init__(self, name, per_second):
+        self.name = name
+        self.per_second = per_second
+
+    def acquire(self):
+        while True:
+            now = time.time()
+            key = f'ratelimit:{self.name}:{int(now)}'
+            cache.add(key, 0, timeout=5)
+            if cache.incr(key) <= self.per_second:
+                return
+            time.sleep(int(now) + 1 - now)
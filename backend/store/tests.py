@@ -1,3 +1,1173 @@
-from django.test import TestCase
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import daraja, metrics, routing, tracking
+from . import urls as store_urls
+from .authentication import users_with_email
+from .inventory import available_stock, release_expired
+from .models import (
+    Banner, Brand, Cart, CartItem, Category, LazyUser, MpesaCallback, MpesaTransaction, Order, OrderItem, Product,
+    ProductImage, ProductPopularity, ProductSpecification, ProductVariant, RecentlyViewed, Review, StkPushJob,
+    StockReservation, UserProfile, VariantChange, Wishlist,
+)
+from .notifications import notify_wishlists
+from .payments import process_stk_job, reconcile_pending, record_stalled_stk_pushes, requeue_stalled_stk_jobs
+from .popularity import update_popularity
+from .reviews import backfill_verified_purchases
+from .sequences import BlockAllocator
+from .sqlite import apply_pragmas, profile_pragmas
+
+
+CHECKOUT_PAYLOAD = {
+    'full_name': 'Test Buyer',
+    'email': 'buyer@example.com',
+    'phone': '0712345678',
+    'shipping_address': 'Moi Avenue',
+    'city': 'Nairobi',
+    'county': 'Nairobi',
+    'payment_method': 'mpesa',
+}
+
+
+def tearDownModule():
+    # Views buffered by these tests name rolled-back products; don't let the exit flush write them.
+    tracking.discard()
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class CheckoutStockTests(TransactionTestCase):
+    """Parallel checkouts against a low-stock variant must never oversell."""
+
+    buyers = 8
+    initial_stock = 3
+
+    def setUp(self):
+        # Each test's flush empties store_sequence, so start without the block claimed from it.
+        patch_allocator = mock.patch('store.sequences._order_numbers', None)
+        patch_allocator.start()
+        self.addCleanup(patch_allocator.stop)
+        self.product = Product.objects.create(name='Flash Sale Phone')
+        self.variant = ProductVariant.objects.create(
+            product=self.product, name='128GB Black', price=Decimal('15000.00'), stock=self.initial_stock
+        )
+        self.users = []
+        for i in range(self.buyers):
+            user = User.objects.create_user(username=f'buyer{i}', password='pass12345')
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=self.product, variant=self.variant, quantity=1)
+            self.users.append(user)
+
+    def _checkout(self, user, barrier):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        try:
+            barrier.wait()
+            return client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json').status_code
+        finally:
+            connection.close()
+
+    # SQLite has no row locks, and its shared-cache test database fails a lock
+    # wait at once instead of honouring busy_timeout; run this on PostgreSQL.
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_parallel_checkouts_do_not_oversell(self):
+        barrier = threading.Barrier(self.buyers, timeout=30)
+        with self.assertLogs('django.request', 'WARNING') as logs, \
+                ThreadPoolExecutor(max_workers=self.buyers) as pool:
+            futures = [pool.submit(self._checkout, user, barrier) for user in self.users]
+            codes = [future.result(timeout=60) for future in futures]
+
+        losers = self.buyers - self.initial_stock
+        self.assertEqual(Counter(codes), {201: self.initial_stock, 409: losers})
+        self.assertEqual(len(logs.records), losers)   # One "Conflict" per rejected checkout
+        self.assertEqual(available_stock([self.variant.id]), {self.variant.id: 0})
+        self.assertEqual(StockReservation.objects.filter(status='active').count(), self.initial_stock)
+        self.assertEqual(Order.objects.count(), self.initial_stock)
+        self.assertEqual(OrderItem.objects.count(), self.initial_stock)
+        # Buyers who lost the race keep their cart; winners have it emptied.
+        self.assertEqual(CartItem.objects.count(), losers)
+
+    def test_checkout_rejects_quantity_above_stock(self):
+        user = self.users[0]
+        CartItem.objects.filter(cart__user=user).update(quantity=self.initial_stock + 1)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        with self.assertLogs('django.request', 'WARNING'):
+            response = client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertTrue(CartItem.objects.filter(cart__user=user).exists())
+
+    def test_product_detail_serializes_stock_left_after_holds(self):
+        client = APIClient()
+        client.force_authenticate(user=self.users[0])
+        client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json')
+
+        variant = APIClient().get(f'/api/v1/products/{self.product.slug}/').data['variants'][0]
+        self.assertEqual((variant['stock'], variant['available']), (self.initial_stock, self.initial_stock - 1))
+
+    def _callback(self, order, result_code):
+        MpesaTransaction.objects.get_or_create(
+            order=order, checkout_request_id=f'ws_CO_{order.id.hex}', amount=order.total, phone='254712345678'
+        )
+        body = {'Body': {'stkCallback': {
+            'CheckoutRequestID': f'ws_CO_{order.id.hex}',
+            'ResultCode': result_code,
+            'ResultDesc': 'Done',
+            'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'QWE123RTY'}]},
+        }}}
+        return APIClient().post('/api/v1/mpesa/callback/', body, format='json')
+
+    def test_paid_callback_converts_holds_and_failed_callback_releases_them(self):
+        paid_client, failed_client = APIClient(), APIClient()
+        paid_client.force_authenticate(user=self.users[0])
+        failed_client.force_authenticate(user=self.users[1])
+        paid = Order.objects.get(id=paid_client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json').data['id'])
+        failed = Order.objects.get(id=failed_client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json').data['id'])
+        self.assertEqual(available_stock([self.variant.id])[self.variant.id], self.initial_stock - 2)
+
+        self._callback(paid, 0)
+        self._callback(failed, 1032)
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, self.initial_stock - 1)
+        self.assertEqual(available_stock([self.variant.id])[self.variant.id], self.initial_stock - 1)
+        self.assertEqual(paid.reservations.get().status, 'converted')
+        self.assertEqual(failed.reservations.get().status, 'released')
+
+    def test_redelivered_callback_is_journaled_but_applied_once(self):
+        client = APIClient()
+        client.force_authenticate(user=self.users[0])
+        order = Order.objects.get(id=client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json').data['id'])
+
+        self._callback(order, 0)
+        self._callback(order, 0)
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, self.initial_stock - 1)
+        order.refresh_from_db()
+        self.assertEqual((order.payment_status, order.mpesa_transaction_id), ('paid', 'QWE123RTY'))
+        self.assertEqual(
+            list(MpesaCallback.objects.order_by('id').values_list('outcome', flat=True)), ['applied', 'duplicate']
+        )
+
+    def test_callback_is_journaled_even_when_applying_it_fails(self):
+        client = APIClient()
+        client.force_authenticate(user=self.users[0])
+        order = Order.objects.get(id=client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json').data['id'])
+
+        with mock.patch('store.payments.apply_stk_result', side_effect=RuntimeError('boom')), \
+                self.assertRaises(RuntimeError):
+            self._callback(order, 0)
+
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, 'pending')
+        self.assertEqual(order.reservations.get().status, 'active')
+        self.assertEqual(MpesaCallback.objects.get().outcome, 'received')
+
+    def _lapsed_order(self, user):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        order = Order.objects.get(id=client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json').data['id'])
+        StockReservation.objects.filter(order=order).update(expires_at=timezone.now() - timedelta(seconds=1))
+        release_expired()
+        return order
+
+    def test_payment_after_a_lapsed_hold_sells_unclaimed_stock(self):
+        order = self._lapsed_order(self.users[0])
+
+        with self.assertLogs('store.inventory', 'WARNING') as logs:
+            self._callback(order, 0)
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, self.initial_stock - 1)
+        self.assertEqual(order.reservations.get().status, 'converted')
+        self.assertEqual([r.levelname for r in logs.records], ['WARNING'])
+
+    def test_payment_after_a_lapsed_hold_never_takes_stock_held_for_others(self):
+        ProductVariant.objects.filter(pk=self.variant.pk).update(stock=1)
+        order = self._lapsed_order(self.users[0])
+        client = APIClient()
+        client.force_authenticate(user=self.users[1])
+        self.assertEqual(client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json').status_code, 201)
+
+        with self.assertLogs('store.inventory', 'ERROR'):
+            self._callback(order, 0)
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 1)
+        self.assertEqual(StockReservation.objects.get(order__user=self.users[1]).status, 'active')
+
+    def test_expired_holds_are_released(self):
+        client = APIClient()
+        client.force_authenticate(user=self.users[0])
+        client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json')
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(available_stock([self.variant.id])[self.variant.id], self.initial_stock)
+        self.assertEqual(release_expired(batch_size=1), 1)
+        self.assertEqual(StockReservation.objects.get().status, 'released')
+
+
+class OrderNumberSequenceTests(TransactionTestCase):
+    def test_blocks_are_cached_outside_transactions(self):
+        allocator = BlockAllocator('test', 10)
+        self.assertEqual([allocator.next_value() for _ in range(3)], [1, 2, 3])
+        self.assertEqual(allocator.refills, 1)
+
+    def test_a_rolled_back_claim_leaves_no_block_behind(self):
+        first, second = BlockAllocator('test', 10), BlockAllocator('test', 10)
+        with transaction.atomic():
+            first.next_value()
+            transaction.set_rollback(True)
+        # ``second`` stands for another process claiming after the rollback.
+        taken = {second.next_value() for _ in range(10)}
+        self.assertNotIn(first.next_value(), taken)
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        product = Product.objects.create(name='Retry Phone')
+        variant = ProductVariant.objects.create(product=product, name='64GB', price=Decimal('9000.00'), stock=5)
+        self.user = User.objects.create_user(username='retrier', password='pass12345')
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=product, variant=variant)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_retried_checkout_replays_first_response(self):
+        first = self.client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json', HTTP_IDEMPOTENCY_KEY='abc-1')
+        retry = self.client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json', HTTP_IDEMPOTENCY_KEY='abc-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_with_different_body_is_rejected(self):
+        self.client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json', HTTP_IDEMPOTENCY_KEY='abc-2')
+        changed = dict(CHECKOUT_PAYLOAD, city='Mombasa')
+        response = self.client.post('/api/v1/orders/', changed, format='json', HTTP_IDEMPOTENCY_KEY='abc-2')
+
+        self.assertEqual(response.status_code, 422)
+
+    def test_cross_origin_clients_may_send_the_key_and_read_the_replay_flag(self):
+        preflight = self.client.options(
+            '/api/v1/orders/', HTTP_ORIGIN='http://localhost:5173',
+            HTTP_ACCESS_CONTROL_REQUEST_METHOD='POST',
+            HTTP_ACCESS_CONTROL_REQUEST_HEADERS='authorization, content-type, idempotency-key',
+        )
+        self.assertIn('idempotency-key', preflight['Access-Control-Allow-Headers'])
+        response = self.client.post('/api/v1/orders/', CHECKOUT_PAYLOAD, format='json',
+                                    HTTP_ORIGIN='http://localhost:5173', HTTP_IDEMPOTENCY_KEY='abc-3')
+        self.assertIn('Idempotent-Replayed', response['Access-Control-Expose-Headers'])
+
+
+class MpesaAccessTokenTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_callers_share_one_refresh(self):
+        calls = []
+
+        def slow_fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'token-1', 3599
+
+        results = []
+        with mock.patch.object(daraja.DarajaClient, 'fetch_access_token', side_effect=slow_fetch):
+            threads = [threading.Thread(target=lambda: results.append(daraja.get_access_token())) for _ in range(5)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            results.append(daraja.get_access_token())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['token-1'] * 6)
+
+    @override_settings(MPESA_HTTP_RETRIES=3, MPESA_HTTP_BACKOFF=1)
+    def test_refresh_lock_outlasts_every_oauth_retry(self):
+        # 4 attempts of (3.05s connect + 10s read), plus up to 1 + 2 + 4 seconds of backoff.
+        with mock.patch.object(daraja.cache, 'add', wraps=cache.add) as add, \
+                mock.patch.object(daraja.DarajaClient, 'fetch_access_token', return_value=('token-1', 3599)):
+            daraja.get_access_token()
+        self.assertGreater(add.call_args.args[2], 4 * 13.05 + 7)
+
+
+class StubDarajaHandler(BaseHTTPRequestHandler):
+    """Minimal Daraja stand-in; ``server.failures`` 503s are served before succeeding."""
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self.server.hits.append(self.path)
+        self._reply(200, {'access_token': 'stub-token', 'expires_in': '3599'})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.hits.append(self.path)
+        if self.server.failures:
+            self.server.failures -= 1
+            return self._reply(503, {'errorMessage': 'Service unavailable'})
+        self._reply(200, {'ResponseCode': '0', 'ResultCode': '0', 'CheckoutRequestID': 'ws_CO_1'})
+
+    def log_message(self, *args):
+        pass
+
+
+class DarajaClientTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubDarajaHandler)
+        self.server.hits, self.server.failures = [], 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.settings_override = override_settings(MPESA_CONSUMER_KEY='key', MPESA_CONSUMER_SECRET='secret')
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.client = daraja.DarajaClient(
+            base_url=f'http://127.0.0.1:{self.server.server_port}',
+            max_retries=2, backoff=0, failure_threshold=3, reset_timeout=60,
+        )
+        self.patch_client = mock.patch('store.daraja.get_client', return_value=self.client)
+        self.patch_client.start()
+        self.addCleanup(self.patch_client.stop)
+
+    def test_idempotent_query_retries_through_transient_errors(self):
+        self.server.failures = 2
+        data = self.client.stk_query('ws_CO_1')
+
+        self.assertEqual(data['ResultCode'], '0')
+        self.assertEqual(self.server.hits.count('/mpesa/stkpushquery/v1/query'), 3)
+
+    def test_stk_push_is_not_retried_and_circuit_opens(self):
+        self.server.failures = 10
+        for _ in range(3):
+            self.client.stk_push('254712345678', 100, 'PPK-1', 'Test')
+        with self.assertRaises(daraja.CircuitOpenError):
+            self.client.stk_push('254712345678', 100, 'PPK-1', 'Test')
+
+        self.assertEqual(self.server.hits.count('/mpesa/stkpush/v1/processrequest'), 3)
+        # The token was fetched once and reused over the pooled session.
+        self.assertEqual(len([h for h in self.server.hits if h.startswith('/oauth')]), 1)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class StkPushDispatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='payer', password='pass12345')
+        self.order = Order.objects.create(
+            user=self.user, subtotal=Decimal('1000'), total=Decimal('1200'),
+            **{k: v for k, v in CHECKOUT_PAYLOAD.items() if k != 'payment_method'}
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_push_is_queued_and_recorded_by_the_worker(self):
+        stub = mock.Mock()
+        stub.stk_push.return_value = {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_42', 'MerchantRequestID': 'm1'}
+        with mock.patch('store.payments.get_client', return_value=stub), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/v1/mpesa/stk-push/', {'phone': '0712345678', 'order_id': str(self.order.id)}, format='json'
+            )
+
+        self.assertEqual(response.status_code, 202)
+        status_response = self.client.get(f"/api/v1/mpesa/stk-push/{response.data['job_id']}/")
+        self.assertEqual(status_response.data['status'], 'sent')
+        self.assertEqual(status_response.data['checkout_request_id'], 'ws_CO_42')
+        self.assertTrue(MpesaTransaction.objects.filter(order=self.order, checkout_request_id='ws_CO_42').exists())
+        stub.stk_push.assert_called_once_with(
+            phone='254712345678', amount=1200, account_reference=self.order.order_number,
+            description=f'Payment for order {self.order.order_number}',
+        )
+
+    def test_jobs_left_processing_by_a_dead_worker_are_requeued(self):
+        stalled = StkPushJob.objects.create(order=self.order, phone='254712345678', status='processing')
+        busy = StkPushJob.objects.create(order=self.order, phone='254712345678', status='processing')
+        StkPushJob.objects.filter(pk=stalled.pk).update(
+            created_at=timezone.now() - timedelta(minutes=10), updated_at=timezone.now() - timedelta(minutes=5)
+        )
+        stub = mock.Mock()
+        stub.stk_push.return_value = {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_43', 'MerchantRequestID': 'm2'}
+        self.assertEqual(requeue_stalled_stk_jobs(lease=120), 1)
+        with mock.patch('store.payments.get_client', return_value=stub):
+            process_stk_job(stalled.pk)
+
+        stalled.refresh_from_db()
+        busy.refresh_from_db()
+        self.assertEqual((stalled.status, stalled.checkout_request_id), ('sent', 'ws_CO_43'))
+        self.assertEqual(busy.status, 'processing')
+        stub.stk_push.assert_called_once()
+
+    def test_stalled_jobs_daraja_accepted_are_recorded_not_pushed_again(self):
+        job = StkPushJob.objects.create(
+            order=self.order, phone='254712345678', status='processing', checkout_request_id='ws_CO_44'
+        )
+        StkPushJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+
+        self.assertEqual(requeue_stalled_stk_jobs(lease=120), 0)
+        self.assertEqual(record_stalled_stk_pushes(lease=120), 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'sent')
+        tx = MpesaTransaction.objects.get(checkout_request_id='ws_CO_44')
+        self.assertEqual((tx.order_id, tx.status, tx.amount), (self.order.id, 'pending', self.order.total))
+
+    def test_unexpected_errors_fail_the_job_unless_daraja_accepted_it(self):
+        broken = StkPushJob.objects.create(order=self.order, phone='254712345678')
+        accepted = StkPushJob.objects.create(order=self.order, phone='254712345678')
+        stub = mock.Mock()
+        stub.stk_push.side_effect = [
+            ValueError('bad response'),
+            {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_45', 'MerchantRequestID': 'm3'},
+        ]
+        with mock.patch('store.payments.get_client', return_value=stub), \
+                mock.patch('store.payments._record_push', side_effect=OperationalError('gone away')), \
+                self.assertLogs('store.payments', 'ERROR'):
+            process_stk_job(broken.pk)
+            process_stk_job(accepted.pk)
+
+        broken.refresh_from_db()
+        accepted.refresh_from_db()
+        self.assertEqual((broken.status, broken.error), ('failed', 'bad response'))
+        self.assertEqual((accepted.status, accepted.checkout_request_id), ('processing', 'ws_CO_45'))
+
+
+class MpesaReconciliationTests(TestCase):
+    def test_stale_pending_transactions_are_resolved_in_bulk(self):
+        user = User.objects.create_user(username='stuck', password='pass12345')
+        fields = {k: v for k, v in CHECKOUT_PAYLOAD.items() if k != 'payment_method'}
+        orders = [Order.objects.create(user=user, subtotal=100, total=300, **fields) for _ in range(3)]
+        for i, order in enumerate(orders):
+            MpesaTransaction.objects.create(order=order, checkout_request_id=f'ws_CO_{i}', amount=300, phone='254712345678')
+        MpesaTransaction.objects.update(created_at=timezone.now() - timedelta(minutes=10))
+        variant = ProductVariant.objects.create(product=Product.objects.create(name='Held'), name='Base', price=100, stock=5)
+        expires_at = timezone.now() + timedelta(minutes=5)
+        for order in orders:
+            StockReservation.objects.create(variant=variant, order=order, quantity=1, expires_at=expires_at)
+
+        replies = {
+            'ws_CO_0': {'ResultCode': '0', 'ResultDesc': 'Processed'},
+            'ws_CO_1': {'ResultCode': '1032', 'ResultDesc': 'Cancelled by user'},
+            'ws_CO_2': {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'},
+        }
+        stub = mock.Mock()
+        stub.stk_query.side_effect = replies.get
+        # No on-commit hooks run here: holds must be settled inside the batch's own transaction.
+        with mock.patch('store.payments.get_client', return_value=stub):
+            counts = reconcile_pending(older_than=60, workers=2, batch_size=2)
+
+        self.assertEqual(counts, {'paid': 1, 'failed': 1, 'unresolved': 1})
+        statuses = dict(MpesaTransaction.objects.values_list('checkout_request_id', 'status'))
+        self.assertEqual(statuses, {'ws_CO_0': 'success', 'ws_CO_1': 'failed', 'ws_CO_2': 'pending'})
+        self.assertEqual(Order.objects.get(pk=orders[0].pk).payment_status, 'paid')
+        holds = dict(StockReservation.objects.values_list('order_id', 'status'))
+        self.assertEqual([holds[o.pk] for o in orders], ['converted', 'released', 'active'])
+        variant.refresh_from_db()
+        self.assertEqual(variant.stock, 4)
+
+
+@override_settings(LOGIN_THROTTLE={'IP_LIMIT': 100, 'IDENTIFIER_LIMIT': 3, 'LOCKOUT_BASE': 30})
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='victim', email='victim@example.com', password='right-password')
+
+    def test_identifier_is_locked_out_before_hashing(self):
+        client = APIClient()
+        with mock.patch('store.views.authenticate', return_value=None) as auth:
+            codes = [
+                client.post('/api/v1/auth/login/', {'email': 'Victim@example.com', 'password': 'guess'}).status_code
+                for _ in range(5)
+            ]
+
+        self.assertEqual(codes, [401, 401, 401, 429, 429])
+        self.assertEqual(auth.call_count, 3)
+        self.assertEqual(metrics.snapshot('login.hashed', 'login.rejected'), {'login.hashed': 3, 'login.rejected': 2})
+        response = client.post('/api/v1/auth/login/', {'email': 'victim@example.com', 'password': 'right-password'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 29)
+
+    @override_settings(
+        LOGIN_THROTTLE={'IP_LIMIT': 2, 'IDENTIFIER_LIMIT': 100},
+        REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1},
+    )
+    def test_spoofed_forwarded_for_does_not_reset_the_ip_bucket(self):
+        client = APIClient()
+        with mock.patch('store.views.authenticate', return_value=None):
+            codes = [
+                client.post(
+                    '/api/v1/auth/login/', {'email': f'user{i}@example.com', 'password': 'guess'},
+                    HTTP_X_FORWARDED_FOR=f'10.0.0.{i}, 203.0.113.9',
+                ).status_code
+                for i in range(3)
+            ]
+        self.assertEqual(codes, [401, 401, 429])
+
+    def test_non_object_body_is_rejected_without_error(self):
+        response = APIClient().post('/api/v1/auth/login/', ['victim@example.com'], format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class StatelessJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='pass12345', first_name='Ann')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+
+    def test_authenticated_requests_skip_the_user_query_once_cached(self):
+        self.client.get('/api/v1/orders/')
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/api/v1/orders/').status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if '"auth_user"' in q['sql']])
+
+    def test_full_user_loads_lazily_in_one_query(self):
+        response = self.client.get('/api/v1/auth/profile/')
+        self.assertEqual(response.data['first_name'], 'Ann')
+
+        lazy = LazyUser.from_db(None, ['id', 'is_active'], [self.user.pk, True])
+        with self.assertNumQueries(1):
+            self.assertEqual((lazy.username, lazy.first_name), ('reader', 'Ann'))
+
+    def test_deactivation_revokes_tokens_immediately(self):
+        self.assertEqual(self.client.get('/api/v1/orders/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/v1/orders/').status_code, 401)
+
+
+class EmailLookupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def register(self, username, email):
+        return self.client.post('/api/v1/auth/register/', {
+            'username': username, 'email': email, 'password': 'pass12345', 'password2': 'pass12345',
+        }, format='json')
+
+    def test_login_and_registration_ignore_email_case(self):
+        self.assertEqual(self.register('mixed', '  Jane.Doe@Example.COM ').status_code, 201)
+        self.assertEqual(User.objects.get(username='mixed').email, 'jane.doe@example.com')
+
+        self.assertEqual(self.register('other', 'JANE.DOE@example.com').status_code, 400)
+        response = self.client.post('/api/v1/auth/login/', {
+            'email': 'Jane.Doe@EXAMPLE.com', 'password': 'pass12345',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+    def test_lookup_uses_the_lower_email_index(self):
+        sql, params = users_with_email('a@b.com').values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('store_auth_user_email_lower_idx', plan)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True, RECENTLY_VIEWED={'HISTORY': 2, 'FLUSH_INTERVAL': 3600})
+class RecentlyViewedBufferTests(TestCase):
+    def setUp(self):
+        tracking.flush()
+        self.user = User.objects.create_user(username='browser', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.products = [Product.objects.create(name=f'Phone {i}') for i in range(3)]
+
+    def test_product_views_are_written_in_bulk_and_capped(self):
+        with CaptureQueriesContext(connection) as ctx:
+            for product in self.products + self.products[:1]:
+                self.assertEqual(self.client.get(f'/api/v1/products/{product.slug}/').status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if 'store_recentlyviewed' in q['sql']])
+
+        tracking.flush()
+        viewed = list(RecentlyViewed.objects.filter(user=self.user).values_list('product', flat=True))
+        self.assertEqual(viewed, [self.products[0].pk, self.products[2].pk])
+
+    def test_repeat_views_update_the_existing_row(self):
+        for _ in range(2):
+            self.client.get(f'/api/v1/products/{self.products[0].slug}/')
+            tracking.flush()
+        self.assertEqual(RecentlyViewed.objects.filter(user=self.user).count(), 1)
+
+    @override_settings(BACKGROUND_TASKS_EAGER=False, RECENTLY_VIEWED={'FLUSH_INTERVAL': 0.05})
+    def test_an_idle_buffer_flushes_on_a_timer(self):
+        flushed = threading.Event()
+        batches = []
+
+        def submit(fn, *batch):
+            batches.append(batch)
+            flushed.set()
+
+        buffer = tracking.ViewBuffer()
+        with mock.patch.object(tracking.tasks, 'submit', side_effect=submit):
+            buffer.add(self.user.pk, None, self.products[0].pk)
+            self.assertTrue(flushed.wait(5))
+        history, counts = batches[0]
+        self.assertEqual(list(history), [(self.user.pk, None, self.products[0].pk)])
+        self.assertEqual(counts, {self.products[0].pk: 1})
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class ProductPopularityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        tracking.flush()
+        self.client = APIClient()
+        self.viewed, self.sold, self.ignored = (
+            Product.objects.create(name=f'{name} Phone', tags='phone') for name in ('Viewed', 'Sold', 'Ignored')
+        )
+
+    def sell(self, product, quantity, payment_status='paid'):
+        order = Order.objects.create(
+            **{k: v for k, v in CHECKOUT_PAYLOAD.items() if k != 'payment_method'},
+            subtotal=Decimal('100'), total=Decimal('100'), payment_status=payment_status,
+        )
+        OrderItem.objects.create(order=order, product=product, product_name=product.name,
+                                 price=Decimal('100'), quantity=quantity)
+
+    def test_best_sellers_and_search_follow_views_and_paid_sales(self):
+        for _ in range(3):
+            self.client.get(f'/api/v1/products/{self.viewed.slug}/')
+        tracking.flush()
+        self.assertEqual(ProductPopularity.objects.get(product=self.viewed).pending_views, 3)
+        self.sell(self.sold, 1)
+        self.sell(self.ignored, 5, payment_status='failed')
+
+        update_popularity()
+        self.assertEqual(ProductPopularity.objects.get(product=self.viewed).pending_views, 0)
+
+        with CaptureQueriesContext(connection) as ctx:
+            names = [p['name'] for p in self.client.get('/api/v1/products/best_sellers/').data]
+        self.assertFalse([q for q in ctx.captured_queries if 'store_orderitem' in q['sql']])
+        self.assertEqual(names, ['Sold Phone', 'Viewed Phone'])
+
+        results = self.client.get('/api/v1/products/', {'search': 'phone'}).data['results']
+        self.assertEqual([p['name'] for p in results], ['Sold Phone', 'Viewed Phone', 'Ignored Phone'])
+
+
+class MembershipTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.products = [Product.objects.create(name=f'Card Phone {i}') for i in range(4)]
+        self.ids = [str(p.id) for p in self.products]
+
+    def membership(self):
+        return self.client.post('/api/v1/membership/', {'product_ids': self.ids}, format='json')
+
+    def test_bitmaps_come_from_one_cached_query_and_follow_changes(self):
+        self.client.post('/api/v1/wishlist/', {'product_id': self.ids[1]}, format='json')
+        self.client.post('/api/v1/cart/', {'product_id': self.ids[2]}, format='json')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.membership().data, {'wishlist': '0100', 'cart': '0010'})
+        with self.assertNumQueries(0):
+            self.membership()
+
+        self.client.post('/api/v1/wishlist/', {'product_id': self.ids[3]}, format='json')
+        self.client.delete('/api/v1/cart/clear/')
+        self.assertEqual(self.membership().data, {'wishlist': '0101', 'cart': '0000'})
+
+    def test_rejects_oversized_batches(self):
+        response = self.client.post(
+            '/api/v1/membership/', {'product_ids': self.ids * 126}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class WishlistNotificationTests(TestCase):
+    def setUp(self):
+        self.phone = Product.objects.create(name='Pixel 8')
+        self.variant = ProductVariant.objects.create(product=self.phone, name='128GB', price=Decimal('80000'), stock=0)
+        self.other = ProductVariant.objects.create(product=self.phone, name='256GB', price=Decimal('95000'), stock=4)
+        self.fans = [
+            User.objects.create_user(username=f'fan{i}', email=f'fan{i}@example.com', password='pass12345')
+            for i in range(3)
+        ]
+        for user in self.fans[:2]:
+            Wishlist.objects.create(user=user, product=self.phone)
+
+    def test_changes_are_captured_and_sent_once_per_user_over_one_connection(self):
+        variant = ProductVariant.objects.get(pk=self.variant.pk)
+        variant.stock = 5
+        variant.save()
+        other = ProductVariant.objects.get(pk=self.other.pk)
+        other.sale_price = Decimal('89000')
+        other.save()
+        other.name = '256GB Blue'
+        other.save()   # No price or stock change: nothing captured
+        self.assertEqual(
+            sorted(VariantChange.objects.values_list('kind', flat=True)), ['back_in_stock', 'price_drop']
+        )
+
+        with mock.patch('store.notifications.get_connection', wraps=get_connection) as connect:
+            self.assertEqual(notify_wishlists(), (2, 2))
+        connect.assert_called_once()
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['fan0@example.com', 'fan1@example.com'])
+        self.assertIn('back in stock', mail.outbox[0].body)
+        self.assertIn('KES 89,000, down from KES 95,000', mail.outbox[0].body)
+
+        self.assertEqual(notify_wishlists(), (0, 0))
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_only_the_latest_drop_per_variant_is_sent_while_it_still_holds(self):
+        other = ProductVariant.objects.get(pk=self.other.pk)
+        for sale_price in ['90000', '85000']:
+            other.sale_price = Decimal(sale_price)
+            other.save()
+        notify_wishlists()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn('KES 85,000, down from KES 95,000', mail.outbox[0].body)
+        self.assertNotIn('90,000', mail.outbox[0].body)
+
+        other.sale_price = Decimal('80000')
+        other.save()
+        ProductVariant.objects.filter(pk=other.pk).update(sale_price=None)   # Sale ended before the run
+        self.assertEqual(notify_wishlists(), (1, 0))
+        self.assertEqual(len(mail.outbox), 2)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class ReviewHistogramTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Galaxy A55')
+        self.reviewers = [User.objects.create_user(username=f'rev{i}', password='pass12345') for i in range(12)]
+        for i, user in enumerate(self.reviewers):
+            Review.objects.create(product=self.product, user=user, rating=5 if i % 3 else 2, comment='ok')
+        self.client = APIClient()
+
+    def test_histogram_follows_review_create_update_and_delete(self):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_histogram, {1: 0, 2: 4, 3: 0, 4: 0, 5: 8})
+        self.assertEqual(self.product.average_rating, 4.0)
+
+        review = Review.objects.get(user=self.reviewers[0])
+        review.rating = 4
+        review.save()
+        Review.objects.get(user=self.reviewers[1]).delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_histogram, {1: 0, 2: 3, 3: 0, 4: 1, 5: 7})
+
+    def test_saving_a_stale_product_keeps_the_counts(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, user=User.objects.create_user(username='late'), rating=1)
+        stale.name = 'Galaxy A55 5G'
+        stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.name, 'Galaxy A55 5G')
+        self.assertEqual(self.product.rating_histogram, {1: 1, 2: 4, 3: 0, 4: 0, 5: 8})
+
+    def test_detail_embeds_newest_reviews_and_the_rest_are_cursor_paginated(self):
+        data = self.client.get(f'/api/v1/products/{self.product.slug}/').data
+        self.assertEqual(data['rating_histogram'], {1: 0, 2: 4, 3: 0, 4: 0, 5: 8})
+        self.assertEqual(data['review_count'], 12)
+        self.assertEqual(len(data['reviews']), 5)
+
+        seen = []
+        url = f'/api/v1/products/{self.product.slug}/reviews/'
+        while url:
+            with self.assertNumQueries(2):   # product + one page of reviews joined to users
+                page = self.client.get(url).data
+            seen += [r['id'] for r in page['results']]
+            url = page['next']
+        self.assertEqual(len(set(seen)), 12)
+
+
+class VerifiedPurchaseTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='iPhone 15')
+        self.buyer = User.objects.create_user(username='buyer', password='pass12345')
+        self.browser = User.objects.create_user(username='browser', password='pass12345')
+        self.unpaid = User.objects.create_user(username='unpaid', password='pass12345')
+        for user, payment_status in [(self.buyer, 'paid'), (self.unpaid, 'failed')]:
+            order = Order.objects.create(
+                user=user, **{k: v for k, v in CHECKOUT_PAYLOAD.items() if k != 'payment_method'},
+                subtotal=Decimal('100'), total=Decimal('100'), payment_status=payment_status,
+            )
+            OrderItem.objects.create(order=order, product=self.product, product_name=self.product.name,
+                                     price=Decimal('100'), quantity=1)
+
+    def review(self, user):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        response = client.post(f'/api/v1/products/{self.product.slug}/reviews/',
+                               {'rating': 5, 'comment': 'Great'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['is_verified_purchase']
+
+    def test_reviews_are_verified_against_paid_orders(self):
+        self.assertTrue(self.review(self.buyer))
+        self.assertFalse(self.review(self.browser))
+        self.assertFalse(self.review(self.unpaid))
+
+    def test_backfill_flags_existing_reviews_in_chunks(self):
+        for user in (self.buyer, self.browser, self.unpaid):
+            Review.objects.create(product=self.product, user=user, rating=4, comment='ok')
+        with self.assertNumQueries(3):   # bounds x2, then a single UPDATE for the one chunk
+            self.assertEqual(backfill_verified_purchases(chunk_size=5000), 1)
+        self.assertEqual(backfill_verified_purchases(chunk_size=1), 0)
+        self.assertEqual(
+            list(Review.objects.filter(is_verified_purchase=True).values_list('user__username', flat=True)), ['buyer']
+        )
+
+
+class ScheduledBannerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.current = Banner.objects.create(title='Launch week', image='banners/a.jpg', ends_at=now + timedelta(hours=1))
+        self.upcoming = Banner.objects.create(title='Flash sale', image='banners/b.jpg',
+                                              starts_at=now + timedelta(minutes=30))
+        Banner.objects.create(title='Expired', image='banners/c.jpg', ends_at=now - timedelta(minutes=1))
+        self.client = APIClient()
+
+    def test_live_set_is_cached_until_the_next_schedule_boundary(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            titles = [b['title'] for b in self.client.get('/api/v1/banners/hero/').data]
+        self.assertEqual(titles, ['Launch week'])
+        timeout = cache_set.call_args.args[2]
+        self.assertTrue(29 * 60 < timeout <= 30 * 60, timeout)
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/v1/banners/hero/')
+
+        self.upcoming.starts_at = None
+        self.upcoming.save()
+        titles = [b['title'] for b in self.client.get('/api/v1/banners/hero/').data]
+        self.assertEqual(titles, ['Launch week', 'Flash sale'])
+
+    def test_listing_respects_the_schedule(self):
+        titles = [b['title'] for b in self.client.get('/api/v1/banners/').data['results']]
+        self.assertEqual(titles, ['Launch week'])
+
+
+class SQLiteProfileTests(SimpleTestCase):
+    @override_settings(SQLITE_PRAGMAS={'busy_timeout': 2500})
+    def test_profile_pragmas_apply_to_new_connections(self):
+        with tempfile.TemporaryDirectory() as scratch:
+            conn = sqlite3.connect(Path(scratch) / 'db.sqlite3')
+            apply_pragmas(conn.cursor(), profile_pragmas())
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+            self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0], 2500)
+            conn.close()
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is SQLite syntax')
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class StorefrontIndexTests(TestCase):
+    def setUp(self):
+        product = Product.objects.create(name='Pixel 8', is_featured=True)
+        ProductVariant.objects.create(product=product, name='128GB', price=Decimal('80000'), stock=3)
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        Order.objects.create(
+            user=user, **{k: v for k, v in CHECKOUT_PAYLOAD.items() if k != 'payment_method'},
+            subtotal=Decimal('100'), total=Decimal('100'),
+        )
+
+    def test_read_endpoints_do_not_scan_tables(self):
+        out = StringIO()
+        call_command('explain_endpoints', '--fail-on-scan', '--no-color', stdout=out)
+        for index in ['product_active_recent_idx', 'product_featured_recent_idx', 'variant_product_active_idx',
+                      'order_user_recent_idx']:
+            self.assertIn(index, out.getvalue())
+
+    def test_views_of_the_explained_pages_are_not_recorded(self):
+        tracking.discard()
+        call_command('explain_endpoints', '--only', 'products/{product}/', stdout=StringIO())
+        tracking.flush()
+        self.assertFalse(RecentlyViewed.objects.exists())
+        self.assertFalse(ProductPopularity.objects.filter(pending_views__gt=0).exists())
+
+
+@mock.patch.object(routing, 'replica_aliases', return_value=['replica_1'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        routing._health.clear()
+        self.router = routing.ReplicaRouter()
+        self.addCleanup(routing.end_request)
+
+    def test_reads_use_a_caught_up_replica_until_the_request_writes(self, _aliases):
+        routing.begin_request(True)
+        with mock.patch.object(routing, 'replica_lag', return_value=0.5):
+            self.assertEqual(self.router.db_for_read(Product), 'replica_1')
+        self.assertEqual(self.router.db_for_write(Product), 'default')
+        self.assertIsNone(self.router.db_for_read(Product))
+        self.assertTrue(routing.end_request())
+
+    def test_lagging_replica_falls_back_to_the_primary(self, _aliases):
+        routing.begin_request(True)
+        with mock.patch.object(routing, 'replica_lag', return_value=30):
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_write_pins_the_browser_to_the_primary(self, _aliases):
+        def write(request):
+            self.router.db_for_write(Product)
+            return HttpResponse()
+
+        def read(request):
+            self.assertIsNone(self.router.db_for_read(Product))
+            return HttpResponse()
+
+        response = routing.ReplicaPinningMiddleware(write)(RequestFactory().get('/api/v1/cart/'))
+        self.assertIn(routing.PIN_COOKIE, response.cookies)
+
+        request = RequestFactory().get('/api/v1/cart/')
+        request.COOKIES[routing.PIN_COOKIE] = '1'
+        routing.ReplicaPinningMiddleware(read)(request)
+
+    def test_write_pins_every_client_holding_the_same_token(self, _aliases):
+        cache.clear()
+        auth = f'Bearer {RefreshToken.for_user(User(id=7, username="pinned")).access_token}'
+
+        def write(request):
+            self.router.db_for_write(Product)
+            return HttpResponse()
+
+        def read(request):
+            self.assertIsNone(self.router.db_for_read(Product))
+            return HttpResponse()
+
+        response = routing.ReplicaPinningMiddleware(write)(
+            RequestFactory().post('/api/v1/cart/add/', HTTP_AUTHORIZATION=auth)
+        )
+        self.assertNotIn(routing.PIN_COOKIE, response.cookies)
+
+        # A fresh client (another tab or device) has no cookie, only the token.
+        with mock.patch.object(routing, 'replica_lag', return_value=0.5):
+            routing.ReplicaPinningMiddleware(read)(RequestFactory().get('/api/v1/cart/', HTTP_AUTHORIZATION=auth))
+
+
+def query_shape(sql):
+    """``sql`` with literals and IN lists blanked, so per-row repeats compare equal."""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return re.sub(r'\(\?(?:, \?)*\)', '(...)', sql)
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=True)
+class QueryBudgetTests(TestCase):
+    """Query and row budgets for every route in store/urls.py, against a realistic catalog.
+
+    Each case is (route name, method, path, logged in, payload, max queries,
+    max rows). Rows are what the endpoint's SELECTs return. Every case runs
+    with a cold cache and in a rolled-back savepoint, so cases don't see each
+    other's writes. A query shape run more than ``REPEAT_LIMIT`` times is a
+    per-row query (N+1) and fails whatever the budget. Set
+    ``QUERY_BUDGET_REPORT=1`` to print every endpoint's numbers.
+    """
+    REPEAT_LIMIT = 2
+    CASES = [
+        ('category-list', 'get', 'categories/', False, None, 3, 10),
+        ('category-detail', 'get', 'categories/{category}/', False, None, 2, 3),
+        ('category-all-flat', 'get', 'categories/all_flat/', False, None, 2, 15),
+        ('brand-list', 'get', 'brands/', False, None, 2, 5),
+        ('brand-detail', 'get', 'brands/{brand}/', False, None, 1, 1),
+        ('brand-featured', 'get', 'brands/featured/', False, None, 1, 2),
+        ('product-list', 'get', 'products/', False, None, 4, 141),
+        ('product-list', 'get', 'products/?is_featured=true', False, None, 4, 141),
+        ('product-list', 'get', 'products/?search=phone', False, None, 4, 141),
+        ('product-detail', 'get', 'products/{product}/', False, None, 7, 17),
+        ('product-related', 'get', 'products/{product}/related/', False, None, 6, 49),
+        ('product-reviews', 'get', 'products/{product}/reviews/', False, None, 2, 6),
+        ('product-reviews', 'post', 'products/{unreviewed}/reviews/', True,
+         {'rating': 4, 'comment': 'Solid'}, 4, 1),
+        ('product-featured', 'get', 'products/featured/', False, None, 3, 70),
+        ('product-by-category', 'get', 'products/by_category/?slug={category}', False, None, 5, 142),
+        ('product-by-brand', 'get', 'products/by_brand/?slug={brand}', False, None, 4, 106),
+        ('product-best-sellers', 'get', 'products/best_sellers/', False, None, 4, 129),
+        ('product-new-arrivals', 'get', 'products/new_arrivals/', False, None, 3, 70),
+        ('banner-list', 'get', 'banners/', False, None, 2, 7),
+        ('banner-detail', 'get', 'banners/{banner}/', False, None, 1, 1),
+        ('banner-hero', 'get', 'banners/hero/', False, None, 1, 3),
+        ('banner-promo', 'get', 'banners/promo/', False, None, 1, 2),
+        ('cart-list', 'get', 'cart/', False, None, 12, 2),
+        ('cart-list', 'get', 'cart/', True, None, 4, 29),
+        ('cart-list', 'post', 'cart/', True, {'product_id': '{unreviewed_id}', 'quantity': 1}, 9, 38),
+        ('cart-detail', 'delete', 'cart/{cart_item}/', True, None, 7, 23),
+        ('cart-update-item', 'patch', 'cart/update_item/', True, {'item_id': '{cart_item}', 'quantity': 2}, 7, 31),
+        ('cart-clear', 'delete', 'cart/clear/', True, None, 4, 1),
+        ('order-list', 'get', 'orders/', True, None, 3, 21),
+        # Includes claiming the order number: inside the test's transaction no block is cached.
+        ('order-list', 'post', 'orders/', True, CHECKOUT_PAYLOAD, 16, 14),
+        ('order-detail', 'get', 'orders/{order}/', True, None, 2, 4),
+        ('wishlist-list', 'get', 'wishlist/', True, None, 3, 56),
+        ('wishlist-list', 'post', 'wishlist/', True, {'product_id': '{unreviewed_id}'}, 10, 13),
+        ('wishlist-detail', 'delete', 'wishlist/{wishlist_item}/', True, None, 2, 0),
+        ('register', 'post', 'auth/register/', False, {
+            'username': 'newbie', 'email': 'newbie@example.com', 'password': 'pass12345', 'password2': 'pass12345',
+        }, 6, 2),
+        ('login', 'post', 'auth/login/', False, {'email': 'buyer@example.com', 'password': 'pass12345'}, 3, 3),
+        ('token_refresh', 'post', 'auth/refresh/', False, {'refresh': '{refresh}'}, 0, 0),
+        ('profile', 'get', 'auth/profile/', True, None, 1, 1),
+        ('profile', 'patch', 'auth/profile/', True, {'first_name': 'Wanjiru', 'phone': '0700000000'}, 4, 2),
+        ('mpesa_stk_push', 'post', 'mpesa/stk-push/', True, {'phone': '0712345678', 'order_id': '{order}'}, 2, 1),
+        ('mpesa_stk_push_status', 'get', 'mpesa/stk-push/{job}/', True, None, 1, 1),
+        ('mpesa_callback', 'post', 'mpesa/callback/', False, {'Body': {'stkCallback': {
+            'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 0, 'ResultDesc': 'OK',
+            'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'RCP1'}]},
+        }}}, 10, 1),
+        ('recently_viewed', 'get', 'recently-viewed/', True, None, 3, 70),
+        ('membership', 'post', 'membership/', True, {'product_ids': ['{unreviewed_id}', '{product_id}']}, 1, 12),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        brands = [Brand.objects.create(name=f'Brand {i}', is_featured=i < 2) for i in range(4)]
+        categories = []
+        for i in range(3):
+            parent = Category.objects.create(name=f'Category {i}')
+            categories += [parent] + [Category.objects.create(name=f'Category {i}.{j}', parent=parent) for j in range(2)]
+        reviewers = [User.objects.create_user(username=f'reviewer{i}', password='pass12345') for i in range(5)]
+        cls.buyer = User.objects.create_user(username='buyer', email='buyer@example.com', password='pass12345')
+        UserProfile.objects.create(user=cls.buyer)
+
+        products = []
+        for i in range(60):
+            product = Product.objects.create(
+                name=f'Phone {i}', brand=brands[i % 4], category=categories[i % 9],
+                is_featured=i % 3 == 0, is_hot=i % 4 == 0, is_new=i % 5 == 0,
+            )
+            for j in range(3):
+                ProductVariant.objects.create(product=product, name=f'{64 << j}GB', price=Decimal(20000 + j * 5000),
+                                              stock=5)
+                ProductImage.objects.create(product=product, image=f'products/{i}-{j}.jpg', is_primary=j == 1, order=j)
+            for j in range(4):
+                ProductSpecification.objects.create(product=product, key=f'Spec {j}', value='Yes', order=j)
+            for reviewer in reviewers[:i % 6]:
+                Review.objects.create(product=product, user=reviewer, rating=4, comment='Good')
+            ProductPopularity.objects.create(product=product, score=i)
+            products.append(product)
+
+        for i, position in enumerate(['hero', 'hero', 'hero', 'promo', 'promo', 'section']):
+            Banner.objects.create(title=f'Banner {i}', image=f'banners/{i}.jpg', position=position, order=i)
+
+        orders = []
+        for i in range(5):
+            order = Order.objects.create(
+                user=cls.buyer, **{k: v for k, v in CHECKOUT_PAYLOAD.items() if k != 'payment_method'},
+                subtotal=Decimal('60000'), total=Decimal('60200'),
+            )
+            for product in products[i * 3:i * 3 + 3]:
+                variant = product.variants.first()
+                OrderItem.objects.create(order=order, product=product, variant=variant, product_name=product.name,
+                                         variant_name=variant.name, price=variant.price, quantity=1)
+            orders.append(order)
+        MpesaTransaction.objects.create(order=orders[0], checkout_request_id='ws_CO_1', amount=Decimal('60200'),
+                                        phone='254712345678')
+        job = StkPushJob.objects.create(order=orders[0], phone='254712345678')
+
+        cart = Cart.objects.create(user=cls.buyer)
+        cart_items = [
+            CartItem.objects.create(cart=cart, product=product, variant=product.variants.last(), quantity=1)
+            for product in products[20:24]
+        ]
+        wishlist = [Wishlist.objects.create(user=cls.buyer, product=product) for product in products[30:38]]
+        RecentlyViewed.objects.bulk_create(
+            RecentlyViewed(user=cls.buyer, product=product) for product in products[40:50]
+        )
+
+        cls.refs = {
+            'category': categories[0].slug, 'brand': brands[0].slug, 'banner': Banner.objects.first().pk,
+            'product': products[5].slug, 'product_id': str(products[5].pk),
+            'unreviewed': products[0].slug, 'unreviewed_id': str(products[0].pk),
+            'cart_item': cart_items[0].pk, 'wishlist_item': wishlist[0].pk,
+            'order': str(orders[0].pk), 'job': str(job.pk), 'refresh': str(RefreshToken.for_user(cls.buyer)),
+        }
+
+    def fill(self, value):
+        if isinstance(value, dict):
+            return {key: self.fill(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.fill(item) for item in value]
+        return value.format(**self.refs) if isinstance(value, str) else value
+
+    def measure(self, method, path, logged_in, payload):
+        client = APIClient()
+        if logged_in:
+            client.force_authenticate(user=self.buyer)
+        cache.clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as captured:
+                response = getattr(client, method)(f'/api/v1/{path}', payload, format='json')
+            selects = [q['sql'] for q in captured if q['sql'].startswith('SELECT')]
+            with connection.cursor() as cursor:
+                rows = 0
+                for sql in selects:
+                    cursor.execute(f'SELECT COUNT(*) FROM ({sql}) AS budget')
+                    rows += cursor.fetchone()[0]
+            transaction.set_rollback(True)
+        shapes = Counter(query_shape(q['sql']) for q in captured)
+        return response, len(captured), rows, shapes
+
+    def test_every_route_has_a_budget(self):
+        def names(patterns):
+            for pattern in patterns:
+                if hasattr(pattern, 'url_patterns'):
+                    yield from names(pattern.url_patterns)
+                elif pattern.name != 'api-root':
+                    yield pattern.name
+
+        self.assertEqual(set(names(store_urls.urlpatterns)), {case[0] for case in self.CASES})
+
+    def test_endpoints_stay_within_budget(self):
+        report = os.environ.get('QUERY_BUDGET_REPORT') == '1'
+        for name, method, path, logged_in, payload, max_queries, max_rows in self.CASES:
+            path, payload = self.fill(path), self.fill(payload)
+            with self.subTest(f'{method.upper()} {path}'):
+                response, queries, rows, shapes = self.measure(method, path, logged_in, payload)
+                repeated = {shape: n for shape, n in shapes.items() if n > 1}
+                detail = ''.join(f'\n  {n}x {shape[:200]}' for shape, n in repeated.items())
+                if report:
+                    print(f'{method.upper():6} {path:45} {response.status_code} {queries:3} queries {rows:4} rows{detail}')
+                self.assertLess(response.status_code, 400, response.data)
+                self.assertLessEqual(queries, max_queries, f'{queries} queries, repeated shapes:{detail}')
+                self.assertLessEqual(rows, max_rows, f'{rows} rows fetched')
+                self.assertLessEqual(max(shapes.values(), default=0), self.REPEAT_LIMIT, f'per-row queries:{detail}')
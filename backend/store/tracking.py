@@ -0,0 +1,191 @@
+"""
+Write-behind tracking of product views.
+
+Product pages are the hottest read endpoint, so ``record_view`` never touches
+the database: it records the view in a per-process buffer keyed by
+(viewer, product), so repeat views coalesce. The buffer is flushed on the
+background pool once it holds ``FLUSH_SIZE`` entries, and otherwise by a
+timer armed when the first view is buffered, so nothing waits longer than
+``FLUSH_INTERVAL`` seconds even on an idle worker. (With
+``BACKGROUND_TASKS_EAGER`` no timer thread is started; the interval is then
+checked on the next view.) Each flush is one
+``bulk_create(update_conflicts=True)`` per viewer kind followed by a
+set-based prune that keeps each touched viewer's newest ``HISTORY`` rows. If
+flushing falls behind, the oldest entries beyond ``BUFFER_MAX`` are dropped:
+recently-viewed lists are best effort.
+
+The same buffer counts views per product (including anonymous visitors
+without a session). Each flush adds the counts to
+``ProductPopularity.pending_views`` with one UPDATE per distinct count, for
+``store.popularity`` to fold into the popularity score.
+
+Views reach the database up to ``FLUSH_INTERVAL`` seconds late and a crash
+loses at most that much history. ``prune_stale`` removes rows older than
+``RETENTION_DAYS`` (``python manage.py prune_recently_viewed``).
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from . import tasks
+from .models import Product, ProductPopularity, RecentlyViewed
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'HISTORY': 20,            # rows kept per user or session
+    'FLUSH_INTERVAL': 10,     # seconds between flushes
+    'FLUSH_SIZE': 500,        # flush early once this many views are pending
+    'BUFFER_MAX': 10_000,     # oldest pending views dropped beyond this
+    'RETENTION_DAYS': 90,
+}
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'RECENTLY_VIEWED', {})}
+
+
+class ViewBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()   # (user_id, session_key, product_id) -> viewed_at
+        self._counts = Counter()        # product_id -> views
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+    def add(self, user_id, session_key, product_id):
+        config = _config()
+        with self._lock:
+            self._counts[product_id] += 1
+            if user_id or session_key:
+                key = (user_id, None if user_id else session_key, product_id)
+                self._pending.pop(key, None)
+                self._pending[key] = timezone.now()
+                while len(self._pending) > config['BUFFER_MAX']:
+                    self._pending.popitem(last=False)
+            due = len(self._pending) >= config['FLUSH_SIZE']
+            if settings.BACKGROUND_TASKS_EAGER:
+                due = due or time.monotonic() - self._last_flush >= config['FLUSH_INTERVAL']
+            elif not due and self._timer is None:
+                self._timer = threading.Timer(config['FLUSH_INTERVAL'], self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+            batch = self._take() if due else None
+        if batch:
+            tasks.submit(write_views, *batch)
+
+    def drain(self):
+        with self._lock:
+            return self._take()
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._timer = None
+            batch = self._take()
+        if batch[1]:
+            tasks.submit(write_views, *batch)
+
+    def _take(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = (self._pending, self._counts)
+        self._pending, self._counts = OrderedDict(), Counter()
+        self._last_flush = time.monotonic()
+        return batch
+
+
+_buffer = ViewBuffer()
+
+
+def record_view(request, product):
+    """Buffer a product view, and a history entry for the user or session if any."""
+    if request.user.is_authenticated:
+        _buffer.add(request.user.pk, None, product.pk)
+    else:
+        _buffer.add(None, request.session.session_key, product.pk)
+
+
+def flush():
+    """Write everything buffered in this process now."""
+    write_views(*_buffer.drain())
+
+
+def discard():
+    """Drop everything buffered in this process without writing it."""
+    _buffer.drain()
+
+
+def write_views(history, counts):
+    if not counts:
+        return
+    # Products deleted since they were viewed would fail the foreign keys.
+    live = set(Product.objects.filter(pk__in=counts).values_list('pk', flat=True))
+    _add_view_counts({product_id: views for product_id, views in counts.items() if product_id in live})
+
+    user_rows, session_rows = [], []
+    for (user_id, session_key, product_id), viewed_at in history.items():
+        if product_id not in live:
+            continue
+        row = RecentlyViewed(user_id=user_id, session_key=session_key, product_id=product_id, viewed_at=viewed_at)
+        (user_rows if user_id else session_rows).append(row)
+
+    if user_rows:
+        RecentlyViewed.objects.bulk_create(
+            user_rows, update_conflicts=True, unique_fields=['user', 'product'], update_fields=['viewed_at']
+        )
+        _trim('user', {row.user_id for row in user_rows})
+    if session_rows:
+        RecentlyViewed.objects.bulk_create(
+            session_rows, update_conflicts=True, unique_fields=['session_key', 'product'],
+            update_fields=['viewed_at'],
+        )
+        _trim('session_key', {row.session_key for row in session_rows})
+
+
+def _add_view_counts(counts):
+    ProductPopularity.objects.bulk_create(
+        [ProductPopularity(product_id=product_id) for product_id in counts], ignore_conflicts=True
+    )
+    by_count = defaultdict(list)
+    for product_id, views in counts.items():
+        by_count[views].append(product_id)
+    for views, product_ids in by_count.items():
+        ProductPopularity.objects.filter(product_id__in=product_ids).update(pending_views=F('pending_views') + views)
+
+
+def _trim(owner, owners):
+    """Delete all but the newest ``HISTORY`` rows of each of ``owners``."""
+    overflow = list(
+        RecentlyViewed.objects.filter(**{f'{owner}__in': owners})
+        .annotate(position=Window(RowNumber(), partition_by=[F(owner)], order_by=F('viewed_at').desc()))
+        .filter(position__gt=_config()['HISTORY'])
+        .values_list('pk', flat=True)
+    )
+    if overflow:
+        RecentlyViewed.objects.filter(pk__in=overflow).delete()
+
+
+def prune_stale(days=None):
+    """Delete views older than ``days`` (default ``RETENTION_DAYS``); returns the count."""
+    cutoff = timezone.now() - timedelta(days=days or _config()['RETENTION_DAYS'])
+    deleted, _ = RecentlyViewed.objects.filter(viewed_at__lt=cutoff).delete()
+    return deleted
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Could not flush buffered product views at exit")
+
+
+atexit.register(_flush_at_exit)
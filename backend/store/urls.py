@@ -3,9 +3,9 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     CategoryViewSet, BrandViewSet, ProductViewSet,
     BannerViewSet, CartViewSet, OrderViewSet,
-    MpesaSTKPushView, MpesaCallbackView,
+    MpesaSTKPushView, MpesaSTKPushStatusView, MpesaCallbackView,
     RegisterView, LoginView, ProfileView,
-    RecentlyViewedView, WishlistViewSet
+    RecentlyViewedView, WishlistViewSet, MembershipView
 )
 from rest_framework_simplejwt.views import TokenRefreshView
 
@@ -29,8 +29,12 @@ urlpatterns = [
 
     # M-Pesa
     path('mpesa/stk-push/', MpesaSTKPushView.as_view(), name='mpesa_stk_push'),
+    path('mpesa/stk-push/<uuid:job_id>/', MpesaSTKPushStatusView.as_view(), name='mpesa_stk_push_status'),
     path('mpesa/callback/', MpesaCallbackView.as_view(), name='mpesa_callback'),
 
     # Recently Viewed
     path('recently-viewed/', RecentlyViewedView.as_view(), name='recently_viewed'),
+
+    # Wishlist / cart membership for product cards
+    path('membership/', MembershipView.as_view(), name='membership'),
 ]
\ No newline at end of file
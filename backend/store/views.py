@@ -1,25 +1,35 @@
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly, AllowAny
+from rest_framework.generics import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, F, Prefetch, Q, prefetch_related_objects
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-import requests
-import base64
-import json
-from datetime import datetime
 from django.conf import settings
 from decimal import Decimal
 
 from .models import (
     Category, Brand, Product, ProductVariant, Review,
     Banner, Cart, CartItem, Order, OrderItem,
-    RecentlyViewed, UserProfile, Wishlist, MpesaTransaction
+    RecentlyViewed, UserProfile, Wishlist, StkPushJob
 )
+from .authentication import normalize_email, users_with_email
+from .banners import live_banners, scheduled
+from .idempotency import idempotent
+from .inventory import InsufficientStock, reserve, convert_reservations, with_available_stock
+from .membership import membership_bitmaps
+from .pagination import ReviewCursorPagination
+from .payments import enqueue_stk_push, record_stk_callback
+from .popularity import top_product_ids
+from .reviews import is_verified_purchase
+from .sequences import allocate_order_number
 from .serializers import (
     CategorySerializer, BrandSerializer,
     ProductListSerializer, ProductDetailSerializer,
@@ -27,9 +37,18 @@ from .serializers import (
     BannerSerializer, CartSerializer, CartItemSerializer,
     OrderSerializer, OrderCreateSerializer,
     UserSerializer, RegisterSerializer,
-    RecentlyViewedSerializer, WishlistSerializer,
-    MpesaSTKPushSerializer
+    RecentlyViewedSerializer, WishlistSerializer, MembershipQuerySerializer,
+    MpesaSTKPushSerializer, StkPushJobSerializer
 )
+from .throttles import LoginThrottle, reset_login_strikes
+from .tracking import record_view
+
+# Product cards only price active variants; this prefetch is served by variant_product_active_idx.
+ACTIVE_VARIANTS = ProductVariant.objects.filter(is_active=True)
+
+# What ProductListSerializer reads, for querysets of rows with a ``product``.
+PRODUCT_CARD_SELECT = ['product__brand', 'product__category']
+PRODUCT_CARD_PREFETCH = ['product__images', Prefetch('product__variants', queryset=ACTIVE_VARIANTS)]
 
 
 # ──────────────────────────────────────────────
@@ -43,7 +62,7 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['get'])
     def all_flat(self, request):
         """Return all categories including subcategories flat."""
-        cats = Category.objects.filter(is_active=True)
+        cats = Category.objects.filter(is_active=True).prefetch_related('subcategories')
         return Response(CategorySerializer(cats, many=True).data)
 
 
@@ -51,7 +70,9 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
 # Brand
 # ──────────────────────────────────────────────
 class BrandViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Brand.objects.filter(is_active=True)
+    queryset = Brand.objects.filter(is_active=True).annotate(
+        active_product_count=Count('products', filter=Q(products__is_active=True))
+    ).order_by('name')   # Meta.ordering isn't applied to aggregate queries
     serializer_class = BrandSerializer
     lookup_field = 'slug'
 
@@ -66,7 +87,7 @@ class BrandViewSet(viewsets.ReadOnlyModelViewSet):
 # ──────────────────────────────────────────────
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Product.objects.filter(is_active=True).select_related('brand', 'category').prefetch_related(
-        'images', 'variants', 'reviews'
+        'images', Prefetch('variants', queryset=ACTIVE_VARIANTS)
     )
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['brand__slug', 'category__slug', 'is_featured', 'is_hot', 'is_new']
@@ -75,24 +96,30 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     ordering = ['-created_at']
     lookup_field = 'slug'
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            # The detail page lists inactive variants too, with what is left after holds.
+            variants = with_available_stock(ProductVariant.objects.all())
+            queryset = queryset.prefetch_related(None).prefetch_related('images', Prefetch('variants', variants))
+        return queryset
+
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return ProductDetailSerializer
         return ProductListSerializer
 
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.query_params.get('search') and 'ordering' not in self.request.query_params:
+            # Rank matches by the rolled-up popularity score (store/popularity.py).
+            queryset = queryset.order_by(F('popularity__score').desc(nulls_last=True), '-created_at')
+        return queryset
+
     def retrieve(self, request, *args, **kwargs):
         """Override to track recently viewed."""
         instance = self.get_object()
-        if request.user.is_authenticated:
-            RecentlyViewed.objects.update_or_create(
-                user=request.user, product=instance,
-                defaults={'viewed_at': datetime.now()}
-            )
-        elif request.session.session_key:
-            RecentlyViewed.objects.update_or_create(
-                session_key=request.session.session_key, product=instance,
-                defaults={'viewed_at': datetime.now()}
-            )
+        record_view(request, instance)   # Buffered; written in bulk off the request path
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
@@ -100,9 +127,7 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     def related(self, request, slug=None):
         """Products in same category, excluding current."""
         product = self.get_object()
-        related = Product.objects.filter(
-            is_active=True, category=product.category
-        ).exclude(id=product.id)[:8]
+        related = self.queryset.filter(category=product.category).exclude(id=product.id)[:8]
         return Response(ProductListSerializer(related, many=True).data)
 
     @action(detail=False, methods=['get'])
@@ -141,23 +166,32 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
 
     @action(detail=False, methods=['get'])
     def best_sellers(self, request):
-        products = self.queryset.filter(is_hot=True)[:10]
-        return Response(ProductListSerializer(products, many=True).data)
+        ids = top_product_ids(10)
+        if not ids:
+            # No popularity rollup yet; fall back to the hand-picked list.
+            products = self.queryset.filter(is_hot=True)[:10]
+            return Response(ProductListSerializer(products, many=True).data)
+        products = {str(p.id): p for p in self.queryset.filter(id__in=ids)}
+        ranked = [products[i] for i in ids if i in products]
+        return Response(ProductListSerializer(ranked, many=True).data)
 
     @action(detail=False, methods=['get'])
     def new_arrivals(self, request):
         products = self.queryset.filter(is_new=True).order_by('-created_at')[:10]
         return Response(ProductListSerializer(products, many=True).data)
 
-    @action(detail=True, methods=['post', 'get'], permission_classes=[IsAuthenticated])
+    @action(detail=True, methods=['post', 'get'], permission_classes=[IsAuthenticatedOrReadOnly])
     def reviews(self, request, slug=None):
-        product = self.get_object()
+        # No prefetching: this action only needs the product's id.
+        product = get_object_or_404(Product, is_active=True, slug=slug)
         if request.method == 'GET':
-            reviews = product.reviews.all()
-            return Response(ReviewSerializer(reviews, many=True).data)
+            paginator = ReviewCursorPagination()
+            # No view: its OrderingFilter would override the pagination ordering.
+            page = paginator.paginate_queryset(product.reviews.select_related('user'), request)
+            return paginator.get_paginated_response(ReviewSerializer(page, many=True).data)
         serializer = ReviewSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save(product=product)
+            serializer.save(product=product, is_verified_purchase=is_verified_purchase(request.user, product))
             return Response(serializer.data, status=201)
         return Response(serializer.errors, status=400)
 
@@ -169,10 +203,16 @@ class BannerViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Banner.objects.filter(is_active=True)
     serializer_class = BannerSerializer
 
+    def get_queryset(self):
+        return scheduled(super().get_queryset(), timezone.now())
+
     @action(detail=False, methods=['get'])
     def hero(self, request):
-        banners = self.queryset.filter(position='hero')
-        return Response(BannerSerializer(banners, many=True).data)
+        return Response(live_banners('hero'))
+
+    @action(detail=False, methods=['get'])
+    def promo(self, request):
+        return Response(live_banners('promo'))
 
 
 # ──────────────────────────────────────────────
@@ -188,9 +228,14 @@ class CartViewSet(viewsets.ViewSet):
             cart, _ = Cart.objects.get_or_create(session_key=request.session.session_key)
         return cart
 
+    def cart_data(self, cart):
+        items = CartItem.objects.select_related('variant', *PRODUCT_CARD_SELECT).prefetch_related(*PRODUCT_CARD_PREFETCH)
+        prefetch_related_objects([cart], Prefetch('items', queryset=items))
+        return CartSerializer(cart).data
+
     def list(self, request):
         cart = self.get_cart(request)
-        return Response(CartSerializer(cart).data)
+        return Response(self.cart_data(cart))
 
     def create(self, request):
         """Add item to cart."""
@@ -198,7 +243,7 @@ class CartViewSet(viewsets.ViewSet):
         serializer = CartItemSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save(cart=cart)
-            return Response(CartSerializer(cart).data, status=201)
+            return Response(self.cart_data(cart), status=201)
         return Response(serializer.errors, status=400)
 
     def destroy(self, request, pk=None):
@@ -207,7 +252,7 @@ class CartViewSet(viewsets.ViewSet):
         try:
             item = CartItem.objects.get(id=pk, cart=cart)
             item.delete()
-            return Response(CartSerializer(cart).data)
+            return Response(self.cart_data(cart))
         except CartItem.DoesNotExist:
             return Response({'error': 'Item not found'}, status=404)
 
@@ -223,7 +268,7 @@ class CartViewSet(viewsets.ViewSet):
             else:
                 item.quantity = quantity
                 item.save()
-            return Response(CartSerializer(cart).data)
+            return Response(self.cart_data(cart))
         except CartItem.DoesNotExist:
             return Response({'error': 'Item not found'}, status=404)
 
@@ -231,7 +276,7 @@ class CartViewSet(viewsets.ViewSet):
     def clear(self, request):
         cart = self.get_cart(request)
         cart.items.all().delete()
-        return Response(CartSerializer(cart).data)
+        return Response(self.cart_data(cart))
 
 
 # ──────────────────────────────────────────────
@@ -244,6 +289,7 @@ class OrderViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Order.objects.filter(user=self.request.user).prefetch_related('items')
 
+    @idempotent('orders.create')
     def create(self, request):
         serializer = OrderCreateSerializer(data=request.data)
         if not serializer.is_valid():
@@ -255,36 +301,72 @@ class OrderViewSet(viewsets.ModelViewSet):
         except Cart.DoesNotExist:
             return Response({'error': 'Cart is empty'}, status=400)
 
-        if not cart.items.exists():
-            return Response({'error': 'Cart is empty'}, status=400)
-
-        # Build order
         shipping_fee = Decimal('200.00')  # Flat rate
-        subtotal = cart.total
-        total = subtotal + shipping_fee
-
-        order = Order.objects.create(
-            user=request.user,
-            subtotal=subtotal,
-            shipping_fee=shipping_fee,
-            total=total,
-            **serializer.validated_data
-        )
-
-        # Create order items
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                variant=cart_item.variant,
-                product_name=cart_item.product.name,
-                variant_name=cart_item.variant.name if cart_item.variant else '',
-                price=cart_item.variant.effective_price if cart_item.variant else (cart_item.product.min_price or 0),
-                quantity=cart_item.quantity
+        # Claimed outside the transaction, where it can come from this process's cached block.
+        order_number = allocate_order_number()
+
+        # Checkout is one unit of work: either the order, its items, the
+        # stock holds and the emptied cart all land, or none of them do.
+        with transaction.atomic():
+            cart_items = list(cart.items.select_related('product', 'variant'))
+            if not cart_items:
+                return Response({'error': 'Cart is empty'}, status=400)
+
+            # Lock the variants in a stable order so concurrent checkouts of
+            # overlapping carts queue up instead of deadlocking.
+            variant_ids = sorted({item.variant_id for item in cart_items if item.variant_id})
+            variants = {
+                v.id: v for v in ProductVariant.objects.select_for_update().filter(id__in=variant_ids).order_by('id')
+            }
+
+            lines = []
+            for cart_item in cart_items:
+                variant = variants.get(cart_item.variant_id)
+                if variant is not None:
+                    price = variant.effective_price
+                else:
+                    price = cart_item.product.min_price or 0
+                lines.append((cart_item, variant, price))
+
+            subtotal = sum(price * cart_item.quantity for cart_item, _, price in lines)
+            order = Order.objects.create(
+                user=request.user,
+                order_number=order_number,
+                subtotal=subtotal,
+                shipping_fee=shipping_fee,
+                total=subtotal + shipping_fee,
+                **serializer.validated_data
             )
 
-        # Clear cart
-        cart.items.all().delete()
+            try:
+                reserve(order, [(variant, cart_item.quantity) for cart_item, variant, _ in lines if variant])
+            except InsufficientStock as e:
+                transaction.set_rollback(True)
+                return Response({
+                    'error': f'Insufficient stock for {e.variant.product.name} - {e.variant.name}',
+                    'variant_id': e.variant.id,
+                    'available': e.available,
+                }, status=409)
+
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=cart_item.product,
+                    variant=variant,
+                    product_name=cart_item.product.name,
+                    variant_name=variant.name if variant else '',
+                    price=price,
+                    quantity=cart_item.quantity
+                )
+                for cart_item, variant, price in lines
+            ])
+
+            # Only M-Pesa confirms payment asynchronously; other methods sell now.
+            if order.payment_method != 'mpesa':
+                convert_reservations(order)
+
+            # Clear cart
+            cart.items.all().delete()   # Related manager: the membership signal reuses ``cart``
 
         return Response(OrderSerializer(order).data, status=201)
 
@@ -299,41 +381,7 @@ class OrderViewSet(viewsets.ModelViewSet):
 class MpesaSTKPushView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def _get_access_token(self):
-        consumer_key = settings.MPESA_CONSUMER_KEY
-        consumer_secret = settings.MPESA_CONSUMER_SECRET
-
-        if not consumer_key or not consumer_secret:
-            raise ValueError(
-                "MPESA_CONSUMER_KEY or MPESA_CONSUMER_SECRET is empty. "
-                "Check your .env file and that load_dotenv() is called in settings.py."
-            )
-
-        auth = base64.b64encode(f"{consumer_key}:{consumer_secret}".encode()).decode()
-
-        try:
-            r = requests.get(
-                f"{settings.MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials",
-                headers={"Authorization": f"Basic {auth}"},
-                timeout=30,
-            )
-            r.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            raise ValueError(f"M-Pesa OAuth network error: {e}")
-
-        if not r.text.strip():
-            raise ValueError(
-                f"Empty response from M-Pesa OAuth (HTTP {r.status_code}). "
-                "Wrong credentials or base URL."
-            )
-
-        data = r.json()
-        token = data.get('access_token')
-        if not token:
-            raise ValueError(f"No access_token in M-Pesa response: {data}")
-
-        return token
-
+    @idempotent('mpesa.stk_push')
     def post(self, request):
         serializer = MpesaSTKPushSerializer(data=request.data)
         if not serializer.is_valid():
@@ -347,82 +395,33 @@ class MpesaSTKPushView(APIView):
         except Order.DoesNotExist:
             return Response({'error': 'Order not found'}, status=404)
 
-        token = self._get_access_token()
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        password = base64.b64encode(
-            f"{settings.MPESA_SHORTCODE}{settings.MPESA_PASSKEY}{timestamp}".encode()
-        ).decode()
-
-        payload = {
-            "BusinessShortCode": settings.MPESA_SHORTCODE,
-            "Password": password,
-            "Timestamp": timestamp,
-            "TransactionType": "CustomerPayBillOnline",
-            "Amount": int(order.total),
-            "PartyA": phone,
-            "PartyB": settings.MPESA_SHORTCODE,
-            "PhoneNumber": phone,
-            "CallBackURL": settings.MPESA_CALLBACK_URL,
-            "AccountReference": order.order_number,
-            "TransactionDesc": f"Payment for order {order.order_number}"
-        }
-
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-
-        r = requests.post(
-            f"{settings.MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest",
-            json=payload, headers=headers
-        )
-        data = r.json()
-
-        if data.get('ResponseCode') == '0':
-            checkout_request_id = data['CheckoutRequestID']
-            MpesaTransaction.objects.create(
-                order=order,
-                checkout_request_id=checkout_request_id,
-                merchant_request_id=data.get('MerchantRequestID', ''),
-                amount=order.total,
-                phone=phone
-            )
-            order.mpesa_checkout_request_id = checkout_request_id
-            order.mpesa_phone = phone
-            order.save()
-            return Response({'message': 'STK push sent. Check your phone.', 'checkout_request_id': checkout_request_id})
-        return Response({'error': 'Failed to initiate payment', 'details': data}, status=400)
+        # Daraja is called by a background worker; the client polls the job.
+        job = enqueue_stk_push(order, phone)
+        return Response({
+            'message': 'STK push queued.',
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': reverse('mpesa_stk_push_status', args=[job.id], request=request),
+        }, status=202)
+
+
+class MpesaSTKPushStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        try:
+            job = StkPushJob.objects.select_related('order').get(id=job_id, order__user=request.user)
+        except StkPushJob.DoesNotExist:
+            return Response({'error': 'Job not found'}, status=404)
+        return Response(StkPushJobSerializer(job).data)
 
 
 class MpesaCallbackView(APIView):
     permission_classes = [AllowAny]
 
     def post(self, request):
-        data = request.data
-        stk = data.get('Body', {}).get('stkCallback', {})
-        checkout_request_id = stk.get('CheckoutRequestID')
-        result_code = str(stk.get('ResultCode', ''))
-        result_desc = stk.get('ResultDesc', '')
-
-        try:
-            tx = MpesaTransaction.objects.get(checkout_request_id=checkout_request_id)
-            tx.result_code = result_code
-            tx.result_desc = result_desc
-
-            if result_code == '0':
-                items = {i['Name']: i.get('Value', '') for i in stk.get('CallbackMetadata', {}).get('Item', [])}
-                tx.mpesa_receipt = items.get('MpesaReceiptNumber', '')
-                tx.status = 'success'
-                tx.order.payment_status = 'paid'
-                tx.order.status = 'confirmed'
-                tx.order.mpesa_transaction_id = tx.mpesa_receipt
-                tx.order.save()
-            else:
-                tx.status = 'failed'
-            tx.save()
-        except MpesaTransaction.DoesNotExist:
-            pass
-
+        # Journal the delivery, then dedupe, apply and settle stock in one short transaction.
+        record_stk_callback(request.data)
         return Response({'ResultCode': 0, 'ResultDesc': 'Accepted'})
 
 
@@ -449,20 +448,20 @@ class RegisterView(APIView):
 
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [LoginThrottle]   # Rejects floods before any password hashing
 
     def post(self, request):
+        if not isinstance(request.data, dict):
+            return Response({'error': 'Expected an object with email and password'}, status=400)
         email = request.data.get('email', '')
         password = request.data.get('password', '')
 
         # Allow login via email or username
-        try:
-            user_obj = User.objects.get(email=email)
-            username = user_obj.username
-        except User.DoesNotExist:
-            username = email  # Fallback to username
+        username = users_with_email(email).values_list('username', flat=True).first() or email
 
         user = authenticate(username=username, password=password)
         if user:
+            reset_login_strikes(email)
             refresh = RefreshToken.for_user(user)
             return Response({
                 'user': UserSerializer(user).data,
@@ -477,13 +476,22 @@ class LoginView(APIView):
 class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
+    def get_user(self, request):
+        # request.user is a LazyUser; fetch the full row and profile in one query.
+        return User.objects.select_related('profile').get(pk=request.user.pk)
+
     def get(self, request):
-        return Response(UserSerializer(request.user).data)
+        return Response(UserSerializer(self.get_user(request)).data)
 
     def patch(self, request):
-        user = request.user
+        user = self.get_user(request)
+        if 'email' in request.data:
+            email = normalize_email(request.data['email'])
+            if email and users_with_email(email).exclude(pk=user.pk).exists():
+                return Response({'email': 'Email already registered.'}, status=400)
+            user.email = email
         # Update user fields
-        for field in ['first_name', 'last_name', 'email']:
+        for field in ['first_name', 'last_name']:
             if field in request.data:
                 setattr(user, field, request.data[field])
         user.save()
@@ -504,19 +512,35 @@ class ProfileView(APIView):
 class RecentlyViewedView(APIView):
     def get(self, request):
         if request.user.is_authenticated:
-            items = RecentlyViewed.objects.filter(user=request.user).select_related('product')[:10]
+            items = RecentlyViewed.objects.filter(user=request.user)
         elif request.session.session_key:
-            items = RecentlyViewed.objects.filter(session_key=request.session.session_key).select_related('product')[:10]
+            items = RecentlyViewed.objects.filter(session_key=request.session.session_key)
         else:
-            items = []
+            return Response([])
+        items = items.select_related(*PRODUCT_CARD_SELECT).prefetch_related(*PRODUCT_CARD_PREFETCH)[:10]
         return Response(RecentlyViewedSerializer(items, many=True).data)
 
 
+class MembershipView(APIView):
+    """Which of up to 500 products the viewer has wishlisted or in their cart."""
+    permission_classes = [AllowAny]   # Anonymous visitors still have a session cart
+
+    def post(self, request):
+        serializer = MembershipQuerySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        product_ids = [str(pid) for pid in serializer.validated_data['product_ids']]
+        return Response(membership_bitmaps(request, product_ids))
+
+
 class WishlistViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
     def list(self, request):
-        items = Wishlist.objects.filter(user=request.user).select_related('product')
+        items = (
+            Wishlist.objects.filter(user=request.user)
+            .select_related(*PRODUCT_CARD_SELECT).prefetch_related(*PRODUCT_CARD_PREFETCH)
+        )
         return Response(WishlistSerializer(items, many=True).data)
 
     def create(self, request):
@@ -1,11 +1,13 @@
 // src/pages/Checkout.jsx
-import { useState } from 'react';
+import { useRef, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useApp } from '../context/AppContext';
 import api from '../utils/api';
 import { BASE_URL } from '../utils/api';
 
 const STEPS = ['Cart Review', 'Delivery', 'Payment'];
+const STK_POLL_INTERVAL = 1500;   // ms
+const STK_POLL_ATTEMPTS = 40;     // about a minute before giving up
 
 export default function Checkout() {
   const { cart, isLoggedIn, showToast, fetchCart } = useApp();
@@ -15,6 +17,9 @@ export default function Checkout() {
   const [createdOrder, setCreatedOrder] = useState(null);
   const [mpesaLoading, setMpesaLoading] = useState(false);
   const [mpesaSent, setMpesaSent] = useState(false);
+  // Reused across retries of the same attempt; rotated once the server has answered.
+  const orderKey = useRef(crypto.randomUUID());
+  const stkKey = useRef(crypto.randomUUID());
 
   const [form, setForm] = useState({
     full_name: '', email: '', phone: '', shipping_address: '',
@@ -39,10 +44,11 @@ export default function Checkout() {
       const order = await api.createOrder({
         ...form,
         mpesa_phone: form.mpesa_phone || form.phone,
-      });
+      }, orderKey.current);
       setCreatedOrder(order);
       setStep(2);
     } catch (err) {
+      if (!(err instanceof TypeError)) orderKey.current = crypto.randomUUID();
       showToast(err?.detail || 'Failed to create order', 'error');
     } finally {
       setLoading(false);
@@ -52,10 +58,24 @@ export default function Checkout() {
   const handleStkPush = async () => {
     setMpesaLoading(true);
     try {
-      await api.stkPush({ phone: form.mpesa_phone || form.phone, order_id: createdOrder.id });
+      let job = await api.stkPush({ phone: form.mpesa_phone || form.phone, order_id: createdOrder.id }, stkKey.current);
+      // The push is sent by a background worker; poll until it has gone out.
+      let attempts = 0;
+      while (job.status === 'queued' || job.status === 'processing') {
+        if (++attempts > STK_POLL_ATTEMPTS) {
+          // Keep stkKey: trying again resumes this job rather than sending a second push.
+          showToast('M-Pesa is taking longer than usual. Please try again in a moment.', 'error');
+          return;
+        }
+        await new Promise(resolve => setTimeout(resolve, STK_POLL_INTERVAL));
+        job = await api.getStkPushJob(job.job_id);
+      }
+      stkKey.current = crypto.randomUUID();
+      if (job.status !== 'sent') throw { error: job.error || 'Failed to initiate M-Pesa payment' };
       setMpesaSent(true);
       showToast('STK push sent! Check your phone to complete payment.', 'success');
     } catch (err) {
+      if (!(err instanceof TypeError)) stkKey.current = crypto.randomUUID();
       showToast(err?.error || 'Failed to initiate M-Pesa payment', 'error');
     } finally {
       setMpesaLoading(false);
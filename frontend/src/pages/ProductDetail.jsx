@@ -27,6 +27,8 @@ export default function ProductDetail() {
   const [qty, setQty] = useState(1);
   const [activeImg, setActiveImg] = useState(0);
   const [activeTab, setActiveTab] = useState('specs');
+  const [reviews, setReviews] = useState([]);
+  const [reviewsCursor, setReviewsCursor] = useState(null);
 
   useEffect(() => {
     async function load() {
@@ -39,6 +41,9 @@ export default function ProductDetail() {
         ]);
         if (prod.status === 'fulfilled') {
           setProduct(prod.value);
+          setReviews(prod.value.reviews || []);
+          // The detail payload embeds only the newest few reviews
+          setReviewsCursor(prod.value.review_count > (prod.value.reviews?.length || 0) ? '' : null);
           if (prod.value.variants?.length) setSelectedVariant(prod.value.variants[0]);
         }
         if (rel.status === 'fulfilled') setRelated(rel.value || []);
@@ -51,6 +56,16 @@ export default function ProductDetail() {
     load();
   }, [slug]);
 
+  async function loadMoreReviews() {
+    // First page repeats the embedded reviews, so skip any we already show
+    const page = await api.getReviews(slug, reviewsCursor || undefined);
+    setReviews(prev => {
+      const seen = new Set(prev.map(r => r.id));
+      return [...prev, ...page.results.filter(r => !seen.has(r.id))];
+    });
+    setReviewsCursor(page.next ? new URL(page.next).searchParams.get('cursor') : null);
+  }
+
   if (loading) return (
     <div className="container loading-center" style={{ paddingTop: '2rem', minHeight: '60vh' }}>
       <div className="spinner"></div>
@@ -159,8 +174,8 @@ export default function ProductDetail() {
                 {product.variants.map(v => (
                   <button
                     key={v.id}
-                    className={`variant-opt${selectedVariant?.id === v.id ? ' selected' : ''}${v.stock === 0 ? ' out-of-stock' : ''}`}
-                    onClick={() => v.stock > 0 && setSelectedVariant(v)}
+                    className={`variant-opt${selectedVariant?.id === v.id ? ' selected' : ''}${v.available <= 0 ? ' out-of-stock' : ''}`}
+                    onClick={() => v.available > 0 && setSelectedVariant(v)}
                   >
                     {v.name}
                   </button>
@@ -195,9 +210,9 @@ export default function ProductDetail() {
           {/* Stock */}
           {selectedVariant && (
             <div style={{ marginBottom: '1rem' }}>
-              {selectedVariant.stock > 0 ? (
+              {selectedVariant.available > 0 ? (
                 <span style={{ color: 'var(--primary)', fontWeight: 600, fontSize: '0.85rem' }}>
-                  <i className="bi bi-check-circle-fill"></i> In Stock ({selectedVariant.stock} available)
+                  <i className="bi bi-check-circle-fill"></i> In Stock ({selectedVariant.available} available)
                 </span>
               ) : (
                 <span style={{ color: 'var(--red)', fontWeight: 600, fontSize: '0.85rem' }}>
@@ -271,7 +286,7 @@ export default function ProductDetail() {
 
         {activeTab === 'reviews' && (
           <div>
-            {product.reviews?.length > 0 ? product.reviews.map(r => (
+            {reviews.length > 0 ? reviews.map(r => (
               <div key={r.id} style={{ padding: '1rem 0', borderBottom: '1px solid var(--border)' }}>
                 <div style={{ display: 'flex', alignItems: 'center', gap: '0.75rem', marginBottom: '0.4rem' }}>
                   <div style={{ width: 36, height: 36, borderRadius: '50%', background: 'var(--primary)', color: '#fff', display: 'flex', alignItems: 'center', justifyContent: 'center', fontWeight: 700, fontSize: '0.9rem' }}>
@@ -294,6 +309,11 @@ export default function ProductDetail() {
             )) : (
               <p style={{ color: 'var(--text-light)', padding: '1.5rem 0' }}>No reviews yet. Be the first!</p>
             )}
+            {reviewsCursor !== null && (
+              <button className="btn btn-outline" style={{ marginTop: '1rem' }} onClick={loadMoreReviews}>
+                Show more reviews
+              </button>
+            )}
           </div>
         )}
       </div>
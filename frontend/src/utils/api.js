@@ -87,6 +87,8 @@ const api = {
   getByCategory: (slug) => api.get(`/products/by_category/?slug=${slug}`).then(toArray),
   getByBrand: (slug) => api.get(`/products/by_brand/?slug=${slug}`).then(toArray),
   searchProducts: (q) => api.get(`/products/?search=${encodeURIComponent(q)}`),
+  // Cursor-paginated, newest first: { next, previous, results }
+  getReviews: (slug, cursor) => api.get(`/products/${slug}/reviews/${cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''}`),
 
   // Categories & Brands — always return arrays
   getCategories: () => api.get('/categories/').then(toArray),
@@ -96,6 +98,7 @@ const api = {
   // Banners — always return arrays
   getBanners: () => api.get('/banners/').then(toArray),
   getHeroBanners: () => api.get('/banners/hero/').then(toArray),
+  getPromoBanners: () => api.get('/banners/promo/').then(toArray),
 
   // Cart — returns a single cart object, not an array
   getCart: () => api.get('/cart/'),
@@ -105,17 +108,27 @@ const api = {
   clearCart: () => request('/cart/clear/', { method: 'DELETE' }),
 
   // Orders
-  createOrder: (data) => api.post('/orders/', data),
+  // Pass the same idempotencyKey when retrying so the server replays instead of re-running
+  createOrder: (data, idempotencyKey) => request('/orders/', {
+    method: 'POST', body: JSON.stringify(data),
+    headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {},
+  }),
   getOrders: () => api.get('/orders/').then(toArray),
   getOrder: (id) => api.get(`/orders/${id}/`),
 
   // M-Pesa
-  stkPush: (data) => api.post('/mpesa/stk-push/', data),
+  stkPush: (data, idempotencyKey) => request('/mpesa/stk-push/', {
+    method: 'POST', body: JSON.stringify(data),
+    headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {},
+  }),
+  getStkPushJob: (jobId) => api.get(`/mpesa/stk-push/${jobId}/`),
 
   // Wishlist
   getWishlist: () => api.get('/wishlist/').then(toArray),
   addToWishlist: (productId) => api.post('/wishlist/', { product_id: productId }),
   removeFromWishlist: (id) => api.delete(`/wishlist/${id}/`),
+  // { wishlist: '0110…', cart: '0010…' } — one character per id, in order
+  getMembership: (productIds) => api.post('/membership/', { product_ids: productIds }),
 
   // Recently Viewed
   getRecentlyViewed: () => api.get('/recently-viewed/').then(toArray),